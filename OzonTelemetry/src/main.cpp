@@ -547,13 +547,17 @@ void taskPush(void *pvParameters) {
                 // Determine event type
                 String event_trigger = "";
                 uint16_t count = 1;  // Always send 1 for each event
+                uint16_t total = 0;  // Cumulative counter, tells presses in the same second apart
 
                 if(trigger_basic) {
                     event_trigger = "BASIC";
+                    total = counter_basic;
                 } else if(trigger_standard) {
                     event_trigger = "STANDARD";
+                    total = counter_standard;
                 } else if(trigger_premium) {
                     event_trigger = "PREMIUM";
+                    total = counter_premium;
                 }
 
                 trigger_basic = false;
@@ -562,7 +566,7 @@ void taskPush(void *pvParameters) {
 
                 // Publish event via MQTT
                 if (mqtt_connected && event_trigger != "") {
-                    publish_event(event_trigger, count);
+                    publish_event(event_trigger, count, total);
                     Serial.println("Event published via MQTT: " + event_trigger);
                 } else if (event_trigger != "") {
                     Serial.println("MQTT not connected, skipping event: " + event_trigger);
@@ -1029,7 +1033,7 @@ void publish_status(void) {
     Serial.println("Published status: " + statusMessage);
 }
 
-void publish_event(String event_type, uint16_t count) {
+void publish_event(String event_type, uint16_t count, uint16_t total) {
     if (!mqtt_connected) return;
     
     // Create JSON event message
@@ -1039,7 +1043,8 @@ void publish_event(String event_type, uint16_t count) {
     eventMessage += "\"type\":\"event\",";
     eventMessage += "\"data\":{";
     eventMessage += "\"event_type\":\"" + event_type + "\",";
-    eventMessage += "\"count\":" + String(count);
+    eventMessage += "\"count\":" + String(count) + ",";
+    eventMessage += "\"total\":" + String(total);
     eventMessage += "}";
     eventMessage += "}";
     
@@ -131,7 +131,7 @@ void init_mqtt(void);
 void mqtt_reconnect(void);
 void mqtt_callback(char* topic, byte* payload, unsigned int length);
 void publish_status(void);
-void publish_event(String event_type, uint16_t count);
+void publish_event(String event_type, uint16_t count, uint16_t total);
 // void init_sd(void);  // commented out for now
 String get_timestamp(void);
 // void log_usage_event(String machine_type, uint16_t count);  // commented out for now
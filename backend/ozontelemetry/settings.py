@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'telemetry.middleware.MetricsMiddleware',  # first, so /metrics latencies cover the whole stack
+    'telemetry.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -75,13 +80,61 @@ WSGI_APPLICATION = 'ozontelemetry.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+#
+# Profile chosen from the environment: DB_ENGINE=sqlite (default) or
+# postgresql, with DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT and
+# DB_CONN_MAX_AGE. manage.py benchmark_db_profiles compares the profiles.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+# Seconds a connection is kept for the next request (0 closes it after each one)
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+
+# Applied to every new SQLite connection (telemetry.db_tuning). WAL lets
+# dashboard reads run alongside ingest writes, and busy_timeout makes a writer
+# wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,  # ms; first, so switching the journal mode waits too
+    # Lets retention purges return freed pages as they go. Takes effect on a
+    # new database file; switch an existing one with purge_telemetry --vacuum
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # safe in WAL mode; a power cut may lose the last commits
+    'cache_size': -20000,  # negative: KiB of page cache per connection
+    'mmap_size': 128 * 1024 * 1024,  # bytes
+    'temp_store': 'MEMORY',
+}
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # Tests use a file rather than the shared in-memory database, whose
+            # table locks ignore busy_timeout: concurrent ingest tests need the
+            # same WAL locking as production
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
     }
-}
+elif DB_ENGINE == 'postgresql':
+    # Requires psycopg (see requirements.txt)
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'ozontelemetry'),
+            'USER': os.environ.get('DB_USER', 'ozontelemetry'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            # Ping a reused connection before a request uses it, so one dropped
+            # by the server or a pooler fails over to a fresh connection
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"DB_ENGINE must be 'sqlite' or 'postgresql', not {DB_ENGINE!r}")
 
 
 # Password validation
@@ -132,6 +185,91 @@ MQTT_PASSWORD = ''  # Leave empty for public broker
 MQTT_TOPIC_STATUS = 'telemetry/status/'
 MQTT_TOPIC_EVENTS = 'telemetry/events/'
 MQTT_TOPIC_COMMANDS = 'telemetry/commands/'
+MQTT_WORKER_COUNT = 4  # DB worker threads; messages are sharded by device_id
+MQTT_WORKER_QUEUE_SIZE = 1000  # pending messages per worker before backpressure
+MQTT_WORKER_PUT_TIMEOUT = 10.0  # seconds to block the network thread before dropping (ozon_mqtt_dropped_total); None never drops
+MQTT_STATUS_FLUSH_INTERVAL = 2.0  # seconds; heartbeats are written per device at most this late
+MQTT_STATUS_MAX_PENDING = 10_000  # devices with unwritten heartbeats that trigger an early flush
+
+# Write-behind ingest for /api/iot/: queue validated readings in-process and
+# persist them in batches (bulk_create per table) on size or time.
+IOT_INGEST_BUFFERED = False
+IOT_INGEST_BUFFER_FLUSH_SIZE = 200  # readings per flush
+IOT_INGEST_BUFFER_FLUSH_INTERVAL = 1.0  # seconds
+IOT_INGEST_BUFFER_MAX_SIZE = 5000  # producers flush inline beyond this
+IOT_INGEST_BUFFER_MAX_RETRIES = 3  # failed flushes in a row before a batch is split to drop unwritable readings
+IOT_ASYNC_DB_WORKERS = 4  # database threads behind /api/iot/async/ under ASGI
+BULK_INGEST_CHUNK_SIZE = 5000  # readings per transaction for /api/iot/bulk/ and import_sd_log
+IDEMPOTENCY_RECENT_KEYS = 50_000  # trigger keys remembered in memory to reject resends without a query
+
+# Retention: days to keep each raw/rollup table (None keeps forever).
+# Purging events does not change DeviceStatus lifetime counters; running
+# update_device_counts afterwards would recount them from what is left.
+TELEMETRY_RETENTION_DAYS = {
+    'records': 30,  # TelemetryRecord, one per /api/iot/ request including heartbeats
+    'events': None,  # TelemetryEvent
+    'hourly': 400,  # HourlyUsage
+    'daily': None,  # UsageStatistics
+    'presence': 400,  # PresenceTransition
+}
+TELEMETRY_HEARTBEAT_DOWNSAMPLE_DAYS = 2  # older heartbeats keep one record per device per hour
+TELEMETRY_PURGE_BATCH_SIZE = 1000  # rows per delete transaction
+TELEMETRY_PURGE_PAUSE = 0.05  # seconds to yield between batches
+
+# Presence (telemetry.presence): a device goes offline PRESENCE_TIMEOUT seconds
+# after its last reading (or its entry in PRESENCE_DEVICE_TIMEOUTS, e.g.
+# {'3C:8A:1F:A4:3E:C4': 900}); online/offline transitions are recorded as
+# PresenceTransition rows. The online set is kept per process and resynced from
+# DeviceStatus every PRESENCE_SYNC_INTERVAL seconds, so transitions must be
+# recorded by exactly one process: start_mqtt records them (unless run with
+# --no-presence-transitions); without it, set PRESENCE_RECORD_TRANSITIONS=1 in
+# the environment of a single web worker.
+PRESENCE_TIMEOUT = 300
+PRESENCE_DEVICE_TIMEOUTS = {}
+PRESENCE_TICK = 1.0  # seconds per timing wheel slot (offline detection resolution)
+PRESENCE_SYNC_INTERVAL = 30.0
+PRESENCE_RECORD_TRANSITIONS = os.environ.get('PRESENCE_RECORD_TRANSITIONS', '0') == '1'
+
+# Opt-in profiling (telemetry.profiling): requests sent with "X-Profile: 1" or
+# sampled at PROFILING_SAMPLE_RATE, and MQTT messages sampled at
+# PROFILING_MQTT_SAMPLE_RATE, are captured (SQL with timings, cProfile) to
+# PROFILING_DIR; /api/profiles/ lists the slowest. Set PROFILING_ENABLED=1 to enable.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_MQTT_SAMPLE_RATE = float(os.environ.get('PROFILING_MQTT_SAMPLE_RATE', '0'))
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 200  # captures kept on disk, oldest removed first
+
+# Live push channel (/api/live/, server-sent events; needs an ASGI server)
+LIVE_SUBSCRIBER_QUEUE_SIZE = 100  # messages buffered per subscriber before it is told to resync
+LIVE_KEEPALIVE_SECONDS = 15  # comment line sent on idle streams to keep proxies from closing them
+
+# Fleet version (telemetry.versioning), the ETag of the polled fleet listings.
+# Ingest bumps it at most once per FLEET_VERSION_BUMP_INTERVAL seconds, after
+# commit; heartbeats that only refresh last_seen/uptime do not bump it, so
+# listing ETags and the fleet snapshot index expire after FLEET_LIVENESS_REFRESH
+FLEET_VERSION_BUMP_INTERVAL = 0.5
+FLEET_LIVENESS_REFRESH = 60
+
+# Caches. "fleet" holds the fleet status snapshot (telemetry.fleet_cache): one
+# entry per device, expiring after TIMEOUT seconds. Locmem is per process; for
+# a snapshot shared with start_mqtt use a file or Redis backend, e.g.
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379/1',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fleet': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fleet-status',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# In-process LRU of /api/events/analytics/ responses, bounded by approximate JSON size
+ANALYTICS_CACHE_MAX_BYTES = 32 * 1024 * 1024
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -18,7 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 from rest_framework.routers import DefaultRouter
-from telemetry.views import TelemetryViewSet, TelemetryEventViewSet, DeviceStatusViewSet, OutletViewSet, MachineViewSet, iot_ingest, export_data, flush_all_data
+from telemetry.views import TelemetryViewSet, TelemetryEventViewSet, DeviceStatusViewSet, OutletViewSet, MachineViewSet, iot_ingest, iot_ingest_async, iot_bulk_ingest, export_data, export_columnar, flush_all_data, live_stream, metrics, profiles, profile_detail
 
 router = DefaultRouter()
 router.register(r'telemetry', TelemetryViewSet, basename='telemetry')
@@ -32,6 +32,13 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/iot/', iot_ingest),
+    path('api/iot/async/', iot_ingest_async),
+    path('api/iot/bulk/', iot_bulk_ingest),
     path('api/export/', export_data),
+    path('api/export/columnar/', export_columnar),
     path('api/flush/', flush_all_data),
+    path('api/live/', live_stream),
+    path('metrics', metrics),
+    path('api/profiles/', profiles),
+    path('api/profiles/<str:profile_id>/', profile_detail),
 ]
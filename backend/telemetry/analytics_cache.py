@@ -0,0 +1,60 @@
+"""In-process LRU of ``/api/events/analytics/`` responses.
+
+Keys include the device's event generation (see
+``versioning.device_counter``), which every ingest path bumps when a new
+event for the device lands, so entries never need explicit invalidation: a
+new event makes the old key unreachable and LRU eviction reclaims it. The
+cache is bounded by the approximate size of the JSON it holds.
+"""
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class AnalyticsCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or getattr(settings, "ANALYTICS_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        self._entries = OrderedDict()  # key -> (data, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def put(self, key, data):
+        size = len(json.dumps(data, cls=DjangoJSONEncoder))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (data, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+# Global cache instance
+analytics_cache = AnalyticsCache()
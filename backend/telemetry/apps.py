@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TelemetryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'telemetry'
+
+    def ready(self):
+        from . import versioning, fleet_cache, db_tuning  # noqa: F401  connect their signals
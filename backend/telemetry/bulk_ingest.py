@@ -0,0 +1,162 @@
+"""Bulk backfill of readings (``/api/iot/bulk/`` and ``manage.py import_sd_log``).
+
+Payloads are parsed and written in chunks of ``BULK_INGEST_CHUNK_SIZE``,
+one transaction per chunk. Triggers already stored as events (the same
+idempotency key, or for readings without one the same device, type and
+device timestamp) are dropped, the rest go in with one bulk_create per table, and daily/hourly statistics and
+device counters are added with one aggregated upsert each. Backfilled
+readings only add history: current counts and flags are left to the
+device's live readings, ``last_seen`` only moves up to the newest
+backfilled reading (an old log never marks a device online), and nothing is
+pushed to live subscribers.
+"""
+import csv
+import json
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from .ingest_buffer import parse_iot_reading, parse_device_timestamp, build_record_payload, build_event_fields
+from .models import TelemetryRecord, TelemetryEvent, DeviceStatus
+from .upserts import upsert_device_statuses, upsert_daily_statistics, daily_totals, upsert_hourly_usage, hourly_totals
+from .versioning import bump_device_generations, fleet_changed
+
+EVENT_TYPES = ("BASIC", "STANDARD", "PREMIUM")
+
+# Header and counter column of the firmware's SD-card usage log
+SD_LOG_HEADER = ["timestamp", "machine_type", "count", "device_mac"]
+SD_COUNT_FIELDS = {"BASIC": "count1", "STANDARD": "count2", "PREMIUM": "count3"}
+
+
+def _text(lines):
+    for line in lines:
+        yield line.decode("utf-8-sig") if isinstance(line, bytes) else line
+
+
+def ndjson_payloads(lines):
+    """Payload dicts from NDJSON lines; a malformed line yields None"""
+    for line in _text(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            payload = None
+        yield payload if isinstance(payload, dict) else None
+
+
+def csv_payloads(lines):
+    """Payload dicts from CSV lines whose header row names the ``iot_ingest`` fields"""
+    yield from csv.DictReader(_text(lines))
+
+
+def sd_log_payloads(lines, device_id=None):
+    """Payload dicts from an SD-card usage log (``Timestamp,Machine_Type,Count,Device_MAC``).
+
+    ``device_id`` overrides the MAC column. Rows logged without a working
+    RTC cannot be placed in time and yield None.
+    """
+    reader = csv.reader(_text(lines))
+    header = next(reader, None)
+    if header is None:
+        return
+    if [column.strip().lower() for column in header] != SD_LOG_HEADER:
+        raise ValueError(f"Not an SD-card usage log header: {','.join(header)}")
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != len(SD_LOG_HEADER):
+            yield None
+            continue
+        timestamp, machine_type, count, mac = (value.strip() for value in row)
+        if machine_type not in SD_COUNT_FIELDS:
+            yield None
+            continue
+        yield {"macaddr": device_id or mac, "mode": machine_type, "timestamp": timestamp, SD_COUNT_FIELDS[machine_type]: count}
+
+
+def import_payloads(payloads, chunk_size=None):
+    """Store an iterable of ``iot_ingest`` payload dicts and return the totals.
+
+    Payloads without a device or a parseable device timestamp (or None
+    items) count as ``invalid``; heartbeats carry no history and count as
+    ``ignored``.
+    """
+    chunk_size = chunk_size or getattr(settings, "BULK_INGEST_CHUNK_SIZE", 5000)
+    totals = {"received": 0, "created": 0, "duplicates": 0, "invalid": 0, "ignored": 0}
+    payloads = iter(payloads)
+    while chunk := list(islice(payloads, chunk_size)):
+        totals["received"] += len(chunk)
+        readings = []
+        for payload in chunk:
+            reading = parse_iot_reading(payload) if payload else None
+            if reading is None or parse_device_timestamp(reading["device_timestamp"]) is None:
+                totals["invalid"] += 1
+            elif reading["event_type"] == "status":
+                totals["ignored"] += 1
+            else:
+                readings.append(reading)
+        if readings:
+            created = _write_chunk(readings)
+            totals["created"] += created
+            totals["duplicates"] += len(readings) - created
+    return totals
+
+
+def _write_chunk(readings):
+    device_ids = {r["device_id"] for r in readings}
+    times = [r["occurred_at"] for r in readings]
+    with transaction.atomic():
+        # A write comes first so the transaction takes the write lock (or, on
+        # PostgreSQL, the device counter rows) up front: concurrent uploads of
+        # the same log wait here instead of both passing the duplicate check
+        bump_device_generations(device_ids)
+        seen = set(
+            TelemetryEvent.objects.filter(
+                device_id__in=device_ids, event_type__in=EVENT_TYPES, occurred_at__range=(min(times), max(times))
+            ).values_list("device_id", "event_type", "occurred_at")
+        )
+        # Live triggers are stored at server time, so the same press coming
+        # back from an SD log is only recognised by its idempotency key
+        event_fields = {id(r): build_event_fields(r) for r in readings}
+        stored_keys = set(
+            TelemetryEvent.objects.filter(
+                idempotency_key__in=[fields["idempotency_key"] for fields in event_fields.values()]
+            ).values_list("idempotency_key", flat=True)
+        )
+        new = []
+        for r in readings:
+            idempotency_key = event_fields[id(r)]["idempotency_key"]
+            if idempotency_key is not None:
+                # Keyed triggers differ by cumulative count, so presses in the
+                # same second are kept
+                if idempotency_key in stored_keys:
+                    continue
+                stored_keys.add(idempotency_key)
+            else:
+                key = (r["device_id"], r["event_type"], r["occurred_at"])
+                if key in seen:
+                    continue
+                seen.add(key)
+            new.append(r)
+        if not new:
+            return 0
+
+        TelemetryRecord.objects.bulk_create(
+            [TelemetryRecord(device_id=r["device_id"], payload=build_record_payload(r)) for r in new]
+        )
+        TelemetryEvent.objects.bulk_create([TelemetryEvent(**event_fields[id(r)]) for r in new])
+        keys = [(r["device_id"], r["event_type"], r["occurred_at"]) for r in new]
+        upsert_daily_statistics(daily_totals(keys))
+        upsert_hourly_usage(hourly_totals(keys))
+        counts = {}
+        seen_at = {}
+        for device_id, event_type, occurred_at in keys:
+            device_counts = counts.setdefault(device_id, {})
+            device_counts[event_type] = device_counts.get(event_type, 0) + 1
+            seen_at[device_id] = max(seen_at.get(device_id, occurred_at), occurred_at)
+        upsert_device_statuses(
+            [DeviceStatus(device_id=device_id) for device_id in counts], counts=counts, seen_at=seen_at
+        )
+        fleet_changed()
+    return len(new)
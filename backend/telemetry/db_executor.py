@@ -0,0 +1,37 @@
+"""Bounded thread pool for running ORM work from async views.
+
+Each worker thread keeps its own database connection, so an ASGI process can
+hold thousands of open device connections while touching the database from
+only ``IOT_ASYNC_DB_WORKERS`` threads.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class DatabaseExecutor:
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(settings, "IOT_ASYNC_DB_WORKERS", 4)
+        self._pool = None
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` on a database thread and return its result"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="db-executor")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(self._call, func, *args))
+
+    @staticmethod
+    def _call(func, *args):
+        # Same connection housekeeping as a request cycle (honours CONN_MAX_AGE)
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+
+
+# Global executor instance
+db_executor = DatabaseExecutor()
@@ -0,0 +1,17 @@
+"""Per-connection database tuning.
+
+Every new SQLite connection gets ``settings.SQLITE_PRAGMAS``. Persistent
+connections (CONN_MAX_AGE) pay for this once rather than per request.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,276 @@
+import csv
+import zlib
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import TelemetryEvent, UsageStatistics, MachineDevice
+
+# Rows fetched per database round trip while streaming
+EXPORT_CHUNK_SIZE = 2000
+# Approximate bytes of CSV text buffered before a chunk is yielded
+EXPORT_FLUSH_BYTES = 64 * 1024
+# Rows per Arrow record batch / Parquet row group in columnar exports
+COLUMNAR_BATCH_ROWS = 50_000
+
+EVENT_EXPORT_FIELDS = [
+    'device_id',
+    'occurred_at',
+    'device_timestamp',
+    'event_type',
+    'count_basic',
+    'count_standard',
+    'count_premium',
+    'wifi_status',
+]
+
+
+def export_scope(params):
+    """Resolve the export scope from ``device_id``, ``outlet_id`` or ``device_ids``.
+
+    An outlet includes every device ever assigned to its machines, so the
+    export covers their full history. Returns ``(label, devices)`` where
+    ``devices`` is a list or subquery usable with ``device_id__in``, or
+    ``(None, None)`` if no scope was given.
+    """
+    device_id = params.get("device_id")
+    outlet_id = params.get("outlet_id")
+    device_ids = params.get("device_ids")
+    if device_id:
+        return device_id, [device_id]
+    if outlet_id:
+        devices = MachineDevice.objects.filter(machine__outlet_id=outlet_id).values('device_id')
+        return f"outlet_{outlet_id}", devices
+    if device_ids:
+        devices = [d for d in device_ids.split(",") if d]
+        if devices:
+            return "devices", devices
+    return None, None
+
+
+def export_events(devices, days):
+    """Queryset of raw event tuples for ``devices`` over the last ``days``"""
+    end_date = timezone.now()
+    start_date = end_date - timedelta(days=days)
+    events = TelemetryEvent.objects.filter(
+        device_id__in=devices,
+        occurred_at__gte=start_date,
+        occurred_at__lte=end_date
+    ).order_by('occurred_at', 'id').values_list(*EVENT_EXPORT_FIELDS)
+    return events, start_date, end_date
+
+
+class _LineBuffer:
+    """File-like sink for csv.writer that collects written text"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, value):
+        self.parts.append(value)
+        self.size += len(value)
+
+    def drain(self):
+        data = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def stream_events_csv(events, include_device=False):
+    """Yield the event CSV as encoded chunks without materialising the rows"""
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    header = ['Timestamp', 'Device Timestamp', 'Event Type', 'Basic Count', 'Standard Count', 'Premium Count', 'WiFi Status']
+    writer.writerow(['Device ID'] + header if include_device else header)
+
+    for device_id, occurred_at, device_timestamp, event_type, basic, standard, premium, wifi_status in events.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = [
+            occurred_at.isoformat(),
+            device_timestamp or '',
+            event_type,
+            basic or 0,
+            standard or 0,
+            premium or 0,
+            'Connected' if wifi_status else 'Disconnected'
+        ]
+        writer.writerow([device_id] + row if include_device else row)
+        if buffer.size >= EXPORT_FLUSH_BYTES:
+            yield buffer.drain().encode()
+    yield buffer.drain().encode()
+
+
+def gzip_stream(chunks, level=6):
+    """Gzip-compress an iterable of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Columnar (Parquet / Arrow IPC) exports. pyarrow is an optional dependency.
+
+COLUMNAR_TABLES = ('events', 'daily')
+COLUMNAR_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+DAILY_EXPORT_FIELDS = [
+    'device_id',
+    'date',
+    'basic_count',
+    'standard_count',
+    'premium_count',
+    'total_events',
+    'first_event',
+    'last_event',
+]
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_export_range(params):
+    """Resolve ``start``/``end`` (ISO date or datetime) or ``days`` into datetimes"""
+    end_date = _parse_bound(params.get("end"), end=True) or timezone.now()
+    start_date = _parse_bound(params.get("start"))
+    if start_date is None:
+        start_date = end_date - timedelta(days=int(params.get("days", 30)))
+    return start_date, end_date
+
+
+def _parse_bound(value, end=False):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"invalid date: {value}")
+        parsed = datetime.combine(day, time.max if end else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def columnar_rows(table, devices, start_date, end_date):
+    """Ordered tuples for a columnar export of ``table``"""
+    if table == 'events':
+        rows = TelemetryEvent.objects.filter(
+            occurred_at__gte=start_date,
+            occurred_at__lte=end_date
+        ).order_by('occurred_at', 'id').values_list(*EVENT_EXPORT_FIELDS)
+    elif table == 'daily':
+        rows = UsageStatistics.objects.filter(
+            date__gte=start_date.date(),
+            date__lte=end_date.date()
+        ).order_by('date', 'device_id').values_list(*DAILY_EXPORT_FIELDS)
+    else:
+        raise ValueError(f"unknown table: {table}")
+    if devices is not None:
+        rows = rows.filter(device_id__in=devices)
+    return rows
+
+
+def _columnar_schema(pa, table):
+    category = pa.dictionary(pa.int32(), pa.string())
+    timestamp = pa.timestamp('us', tz='UTC')
+    if table == 'events':
+        return pa.schema([
+            ('device_id', category),
+            ('occurred_at', timestamp),
+            ('device_timestamp', pa.string()),
+            ('event_type', category),
+            ('count_basic', pa.int32()),
+            ('count_standard', pa.int32()),
+            ('count_premium', pa.int32()),
+            ('wifi_status', pa.bool_()),
+        ])
+    return pa.schema([
+        ('device_id', category),
+        ('date', pa.date32()),
+        ('basic_count', pa.int32()),
+        ('standard_count', pa.int32()),
+        ('premium_count', pa.int32()),
+        ('total_events', pa.int32()),
+        ('first_event', timestamp),
+        ('last_event', timestamp),
+    ])
+
+
+def _record_batch(pa, schema, columns):
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            continue
+        try:
+            arrays.append(pa.array(values, field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Legacy rows can hold floats in integer columns
+            arrays.append(pa.array(values).cast(field.type, safe=False))
+    return pa.record_batch(arrays, schema=schema)
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the caller"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_columnar(rows, table, fmt='parquet', batch_rows=COLUMNAR_BATCH_ROWS):
+    """Yield a Parquet file or Arrow IPC stream built batch by batch from ``rows``"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _columnar_schema(pa, table)
+    sink = _ChunkSink()
+    target = pa.PythonFile(sink, mode='w')
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(target, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(target, schema)
+
+    columns = [[] for _ in schema]
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        for column, value in zip(columns, row):
+            column.append(value)
+        if len(columns[0]) >= batch_rows:
+            writer.write_batch(_record_batch(pa, schema, columns))
+            columns = [[] for _ in schema]
+            yield sink.drain()
+    if columns[0]:
+        writer.write_batch(_record_batch(pa, schema, columns))
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,136 @@
+"""Fleet status snapshot in the Django cache (the ``fleet`` cache alias).
+
+Each device's serialized DeviceStatus is one cache entry, and an index entry
+lists every device id together with the fleet version it is current for.
+DeviceStatus upserts write their rows through once the transaction commits
+and each fleet version bump advances the index, so a busy process keeps
+serving from the snapshot. A reader that finds the index behind the fleet
+version (e.g. after writes from ``start_mqtt`` in another process with a
+per-process cache), or older than FLEET_LIVENESS_REFRESH seconds (heartbeats
+do not bump the version), reloads the whole fleet in one query. Entries
+expire after the cache TIMEOUT and the backend bounds the entry count.
+"""
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import DeviceStatus
+
+INDEX_KEY = "fleet:index"
+
+
+def _device_key(device_id):
+    return f"fleet:device:{device_id}"
+
+
+def _serialize(device):
+    from .serializers import DeviceStatusSerializer  # serializers read the snapshot too
+    return dict(DeviceStatusSerializer(device).data)
+
+
+class FleetStatusCache:
+    def __init__(self, alias="fleet"):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "partial_misses": 0, "writes": 0}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def devices(self):
+        """Serialized DeviceStatus of every device"""
+        device_ids, loaded = self._index()
+        return list(self._entries(device_ids, loaded).values())
+
+    def get_many(self, device_ids):
+        """``{device_id: serialized DeviceStatus}`` for the known devices among ``device_ids``"""
+        known, loaded = self._index()
+        known = set(known)
+        return self._entries([d for d in device_ids if d in known], loaded)
+
+    def peek(self, device_ids):
+        """``{device_id: serialized DeviceStatus}`` of the cached entries, without touching the database"""
+        entries = self.cache.get_many([_device_key(d) for d in device_ids])
+        return {data["device_id"]: data for data in entries.values()}
+
+    def store(self, devices):
+        """Write freshly saved DeviceStatus rows through to the snapshot"""
+        if not devices:
+            return
+        self.cache.set_many({_device_key(d.device_id): _serialize(d) for d in devices})
+        index = self.cache.get(INDEX_KEY)
+        if index is not None:
+            new_ids = {d.device_id for d in devices}.difference(index["ids"])
+            if new_ids:
+                index["ids"] = [*index["ids"], *new_ids]
+                self.cache.set(INDEX_KEY, index)
+        self._count("writes", len(devices))
+
+    def advance(self, version):
+        """Mark the snapshot current for ``version`` if it was current for the one before"""
+        index = self.cache.get(INDEX_KEY)
+        if index is not None and index["version"] == version - 1:
+            index["version"] = version
+            self.cache.set(INDEX_KEY, index)
+
+    def invalidate(self, device_id):
+        self.cache.delete(_device_key(device_id))
+
+    def clear(self):
+        """Force the next read to reload the whole fleet"""
+        self.cache.delete(INDEX_KEY)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"] + counters["partial_misses"]
+        counters["hit_ratio"] = round(counters["hits"] / lookups, 3) if lookups else None
+        return counters
+
+    def _index(self):
+        # Returns (device_ids, loaded) where ``loaded`` holds the entries when
+        # the fleet had to be reloaded from the database
+        from .versioning import current_version  # versioning -> upserts -> this module
+        version, _ = current_version()
+        index = self.cache.get(INDEX_KEY)
+        max_age = getattr(settings, "FLEET_LIVENESS_REFRESH", 60)
+        if index is not None and index["version"] == version and time.time() - index["loaded_at"] < max_age:
+            return index["ids"], None
+        self._count("misses")
+        loaded = {d.device_id: _serialize(d) for d in DeviceStatus.objects.all()}
+        self.cache.set_many({_device_key(device_id): data for device_id, data in loaded.items()})
+        self.cache.set(INDEX_KEY, {"version": version, "ids": list(loaded), "loaded_at": time.time()})
+        return list(loaded), loaded
+
+    def _entries(self, device_ids, loaded):
+        if loaded is not None:
+            return {d: loaded[d] for d in device_ids if d in loaded}
+        keys = {_device_key(d): d for d in device_ids}
+        entries = {keys[key]: data for key, data in self.cache.get_many(list(keys)).items()}
+        missing = [d for d in device_ids if d not in entries]
+        if not missing:
+            self._count("hits")
+            return entries
+        # Some entries expired or were evicted: load just those
+        self._count("partial_misses")
+        reloaded = {d.device_id: _serialize(d) for d in DeviceStatus.objects.filter(device_id__in=missing)}
+        self.cache.set_many({_device_key(device_id): data for device_id, data in reloaded.items()})
+        entries.update(reloaded)
+        return entries
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+
+@receiver([post_save, post_delete], sender=DeviceStatus)
+def _device_status_changed(sender, instance, **kwargs):
+    # Saves outside the upsert path (admin, scripts) drop the cached entry
+    fleet_status.invalidate(instance.device_id)
+
+
+# Global snapshot instance
+fleet_status = FleetStatusCache()
@@ -0,0 +1,65 @@
+"""Idempotency keys for device triggers.
+
+Devices resend a trigger when they get no HTTP 200 or MQTT ack. The resend
+repeats the device timestamp and the cumulative counter, so the hash of
+(device, device timestamp, event type, count) identifies the trigger. The
+key is stored on TelemetryEvent under a unique index, which is the
+authority; ``recent_event_keys`` remembers the latest keys so most resends
+are rejected without a database round trip.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+def event_key(device_id, device_timestamp, event_type, count):
+    """Idempotency key of a trigger, or None without a device timestamp to tell presses apart"""
+    if not device_timestamp:
+        return None
+    raw = f"{device_id}|{device_timestamp}|{event_type}|{count}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+class RecentKeys:
+    """Bounded LRU set of recently stored idempotency keys"""
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys or getattr(settings, "IDEMPOTENCY_RECENT_KEYS", 50_000)
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def seen(self, key):
+        """Whether ``key`` was stored recently (None never was)"""
+        if key is None:
+            return False
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.counters["hits"] += 1
+                return True
+            self.counters["misses"] += 1
+            return False
+
+    def add(self, *keys):
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "keys": len(self._keys), "max_keys": self.max_keys}
+
+
+# Global recent-keys instance
+recent_event_keys = RecentKeys()
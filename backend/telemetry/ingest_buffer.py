@@ -0,0 +1,383 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from .models import TelemetryRecord, TelemetryEvent, DeviceStatus
+from .upserts import upsert_device_statuses, upsert_daily_statistics, daily_totals, upsert_hourly_usage, hourly_totals
+from .versioning import bump_device_generations, fleet_changed, status_changes_listing
+from .live import publish_status, publish_event
+from .idempotency import event_key, recent_event_keys
+
+logger = logging.getLogger(__name__)
+
+# Reading field holding the device's cumulative counter for each trigger type
+EVENT_COUNT_FIELDS = {"BASIC": "count1", "STANDARD": "count2", "PREMIUM": "count3"}
+
+# Longest device identifier and device timestamp the tables can store
+MAX_DEVICE_ID_LENGTH = DeviceStatus._meta.get_field("device_id").max_length
+MAX_TIMESTAMP_LENGTH = TelemetryEvent._meta.get_field("device_timestamp").max_length
+INVALID_READING = (
+    f"macaddr required (at most {MAX_DEVICE_ID_LENGTH} characters); timestamp at most {MAX_TIMESTAMP_LENGTH} characters"
+)
+
+
+def parse_iot_reading(data):
+    """Validate an ESP32 payload and normalise it into a reading dict.
+
+    Returns None when the payload has no device identifier, or its
+    identifier or timestamp is too long to store (see INVALID_READING):
+    accepted readings must never fail a batched write.
+    """
+    macaddr = data.get("macaddr")
+    if not macaddr or len(str(macaddr)) > MAX_DEVICE_ID_LENGTH:
+        return None
+
+    mode = data.get("mode")
+    device_timestamp = data.get("timestamp")
+    if device_timestamp is not None and len(str(device_timestamp)) > MAX_TIMESTAMP_LENGTH:
+        return None
+    rtc_available_raw = data.get("rtc_available", None)
+    sd_available_raw = data.get("sd_available", None)
+
+    # Parse device timestamp if provided
+    occurred_at = timezone.now()
+    if device_timestamp:
+        parsed = parse_device_timestamp(device_timestamp)
+        if parsed:
+            occurred_at = parsed
+
+    return {
+        "device_id": str(macaddr),
+        "mode": mode,
+        # Determine event type (status = heartbeat)
+        "event_type": mode if mode in {"BASIC", "STANDARD", "PREMIUM", "status"} else "status",
+        "type1": _safe_number(data.get("type1")),
+        "type2": _safe_number(data.get("type2")),
+        "type3": _safe_number(data.get("type3")),
+        "count1": _safe_number(data.get("count1")),
+        "count2": _safe_number(data.get("count2")),
+        "count3": _safe_number(data.get("count3")),
+        "device_timestamp": device_timestamp,
+        "occurred_at": occurred_at,
+        "rtc_available": None if rtc_available_raw is None else str(rtc_available_raw).lower() == "true",
+        "sd_available": None if sd_available_raw is None else str(sd_available_raw).lower() == "true",
+    }
+
+
+def parse_device_timestamp(value):
+    """Parse ESP32 device timestamp format: '2024-01-15 14:30:25'"""
+    try:
+        if not value:
+            return None
+        # ESP32 format: "2024-01-15 14:30:25" - Now synced with NTP (Kuala Lumpur time)
+        dt = datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+        return timezone.make_aware(dt)
+    except Exception:
+        return None
+
+
+def _safe_number(value):
+    try:
+        if value is None:
+            return None
+        # try int first, then float
+        iv = int(str(value))
+        return iv
+    except Exception:
+        try:
+            fv = float(str(value))
+            return fv
+        except Exception:
+            return None
+
+
+def build_record_payload(reading):
+    """TelemetryRecord.payload for a parsed ESP32 reading"""
+    return {
+        "mode": reading["mode"],
+        "type1": reading["type1"],
+        "type2": reading["type2"],
+        "type3": reading["type3"],
+        "count1": reading["count1"],
+        "count2": reading["count2"],
+        "count3": reading["count3"],
+        "timestamp": reading["device_timestamp"],
+    }
+
+
+def reading_event_key(reading):
+    """Idempotency key of a parsed trigger reading (None for heartbeats)"""
+    field = EVENT_COUNT_FIELDS.get(reading["event_type"])
+    if field is None:
+        return None
+    return event_key(reading["device_id"], reading["device_timestamp"], reading["event_type"], reading[field])
+
+
+def build_event_fields(reading):
+    """TelemetryEvent field values for a parsed ESP32 trigger reading"""
+    return {
+        "device_id": reading["device_id"],
+        "event_type": reading["event_type"],
+        "count_basic": reading["count1"],
+        "count_standard": reading["count2"],
+        "count_premium": reading["count3"],
+        "occurred_at": reading["occurred_at"],
+        "device_timestamp": reading["device_timestamp"],
+        "wifi_status": True,
+        "payload": {
+            "type1": reading["type1"],
+            "type2": reading["type2"],
+            "type3": reading["type3"],
+        },
+        "idempotency_key": reading_event_key(reading),
+    }
+
+
+def write_readings(readings):
+    """Persist a batch of parsed readings in one transaction.
+
+    One bulk_create per table, with DeviceStatus, UsageStatistics and
+    HourlyUsage updates coalesced per device, day and hour into
+    single-statement upserts.
+    """
+    if not readings:
+        return
+    event_fields = {id(r): build_event_fields(r) for r in readings if r["event_type"] != "status"}
+    with transaction.atomic():
+        if event_fields:
+            # A write comes first so the transaction takes the write lock
+            # before the duplicate check
+            bump_device_generations([r["device_id"] for r in readings if id(r) in event_fields])
+            readings = _drop_duplicates(readings, event_fields)
+        events = [r for r in readings if id(r) in event_fields]
+        TelemetryRecord.objects.bulk_create(
+            [TelemetryRecord(device_id=r["device_id"], payload=build_record_payload(r)) for r in readings]
+        )
+        if events:
+            TelemetryEvent.objects.bulk_create([TelemetryEvent(**event_fields[id(r)]) for r in events])
+        statuses = _write_device_status(readings)
+        _write_daily_statistics(events)
+        if events or status_changes_listing(statuses):
+            fleet_changed()
+    recent_event_keys.add(*(event_fields[id(r)]["idempotency_key"] for r in events))
+    _publish(readings, events)
+
+
+def _drop_duplicates(readings, event_fields):
+    # Resent triggers: keys already stored, or repeated within the batch
+    keys = [fields["idempotency_key"] for fields in event_fields.values() if fields["idempotency_key"]]
+    stored = set(TelemetryEvent.objects.filter(idempotency_key__in=keys).values_list("idempotency_key", flat=True))
+    kept = []
+    for r in readings:
+        key = event_fields[id(r)]["idempotency_key"] if id(r) in event_fields else None
+        if key is not None:
+            if key in stored:
+                continue
+            stored.add(key)
+        kept.append(r)
+    return kept
+
+
+def _write_device_status(readings):
+    # Last write wins per device; rtc/sd flags only change when a reading carries them.
+    # Returns the values written, by device
+    latest = {}
+    event_counts = {}
+    for r in readings:
+        if r["event_type"] != "status":
+            device_counts = event_counts.setdefault(r["device_id"], {})
+            device_counts[r["event_type"]] = device_counts.get(r["event_type"], 0) + 1
+        state = latest.setdefault(r["device_id"], {"rtc_available": None, "sd_available": None})
+        state["count1"] = r["count1"]
+        state["count2"] = r["count2"]
+        state["count3"] = r["count3"]
+        state["device_timestamp"] = r["device_timestamp"]
+        if r["rtc_available"] is not None:
+            state["rtc_available"] = r["rtc_available"]
+        if r["sd_available"] is not None:
+            state["sd_available"] = r["sd_available"]
+
+    # One upsert per combination of flags present in the batch
+    groups = {}
+    written = {}
+    for device_id, state in latest.items():
+        values = {
+            "wifi_connected": True,
+            "current_count_basic": state["count1"] or 0,
+            "current_count_standard": state["count2"] or 0,
+            "current_count_premium": state["count3"] or 0,
+            "device_timestamp": state["device_timestamp"],
+        }
+        if state["rtc_available"] is not None:
+            values["rtc_available"] = state["rtc_available"]
+        if state["sd_available"] is not None:
+            values["sd_card_available"] = state["sd_available"]
+        groups.setdefault(tuple(values), []).append(DeviceStatus(device_id=device_id, **values))
+        written[device_id] = values
+    for update_fields, objs in groups.items():
+        upsert_device_statuses(objs, update_fields=update_fields, counts=event_counts)
+    return written
+
+
+def _write_daily_statistics(events):
+    keys = [(r["device_id"], r["event_type"], r["occurred_at"]) for r in events]
+    upsert_daily_statistics(daily_totals(keys))
+    upsert_hourly_usage(hourly_totals(keys))
+
+
+def _publish(readings, events):
+    # One status delta per device from its latest reading, then every new event
+    now = timezone.now()
+    latest = {r["device_id"]: r for r in readings}
+    for device_id, r in latest.items():
+        values = {"wifi_connected": True, "device_timestamp": r["device_timestamp"]}
+        if r["rtc_available"] is not None:
+            values["rtc_available"] = r["rtc_available"]
+        if r["sd_available"] is not None:
+            values["sd_card_available"] = r["sd_available"]
+        publish_status(device_id, values, now)
+    for r in events:
+        publish_event(build_event_fields(r))
+
+
+class IngestBuffer:
+    """Bounded in-process write-behind buffer for ``iot_ingest``.
+
+    Readings are flushed by a background thread once ``flush_size`` readings
+    are pending or ``flush_interval`` seconds have passed. When the buffer
+    holds ``max_size`` readings the caller flushes inline, so producers slow
+    down instead of dropping data; if that flush fails the reading is refused
+    (``add`` returns False). A failed flush keeps its readings for the next
+    attempt. Every ``max_retries`` failures in a row the batch is written in
+    halves down to single readings: if some of it goes in, the readings that
+    still fail are bad data rather than a database outage, and are logged and
+    dropped (dead-lettered) so they cannot block the buffer. Pending readings
+    are flushed at interpreter exit.
+    """
+
+    def __init__(self, flush_size=None, flush_interval=None, max_size=None, max_retries=None):
+        self.flush_size = flush_size or getattr(settings, "IOT_INGEST_BUFFER_FLUSH_SIZE", 200)
+        self.flush_interval = flush_interval or getattr(settings, "IOT_INGEST_BUFFER_FLUSH_INTERVAL", 1.0)
+        self.max_size = max_size or getattr(settings, "IOT_INGEST_BUFFER_MAX_SIZE", 5000)
+        self.max_retries = max_retries or getattr(settings, "IOT_INGEST_BUFFER_MAX_RETRIES", 3)
+        self._pending = []
+        self._failures = 0  # failed flushes in a row
+        self.counters = {"failed_flushes": 0, "dead_lettered": 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start the background flush thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="iot-ingest-flush", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def add(self, reading):
+        """Queue a parsed reading, flushing inline if the buffer is full.
+
+        Returns False if the buffer is full and could not be flushed.
+        """
+        if self._thread is None:
+            self.start()
+        while True:
+            with self._lock:
+                if len(self._pending) < self.max_size:
+                    self._pending.append(reading)
+                    pending = len(self._pending)
+                    break
+            if not self.flush() and len(self._pending) >= self.max_size:
+                return False
+        if pending >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write all pending readings; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                write_readings(batch)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} buffered readings: {e}")
+                self._failures += 1
+                self.counters["failed_flushes"] += 1
+                if self._failures % self.max_retries == 0:
+                    written, rejected = self._write_split(batch)
+                    if written:
+                        self._failures = 0
+                        for reading, error in rejected:
+                            logger.error(f"Dropped a buffered reading that cannot be written ({error}): {reading}")
+                        self.counters["dead_lettered"] += len(rejected)
+                        return written
+                with self._lock:
+                    # Put the batch back in front of newer readings; add() refuses
+                    # new ones while the buffer is over its bound
+                    self._pending = batch + self._pending
+                return 0
+            self._failures = 0
+            logger.debug(f"Flushed {len(batch)} buffered readings")
+            return len(batch)
+
+    def _write_split(self, batch):
+        # Bisect a failing batch; returns the number written and the
+        # (reading, error) pairs that fail on their own
+        half = len(batch) // 2
+        written, rejected = 0, []
+        for part in (batch[:half], batch[half:]):
+            if not part:
+                continue
+            try:
+                write_readings(part)
+                written += len(part)
+            except Exception as e:
+                if len(part) == 1:
+                    rejected.append((part[0], e))
+                else:
+                    part_written, part_rejected = self._write_split(part)
+                    written += part_written
+                    rejected.extend(part_rejected)
+        return written, rejected
+
+    def stats(self):
+        return {"pending": len(self._pending), **self.counters}
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending"""
+        self._stopping = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 30)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                # Drop connections that are broken or past CONN_MAX_AGE before touching the DB
+                close_old_connections()
+                self.flush()
+        finally:
+            connection.close()
+
+
+# Global ingest buffer instance
+ingest_buffer = IngestBuffer()
@@ -0,0 +1,151 @@
+"""In-process pub/sub behind the live push channel (``/api/live/``).
+
+Ingest paths publish from any thread. Each subscriber is a bounded asyncio
+queue on the ASGI event loop; a message is JSON-encoded once and handed to
+each event loop once, then fanned out to the matching subscribers there. An
+idle subscriber costs one index entry and one parked coroutine.
+
+This backend is single-process: readings ingested by another process (for
+example ``manage.py start_mqtt``) are not pushed to subscribers here.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from .presence import presence
+
+logger = logging.getLogger(__name__)
+
+LIVE_KINDS = ("status", "event", "presence")
+
+# DeviceStatus fields carried by status deltas. The counters are left out:
+# subscribers add each pushed event to the accumulated totals themselves.
+STATUS_DELTA_FIELDS = ("wifi_connected", "rtc_available", "sd_card_available", "uptime_seconds", "device_timestamp")
+
+
+class Subscription:
+    """One subscriber's queue and filters. Only touched on its event loop."""
+
+    def __init__(self, loop, device_ids, kinds, max_queue):
+        self.loop = loop
+        self.device_ids = frozenset(device_ids) if device_ids is not None else None
+        self.kinds = frozenset(kinds) if kinds else None
+        self.queue = asyncio.Queue(max_queue)
+        # Set when messages were dropped because the subscriber fell behind
+        self.lagged = False
+
+    def deliver(self, message):
+        if self.kinds is not None and message[1] not in self.kinds:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout):
+        """Next ``(seq, kind, body)`` message, or None after ``timeout`` seconds idle"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LiveHub:
+    def __init__(self, max_queue=None):
+        self.max_queue = max_queue or getattr(settings, "LIVE_SUBSCRIBER_QUEUE_SIZE", 100)
+        self._lock = threading.Lock()
+        # loop -> (subscribers to every device, {device_id: subscribers})
+        self._loops = {}
+        self._seq = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self, device_ids=None, kinds=None):
+        """Register a subscriber on the running event loop"""
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(loop, device_ids, kinds, self.max_queue)
+        with self._lock:
+            everyone, by_device = self._loops.setdefault(loop, (set(), {}))
+            if subscription.device_ids is None:
+                everyone.add(subscription)
+            else:
+                for device_id in subscription.device_ids:
+                    by_device.setdefault(device_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            entry = self._loops.get(subscription.loop)
+            if entry is None:
+                return
+            everyone, by_device = entry
+            everyone.discard(subscription)
+            for device_id in subscription.device_ids or ():
+                subscribers = by_device.get(device_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del by_device[device_id]
+            if not everyone and not by_device:
+                del self._loops[subscription.loop]
+
+    def publish(self, kind, device_id, data):
+        """Push ``data`` to the subscribers of ``device_id``. Safe from any thread."""
+        with self._lock:
+            loops = list(self._loops)
+        if not loops:
+            return
+        body = json.dumps({"device_id": device_id, **data}, cls=DjangoJSONEncoder)
+        message = (next(self._seq), kind, body)
+        self.published += 1
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._fan_out, loop, device_id, message)
+            except RuntimeError:
+                # The loop has shut down; its subscribers are gone
+                with self._lock:
+                    self._loops.pop(loop, None)
+
+    def stats(self):
+        with self._lock:
+            subscribers = set()
+            for everyone, by_device in self._loops.values():
+                subscribers.update(everyone)
+                for device_subscribers in by_device.values():
+                    subscribers.update(device_subscribers)
+        return {"subscribers": len(subscribers), "published": self.published}
+
+    def _fan_out(self, loop, device_id, message):
+        # Runs on ``loop``; copy the sets since subscribers may leave meanwhile
+        with self._lock:
+            entry = self._loops.get(loop)
+            if entry is None:
+                return
+            targets = set(entry[0]) | set(entry[1].get(device_id, ()))
+        for subscription in targets:
+            subscription.deliver(message)
+
+
+def publish_status(device_id, values, last_seen):
+    """Publish a status delta carrying the fields present in ``values``"""
+    presence.seen(device_id)
+    delta = {field: values[field] for field in STATUS_DELTA_FIELDS if field in values}
+    live_hub.publish("status", device_id, {"last_seen": last_seen, **delta})
+
+
+def publish_event(fields):
+    """Publish a new TelemetryEvent from its field values"""
+    presence.seen(fields["device_id"])
+    hidden = ("device_id", "payload", "idempotency_key")
+    live_hub.publish("event", fields["device_id"], {k: v for k, v in fields.items() if k not in hidden})
+
+
+# Global hub instance
+live_hub = LiveHub()
+
+
+@presence.add_listener
+def publish_presence(device_id, online):
+    live_hub.publish("presence", device_id, {"online": online})
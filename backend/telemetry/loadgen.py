@@ -0,0 +1,193 @@
+"""Helpers for the load and benchmark commands.
+
+Unlike ``django.test.Client``, ``wsgi_request`` goes through the real
+``WSGIHandler`` request cycle, including the request_started/finished
+connection housekeeping that CONN_MAX_AGE depends on. ``FleetSchedule`` and
+``CommitTracker`` drive ``manage.py loadgen_fleet``, and
+``delete_simulated_devices`` removes what the commands wrote.
+"""
+import heapq
+import io
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlencode
+from django.db import connection
+from .models import (
+    TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, HourlyUsage, PresenceTransition, ChangeCounter,
+)
+from .presence import presence
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+class SlowInput(io.BytesIO):
+    """A request body that arrives ``delay`` seconds after the headers, like a device on a slow link"""
+
+    def __init__(self, body, delay=0):
+        super().__init__(body)
+        self.delay = delay
+
+    def read(self, *args):
+        if self.delay:
+            time.sleep(self.delay)
+            self.delay = 0
+        return super().read(*args)
+
+
+def wsgi_request(handler, method, path, body=b'', content_type=FORM_CONTENT_TYPE, query=None, input_delay=0):
+    """Run one request through a ``WSGIHandler``; returns ``(status code, body bytes)``"""
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '',
+        'QUERY_STRING': urlencode(query or {}),
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'localhost',
+        'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': SlowInput(body, input_delay), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        content = b''.join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0]), content
+
+
+def percentiles(latencies, points=(50, 95, 99)):
+    """``{point: seconds}`` for the given percentiles of ``latencies``"""
+    if not latencies:
+        return {point: None for point in points}
+    if len(latencies) == 1:
+        return {point: latencies[0] for point in points}
+    cuts = statistics.quantiles(latencies, n=100)
+    return {point: cuts[point - 1] for point in points}
+
+
+def format_percentiles(latencies):
+    return ' '.join(
+        f'p{point} {value * 1000:.0f}ms' if value is not None else f'p{point} -'
+        for point, value in percentiles(latencies).items()
+    )
+
+
+def delete_simulated_devices(prefix):
+    """Delete every row written for the simulated devices whose id starts with ``prefix``"""
+    # Write the transitions still queued for these devices before deleting them
+    presence.flush()
+    for model in (TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, HourlyUsage, PresenceTransition):
+        model.objects.filter(device_id__startswith=prefix).delete()
+    ChangeCounter.objects.filter(name__startswith=f'device:{prefix}').delete()
+
+
+class FleetSchedule:
+    """Heartbeat and press times of a simulated fleet, in seconds from the start.
+
+    Each device sends a heartbeat every ``heartbeat_interval`` seconds from a
+    random phase, and presses arrive as a Poisson process of
+    ``presses_per_hour``, at least ``min_press_gap`` apart (a treatment
+    takes time, and presses in one second would share a device timestamp).
+    """
+
+    # Share of presses per machine type
+    PRESS_WEIGHTS = {'BASIC': 6, 'STANDARD': 3, 'PREMIUM': 1}
+
+    def __init__(self, devices, heartbeat_interval=60.0, presses_per_hour=12.0, min_press_gap=1.0, seed=None):
+        self.random = random.Random(seed)
+        self.heartbeat_interval = heartbeat_interval
+        self.press_rate = presses_per_hour / 3600
+        self.min_press_gap = min_press_gap
+        self._heap = []
+        for device in range(devices):
+            if heartbeat_interval:
+                self._heap.append((self.random.uniform(0, heartbeat_interval), device, 'heartbeat'))
+            if self.press_rate:
+                self._heap.append((self._press_gap(), device, 'press'))
+        heapq.heapify(self._heap)
+
+    def _press_gap(self):
+        return max(self.min_press_gap, self.random.expovariate(self.press_rate))
+
+    def press_type(self):
+        return self.random.choices(list(self.PRESS_WEIGHTS), weights=list(self.PRESS_WEIGHTS.values()))[0]
+
+    def until(self, end):
+        """Yield ``(offset, device, kind)`` in time order up to ``end`` seconds"""
+        while self._heap and self._heap[0][0] < end:
+            offset, device, kind = heapq.heappop(self._heap)
+            gap = self.heartbeat_interval if kind == 'heartbeat' else self._press_gap()
+            heapq.heappush(self._heap, (offset + gap, device, kind))
+            yield offset, device, kind
+
+
+class CommitTracker:
+    """Times from sending a press to its TelemetryEvent row becoming visible.
+
+    Presses are identified by their idempotency key. A background thread
+    polls for the pending keys every ``poll_interval`` seconds, which is
+    the resolution of the measured latencies.
+    """
+
+    LOOKUP_BATCH = 500
+
+    def __init__(self, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self.latencies = {}  # transport -> seconds from send to commit
+        self._pending = {}  # key -> (transport, monotonic send time)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def expect(self, key, transport, sent_at):
+        with self._lock:
+            self._pending[key] = (transport, sent_at)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='loadgen-commits', daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout):
+        """Wait until every press committed or ``timeout`` passed; returns the number still pending"""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+        self._stopping.set()
+        self._thread.join()
+        return self.pending()
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def pending_by_transport(self):
+        counts = {}
+        with self._lock:
+            for transport, _ in self._pending.values():
+                counts[transport] = counts.get(transport, 0) + 1
+        return counts
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                self._poll()
+                self._stopping.wait(self.poll_interval)
+            self._poll()
+        finally:
+            connection.close()
+
+    def _poll(self):
+        with self._lock:
+            keys = list(self._pending)
+        for start in range(0, len(keys), self.LOOKUP_BATCH):
+            found = list(TelemetryEvent.objects.filter(
+                idempotency_key__in=keys[start:start + self.LOOKUP_BATCH]
+            ).values_list('idempotency_key', flat=True))
+            now = time.monotonic()
+            with self._lock:
+                for key in found:
+                    entry = self._pending.pop(key, None)
+                    if entry is not None:
+                        transport, sent_at = entry
+                        self.latencies.setdefault(transport, []).append(now - sent_at)
@@ -0,0 +1,123 @@
+import threading
+import time
+from urllib.parse import urlencode
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from telemetry.loadgen import wsgi_request, format_percentiles, delete_simulated_devices
+
+DEVICE_PREFIX = 'dbbench-'
+
+# Connection settings per profile, by database vendor. 'rollback' is how the
+# project used to run SQLite (no pragmas, rollback journal, a connection per
+# request); the WAL profiles apply the configured SQLITE_PRAGMAS.
+PROFILES = {
+    'sqlite': {
+        'rollback': {'journal_mode': 'DELETE', 'pragmas': {}, 'conn_max_age': 0},
+        'wal': {'journal_mode': 'WAL', 'conn_max_age': 0},
+        'wal-persistent': {'journal_mode': 'WAL', 'conn_max_age': 60},
+    },
+    'postgresql': {
+        'per-request': {'conn_max_age': 0},
+        'persistent': {'conn_max_age': 60},
+    },
+}
+
+READ_PATHS = ('/api/devices/online/', '/api/events/', '/api/machines/')
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed ingest/dashboard throughput across database connection profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per profile')
+        parser.add_argument('--writers', type=int, default=4, help='Threads posting /api/iot/ triggers')
+        parser.add_argument('--readers', type=int, default=4, help='Threads reading dashboard endpoints')
+        parser.add_argument('--devices', type=int, default=20, help='Number of simulated devices')
+        parser.add_argument('--profile', action='append', dest='profiles', help='Profile(s) to run (default: all)')
+
+    def handle(self, *args, **options):
+        profiles = PROFILES.get(connection.vendor)
+        if profiles is None:
+            raise CommandError(f'No profiles for {connection.vendor}')
+        names = options['profiles'] or list(profiles)
+        unknown = set(names).difference(profiles)
+        if unknown:
+            raise CommandError(f'Unknown profile(s) {", ".join(sorted(unknown))}; choose from {", ".join(profiles)}')
+
+        settings_dict = connections.settings[connection.alias]
+        original_age = settings_dict['CONN_MAX_AGE']
+        delete_simulated_devices(DEVICE_PREFIX)
+        try:
+            for name in names:
+                profile = profiles[name]
+                overrides = {'SQLITE_PRAGMAS': profile['pragmas']} if 'pragmas' in profile else {}
+                with override_settings(**overrides):
+                    # New connections pick up the profile
+                    connection.close()
+                    settings_dict['CONN_MAX_AGE'] = profile['conn_max_age']
+                    if 'journal_mode' in profile:
+                        # Stored in the database file; switching needs the only open connection
+                        with connection.cursor() as cursor:
+                            cursor.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+                        connection.close()
+                    self._report(name, self._run(options))
+        finally:
+            connection.close()
+            settings_dict['CONN_MAX_AGE'] = original_age
+            delete_simulated_devices(DEVICE_PREFIX)
+
+    def _run(self, options):
+        handler = WSGIHandler()
+        deadline = time.perf_counter() + options['duration']
+        devices = options['devices']
+        results = {'write': ([], []), 'read': ([], [])}  # kind -> (latencies, error codes)
+        lock = threading.Lock()
+
+        def worker(kind, index):
+            latencies, errors = [], []
+            n = index
+            try:
+                while time.perf_counter() < deadline:
+                    device_id = f'{DEVICE_PREFIX}{n % devices}'
+                    start = time.perf_counter()
+                    if kind == 'write':
+                        body = urlencode({'macaddr': device_id, 'mode': ('BASIC', 'STANDARD', 'PREMIUM')[n % 3]}).encode()
+                        code, _ = wsgi_request(handler, 'POST', '/api/iot/', body)
+                    else:
+                        path = READ_PATHS[n % len(READ_PATHS)]
+                        query = {'device_id': device_id, 'limit': 50} if path == '/api/events/' else None
+                        code, _ = wsgi_request(handler, 'GET', path, query=query)
+                    latencies.append(time.perf_counter() - start)
+                    if code != 200:
+                        errors.append(code)
+                    n += options['writers'] + options['readers']
+            finally:
+                connections.close_all()
+                with lock:
+                    results[kind][0].extend(latencies)
+                    results[kind][1].extend(errors)
+
+        threads = [threading.Thread(target=worker, args=('write', i)) for i in range(options['writers'])]
+        threads += [threading.Thread(target=worker, args=('read', i)) for i in range(options['readers'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {kind: (latencies, errors, elapsed) for kind, (latencies, errors) in results.items()}
+
+    def _report(self, name, results):
+        with connection.cursor() as cursor:
+            journal = ''
+            if connection.vendor == 'sqlite':
+                cursor.execute('PRAGMA journal_mode')
+                journal = f' (journal {cursor.fetchone()[0]})'
+        self.stdout.write(f'{name}{journal}:')
+        for kind, (latencies, errors, elapsed) in results.items():
+            self.stdout.write(
+                f'  {kind:<5} {len(latencies) / elapsed:8.1f} req/s, {len(errors)} errors, {format_percentiles(latencies)}'
+            )
+
@@ -0,0 +1,97 @@
+import csv
+import io
+import time
+import tracemalloc
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.utils import timezone
+from telemetry.models import TelemetryEvent
+
+DEVICE_ID = 'bench-export'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the streaming CSV export against the in-memory export on a large event table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1_000_000, help='Events to seed for the benchmark device')
+        parser.add_argument('--legacy', action='store_true', help='Also time the old build-everything-in-memory export')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded events')
+
+    def handle(self, *args, **options):
+        total = options['events']
+        existing = TelemetryEvent.objects.filter(device_id=DEVICE_ID).count()
+        if existing != total:
+            self._seed(total)
+
+        for label, query in (('csv', ''), ('csv+gzip', '&compress=gzip')):
+            elapsed, peak, size = self._measure(
+                lambda: Client().get(f'/api/export/?device_id={DEVICE_ID}&days=365{query}').streaming_content
+            )
+            self.stdout.write(
+                f'{label:>9}: {total / elapsed:10.0f} rows/s, {elapsed:6.1f}s, '
+                f'peak {peak / 2**20:7.1f} MiB, {size / 2**20:7.1f} MiB output'
+            )
+
+        if options['legacy']:
+            elapsed, peak, size = self._measure(lambda: [self._legacy_export()])
+            self.stdout.write(
+                f'{"legacy":>9}: {total / elapsed:10.0f} rows/s, {elapsed:6.1f}s, '
+                f'peak {peak / 2**20:7.1f} MiB, {size / 2**20:7.1f} MiB output'
+            )
+
+        if not options['keep']:
+            TelemetryEvent.objects.filter(device_id=DEVICE_ID).delete()
+
+    def _measure(self, produce):
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = 0
+        for chunk in produce():
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, size
+
+    def _legacy_export(self):
+        # The previous implementation: model instances written into one response body
+        end_date = timezone.now()
+        events = TelemetryEvent.objects.filter(
+            device_id=DEVICE_ID,
+            occurred_at__gte=end_date - timedelta(days=365),
+            occurred_at__lte=end_date
+        ).order_by('occurred_at')
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for event in events:
+            writer.writerow([
+                event.occurred_at.isoformat(),
+                event.device_timestamp or '',
+                event.event_type,
+                event.count_basic or 0,
+                event.count_standard or 0,
+                event.count_premium or 0,
+                'Connected' if event.wifi_status else 'Disconnected'
+            ])
+        return out.getvalue().encode()
+
+    def _seed(self, total, batch_size=5000):
+        self.stdout.write(f'Seeding {total} events...')
+        TelemetryEvent.objects.filter(device_id=DEVICE_ID).delete()
+        start = timezone.now() - timedelta(days=364)
+        step = timedelta(days=364) / total
+        types = ('BASIC', 'STANDARD', 'PREMIUM')
+        for offset in range(0, total, batch_size):
+            TelemetryEvent.objects.bulk_create([
+                TelemetryEvent(
+                    device_id=DEVICE_ID,
+                    event_type=types[i % 3],
+                    count_basic=i, count_standard=i, count_premium=i,
+                    occurred_at=start + step * i,
+                    device_timestamp=(start + step * i).strftime('%Y-%m-%d %H:%M:%S'),
+                    wifi_status=True,
+                )
+                for i in range(offset, min(offset + batch_size, total))
+            ])
@@ -0,0 +1,69 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from telemetry.ingest_buffer import ingest_buffer
+from telemetry.loadgen import delete_simulated_devices
+
+DEVICE_PREFIX = 'bench-'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark /api/iot/ throughput in synchronous and write-behind modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode')
+        parser.add_argument('--devices', type=int, default=50, help='Number of simulated devices')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent client threads')
+        parser.add_argument('--keep', action='store_true', help='Keep benchmark rows instead of deleting them')
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode, buffered in (('sync', False), ('buffered', True)):
+            delete_simulated_devices(DEVICE_PREFIX)
+            with override_settings(IOT_INGEST_BUFFERED=buffered):
+                accepted, drained = self._run(options['requests'], options['devices'], options['threads'])
+            results[mode] = (accepted, drained)
+            self.stdout.write(
+                f'{mode:>8}: {options["requests"] / accepted:8.1f} req/s accepted, '
+                f'{options["requests"] / drained:8.1f} req/s committed'
+            )
+
+        speedup = results['sync'][1] / results['buffered'][1]
+        self.stdout.write(self.style.SUCCESS(f'Write-behind speedup (committed): {speedup:.2f}x'))
+        if not options['keep']:
+            delete_simulated_devices(DEVICE_PREFIX)
+
+    def _run(self, total, devices, threads):
+        per_thread = total // threads
+        errors = []
+
+        def worker(index):
+            client = Client(raise_request_exception=False)
+            for i in range(per_thread):
+                n = index * per_thread + i
+                # Roughly one trigger for every three heartbeats
+                mode = ('BASIC', 'status', 'status', 'status', 'STANDARD', 'status', 'PREMIUM')[n % 7]
+                response = client.post('/api/iot/', {
+                    'macaddr': f'{DEVICE_PREFIX}{n % devices:04d}',
+                    'mode': mode,
+                    'count1': n, 'count2': n, 'count3': n,
+                    'type1': 1, 'type2': 0, 'type3': 0,
+                })
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        accepted = time.perf_counter() - start
+        ingest_buffer.flush()
+        drained = time.perf_counter() - start
+
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{len(errors)} requests failed'))
+        return accepted, drained
+
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from telemetry.bulk_ingest import import_payloads, sd_log_payloads
+
+
+class Command(BaseCommand):
+    help = 'Import SD-card usage logs (Timestamp,Machine_Type,Count,Device_MAC), skipping events already stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Usage log CSV files copied off the SD card')
+        parser.add_argument('--device-id', help='Device id to use instead of the log\'s MAC column')
+        parser.add_argument('--chunk-size', type=int, help='Rows per transaction (default BULK_INGEST_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            try:
+                with open(path, newline='', encoding='utf-8-sig') as log:
+                    totals = import_payloads(sd_log_payloads(log, options['device_id']), options['chunk_size'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f'{path}: {e}')
+            self.stdout.write(
+                f"{path}: {totals['received']} rows, {totals['created']} imported, "
+                f"{totals['duplicates']} already stored, {totals['invalid']} unusable"
+            )
+        self.stdout.write(self.style.SUCCESS('Import complete'))
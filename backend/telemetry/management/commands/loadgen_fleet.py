@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from paho.mqtt.client import Client, MQTT_ERR_SUCCESS
+from telemetry.idempotency import event_key
+from telemetry.loadgen import FORM_CONTENT_TYPE, FleetSchedule, CommitTracker, wsgi_request, percentiles, format_percentiles, delete_simulated_devices
+from telemetry.mqtt_client import MQTTClient
+
+DEVICE_PREFIX = 'fleet-'
+COUNT_FIELDS = {'BASIC': 'count1', 'STANDARD': 'count2', 'PREMIUM': 'count3'}
+STATUS_COUNT_KEYS = {'BASIC': 'basic_count', 'STANDARD': 'standard_count', 'PREMIUM': 'premium_count'}
+
+
+class HttpTransport:
+    """Posts form readings to /api/iot/, in-process or to a running server"""
+
+    name = 'http'
+
+    def __init__(self, workers, base_url=None):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.handler = None if base_url else WSGIHandler()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='loadgen-http')
+        self.lock = threading.Lock()
+        self.sent = {'press': 0, 'heartbeat': 0}
+        self.errors = 0
+        self.ack_latencies = []
+
+    def send(self, device, kind, timestamp, counts, press_type, sent_at):
+        form = {'macaddr': device, 'mode': press_type or 'status', 'timestamp': timestamp}
+        form.update({COUNT_FIELDS[t]: n for t, n in counts.items()})
+        self.pool.submit(self._post, kind, urlencode(form).encode(), sent_at)
+        return event_key(device, timestamp, press_type, counts[press_type]) if press_type else None
+
+    def _post(self, kind, body, sent_at):
+        try:
+            if self.handler is not None:
+                code, _ = wsgi_request(self.handler, 'POST', '/api/iot/', body)
+            else:
+                request = Request(f'{self.base_url}/api/iot/', data=body, headers={'Content-Type': FORM_CONTENT_TYPE})
+                with urlopen(request, timeout=30) as response:
+                    code = response.status
+        except HTTPError as e:
+            code = e.code
+        except (URLError, OSError):
+            code = None
+        with self.lock:
+            self.sent[kind] += 1
+            self.ack_latencies.append(time.monotonic() - sent_at)
+            if code != 200:
+                self.errors += 1
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def stats(self):
+        return {'ack_latency': self.ack_latencies}
+
+
+class MqttTransport:
+    """Publishes firmware-format messages to a broker, or straight into an in-process MQTTClient"""
+
+    name = 'mqtt'
+
+    def __init__(self, broker=None):
+        self.sent = {'press': 0, 'heartbeat': 0}
+        self.errors = 0
+        self.consumer = self.client = None
+        if broker:
+            host, _, port = broker.partition(':')
+            self.client = Client()
+            if self.client.connect(host, int(port or settings.MQTT_PORT), 60) != MQTT_ERR_SUCCESS:
+                raise CommandError(f'Could not connect to MQTT broker {broker}')
+            self.client.loop_start()
+        else:
+            # Stand-in for the broker: the consumer's own decode and worker pool
+            self.consumer = MQTTClient()
+            self.consumer.start_workers()
+
+    def send(self, device, kind, timestamp, counts, press_type, sent_at):
+        if press_type:
+            topic = f'{settings.MQTT_TOPIC_EVENTS}{device}'
+            # The firmware sends count 1 for every press, and the cumulative counter
+            data = {'event_type': press_type, 'count': 1, 'total': counts[press_type]}
+        else:
+            topic = f'{settings.MQTT_TOPIC_STATUS}{device}'
+            data = {STATUS_COUNT_KEYS[t]: n for t, n in counts.items()}
+            data.update(wifi_connected=True, rtc_available=True)
+        body = json.dumps({'device_id': device, 'timestamp': timestamp, 'type': 'event' if press_type else 'status', 'data': data}).encode()
+        if self.consumer is not None:
+            self.consumer.on_message(None, None, SimpleNamespace(topic=topic, payload=body))
+        elif self.client.publish(topic, body, qos=1).rc != MQTT_ERR_SUCCESS:
+            self.errors += 1
+        self.sent[kind] += 1
+        return event_key(device, timestamp, press_type, counts[press_type]) if press_type else None
+
+    def close(self):
+        if self.consumer is not None:
+            # Drain the worker queues and write the pending statuses
+            self.consumer.stop_workers()
+            self.errors += self.consumer.workers.dropped
+        else:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+    def stats(self):
+        return {}
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate a fleet of devices sending heartbeats and presses over /api/iot/ and MQTT, and report '
+        'throughput, publish-to-commit latency and error rates'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=1000, help='Simulated devices')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load')
+        parser.add_argument('--heartbeat-interval', type=float, default=60.0,
+                            help='Seconds between heartbeats per device (firmware: 60)')
+        parser.add_argument('--presses-per-hour', type=float, default=12.0, help='Mean presses per device per hour')
+        parser.add_argument('--transport', choices=('http', 'mqtt', 'mixed'), default='http',
+                            help='mixed splits the devices between the two')
+        parser.add_argument('--http-url', help='Base URL of a running server sharing this database '
+                                               '(default: in-process WSGI handler)')
+        parser.add_argument('--http-workers', type=int, default=16, help='Concurrent HTTP requests')
+        parser.add_argument('--mqtt-broker', help='host[:port] of a broker that a start_mqtt process on this database '
+                                                  'consumes (default: in-process stand-in)')
+        parser.add_argument('--drain-timeout', type=float, default=30.0,
+                            help='Seconds to wait for presses to commit after the load stops')
+        parser.add_argument('--seed', type=int, help='Random seed for a repeatable schedule')
+        parser.add_argument('--json', dest='json_path', help='Write the results as JSON to this file (- for stdout)')
+        parser.add_argument('--keep', action='store_true', help='Keep the fleet rows instead of deleting them')
+
+    def handle(self, *args, **options):
+        delete_simulated_devices(DEVICE_PREFIX)
+        transports = []
+        if options['transport'] in ('http', 'mixed'):
+            transports.append(HttpTransport(options['http_workers'], options['http_url']))
+        if options['transport'] in ('mqtt', 'mixed'):
+            transports.append(MqttTransport(options['mqtt_broker']))
+
+        schedule = FleetSchedule(
+            options['devices'], options['heartbeat_interval'], options['presses_per_hour'], seed=options['seed']
+        )
+        counts = [dict.fromkeys(COUNT_FIELDS, 0) for _ in range(options['devices'])]
+        tracker = CommitTracker()
+        tracker.start()
+
+        started = time.monotonic()
+        # Device clocks: timestamps follow the schedule, not the (possibly lagging) send time
+        wall_start = timezone.localtime()
+        for offset, device, kind in schedule.until(options['duration']):
+            sent_at = started + offset
+            delay = sent_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            press_type = schedule.press_type() if kind == 'press' else None
+            if press_type:
+                counts[device][press_type] += 1
+            timestamp = (wall_start + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S')
+            transport = transports[device % len(transports)]
+            key = transport.send(f'{DEVICE_PREFIX}{device}', kind, timestamp, counts[device], press_type, sent_at)
+            if key:
+                tracker.expect(key, transport.name, sent_at)
+        for transport in transports:
+            transport.close()
+        load_seconds = time.monotonic() - started
+        tracker.wait(options['drain_timeout'])
+        elapsed = time.monotonic() - started
+
+        results = self._results(options, transports, tracker, load_seconds, elapsed)
+        self._report(results, tracker, transports)
+        if options['json_path'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        elif options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if not options['keep']:
+            delete_simulated_devices(DEVICE_PREFIX)
+
+    def _results(self, options, transports, tracker, load_seconds, elapsed):
+        lost = tracker.pending_by_transport()
+        results = {
+            'config': {key: options[key] for key in (
+                'devices', 'duration', 'heartbeat_interval', 'presses_per_hour', 'transport',
+                'http_url', 'http_workers', 'mqtt_broker', 'seed',
+            )},
+            'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+            'load_seconds': round(load_seconds, 3),
+            'elapsed_seconds': round(elapsed, 3),
+            'transports': {},
+        }
+        for transport in transports:
+            committed = tracker.latencies.get(transport.name, [])
+            sent = sum(transport.sent.values())
+            entry = {
+                'sent': dict(transport.sent),
+                'sent_per_second': round(sent / load_seconds, 1),
+                'errors': transport.errors,
+                'error_rate': round(transport.errors / sent, 4) if sent else 0,
+                'presses_committed': len(committed),
+                'presses_lost': lost.get(transport.name, 0),
+                'commit_latency_ms': _milliseconds(percentiles(committed)),
+            }
+            for name, latencies in transport.stats().items():
+                entry[f'{name}_ms'] = _milliseconds(percentiles(latencies))
+            results['transports'][transport.name] = entry
+        return results
+
+    def _report(self, results, tracker, transports):
+        self.stdout.write(
+            f"{results['config']['devices']} devices for {results['load_seconds']:.1f}s "
+            f"({results['database']}, commit latency resolution {tracker.poll_interval * 1000:.0f}ms)"
+        )
+        for transport in transports:
+            entry = results['transports'][transport.name]
+            self.stdout.write(
+                f"  {transport.name}: {entry['sent']['press']} presses + {entry['sent']['heartbeat']} heartbeats "
+                f"({entry['sent_per_second']} msg/s), {entry['errors']} errors, "
+                f"{entry['presses_committed']} presses committed, {entry['presses_lost']} lost"
+            )
+            self.stdout.write(f'    publish->commit {format_percentiles(tracker.latencies.get(transport.name, []))}')
+            for name, latencies in transport.stats().items():
+                self.stdout.write(f"    {name.replace('_', ' ')} {format_percentiles(latencies)}")
+
+
+
+def _milliseconds(points):
+    return {f'p{point}': round(value * 1000, 1) if value is not None else None for point, value in points.items()}
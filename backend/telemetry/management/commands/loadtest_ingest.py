@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from telemetry.loadgen import wsgi_request, format_percentiles, delete_simulated_devices
+
+DEVICE_PREFIX = 'load-'
+EVENT_TYPES = ('BASIC', 'STANDARD', 'PREMIUM', 'status')
+
+
+def _body(i, devices):
+    return urlencode({'macaddr': f'{DEVICE_PREFIX}{i % devices}', 'mode': EVENT_TYPES[i % len(EVENT_TYPES)]}).encode()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare /api/iot/ under a threaded WSGI server with /api/iot/async/ under ASGI, '
+        'in-process, at high concurrency with slow clients'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per run')
+        parser.add_argument('--concurrency', type=int, default=200, help='Clients connected at once')
+        parser.add_argument('--client-delay', type=float, default=0.25,
+                            help='Seconds each client takes to send its body')
+        parser.add_argument('--wsgi-workers', type=int, default=16, help='Worker threads of the WSGI server')
+        parser.add_argument('--devices', type=int, default=50, help='Number of devices sharing the load')
+        parser.add_argument('--only', choices=('wsgi', 'asgi'), help='Run one side only')
+        parser.add_argument('--keep', action='store_true', help='Keep load rows instead of deleting them')
+
+    def handle(self, *args, **options):
+        delete_simulated_devices(DEVICE_PREFIX)
+        runs = [options['only']] if options['only'] else ['wsgi', 'asgi']
+        try:
+            for name in runs:
+                run = self._run_wsgi if name == 'wsgi' else self._run_asgi
+                start = time.perf_counter()
+                latencies, errors = run(options)
+                self._report(name, latencies, errors, time.perf_counter() - start, options)
+        finally:
+            if not options['keep']:
+                delete_simulated_devices(DEVICE_PREFIX)
+
+    def _run_wsgi(self, options):
+        # Each request holds a server thread while its body trickles in
+        handler = WSGIHandler()
+        devices, delay = options['devices'], options['client_delay']
+
+        def request(i, start):
+            try:
+                code, _ = wsgi_request(handler, 'POST', '/api/iot/', _body(i, devices), input_delay=delay)
+            finally:
+                slots.release()
+            return time.perf_counter() - start, code == 200
+
+        # Latency runs from when the client connects, including time queued for a free worker
+        slots = threading.BoundedSemaphore(options['concurrency'])
+        futures = []
+        with ThreadPoolExecutor(options['wsgi_workers']) as pool:
+            for i in range(options['requests']):
+                slots.acquire()
+                futures.append(pool.submit(request, i, time.perf_counter()))
+        results = [future.result() for future in futures]
+        return [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+    def _run_asgi(self, options):
+        # Bodies are awaited on the event loop; only the database work takes a thread
+        application = get_asgi_application()
+        devices, delay = options['devices'], options['client_delay']
+
+        async def request(i, slots):
+            body = _body(i, devices)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+                'scheme': 'http', 'path': '/api/iot/async/', 'raw_path': b'/api/iot/async/',
+                'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                'headers': [
+                    (b'host', b'localhost'),
+                    (b'content-type', b'application/x-www-form-urlencoded'),
+                    (b'content-length', str(len(body)).encode()),
+                ],
+            }
+            sent = []
+
+            async def receive():
+                if sent:
+                    # Body already delivered: stay connected until the handler is done
+                    await asyncio.Event().wait()
+                sent.append(True)
+                await asyncio.sleep(delay)
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            statuses = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            async with slots:
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - start, statuses == [200]
+
+        async def main():
+            slots = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(*(request(i, slots) for i in range(options['requests'])))
+
+        results = asyncio.run(main())
+        return [latency for latency, _ in results], sum(1 for _, ok in results if not ok)
+
+    def _report(self, name, latencies, errors, elapsed, options):
+        workers = f"{options['wsgi_workers']} workers, " if name == 'wsgi' else ''
+        self.stdout.write(
+            f'{name}: {len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s, '
+            f"{options['concurrency']} clients, {workers}{errors} errors) {format_percentiles(latencies)}"
+        )
+
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from datetime import datetime, time
+import time as time_module
+from telemetry.retention import PURGE_TABLES, purge, apply_retention, expired_counts, vacuum
+
+class Command(BaseCommand):
+    help = 'Apply telemetry retention policies, or purge a device/date range, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--table', action='append', choices=list(PURGE_TABLES),
+                            help='Table(s) for a targeted purge (default: all)')
+        parser.add_argument('--device-id', action='append', dest='device_ids', help='Purge only these devices')
+        parser.add_argument('--start', help='Purge rows at or after this ISO date/datetime')
+        parser.add_argument('--end', help='Purge rows before this ISO date/datetime')
+        parser.add_argument('--batch-size', type=int, help='Rows per delete transaction')
+        parser.add_argument('--pause', type=float, help='Seconds to yield between batches')
+        parser.add_argument('--vacuum', action='store_true', help='VACUUM afterwards to return space to the OS (on SQLite, also '
+                                 'enables the incremental reclaim of later purges)')
+        parser.add_argument('--dry-run', action='store_true', help='Show what the retention policies would delete')
+
+    def handle(self, *args, **options):
+        self._last_report = 0
+        targeted = options['table'] or options['device_ids'] or options['start'] or options['end']
+        batch = {'batch_size': options['batch_size'], 'pause': options['pause'], 'progress': self._progress}
+
+        if options['dry_run']:
+            if targeted:
+                raise CommandError('--dry-run only applies to retention policies')
+            for table, count in expired_counts().items():
+                self.stdout.write(f'  {table}: {count} expired rows')
+            return
+
+        if targeted:
+            after = self._parse(options['start'])
+            before = self._parse(options['end'])
+            if not (options['device_ids'] or after or before):
+                raise CommandError('A targeted purge needs --device-id, --start or --end')
+            results = {}
+            for table in options['table'] or PURGE_TABLES:
+                self.stdout.write(f'Purging {table}...')
+                results[table] = purge(table, before=before, after=after, device_ids=options['device_ids'], **batch)
+        else:
+            self.stdout.write('Applying retention policies...')
+            results = apply_retention(**batch)
+
+        for table, deleted in results.items():
+            self.stdout.write(f'  {table}: {deleted} rows deleted')
+        if options['vacuum']:
+            self.stdout.write('Vacuuming...')
+            vacuum()
+        self.stdout.write(self.style.SUCCESS('Purge complete'))
+
+    def _progress(self, table, deleted):
+        # Report at most once per second
+        now = time_module.monotonic()
+        if now - self._last_report >= 1:
+            self._last_report = now
+            self.stdout.write(f'  {table}: {deleted} deleted so far...')
+
+    def _parse(self, value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'Invalid date: {value}')
+            parsed = datetime.combine(day, time.min)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,51 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from telemetry.models import TelemetryEvent, HourlyUsage
+from telemetry.upserts import truncate_hour
+
+class Command(BaseCommand):
+    help = 'Rebuild the HourlyUsage rollup from TelemetryEvent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only rebuild the last N days (default: everything)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk_create')
+
+    def handle(self, *args, **options):
+        events = TelemetryEvent.objects.exclude(event_type='status')
+        rollup = HourlyUsage.objects.all()
+        if options['days']:
+            start = truncate_hour(timezone.now() - timedelta(days=options['days']))
+            events = events.filter(occurred_at__gte=start)
+            rollup = rollup.filter(hour__gte=start)
+            self.stdout.write(f'Rebuilding hourly usage since {start.isoformat()}...')
+        else:
+            self.stdout.write('Rebuilding hourly usage from all events...')
+
+        # One GROUP BY over the events, streamed into bulk inserts
+        rows = (
+            events.annotate(bucket=TruncHour('occurred_at', tzinfo=dt_timezone.utc))
+            .values_list('device_id', 'bucket', 'event_type')
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        created = 0
+        with transaction.atomic():
+            deleted, _ = rollup.delete()
+            batch = []
+            for device_id, hour, event_type, n in rows.iterator(chunk_size=options['batch_size']):
+                batch.append(HourlyUsage(device_id=device_id, hour=hour, event_type=event_type, count=n))
+                if len(batch) >= options['batch_size']:
+                    HourlyUsage.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            if batch:
+                HourlyUsage.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Hourly usage rebuilt: {deleted} rows removed, {created} rows written')
+        )
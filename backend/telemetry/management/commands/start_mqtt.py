@@ -11,14 +11,26 @@ import django
 django.setup()
 
 from telemetry.mqtt_client import mqtt_client
+from telemetry.presence import presence
+from telemetry import metrics
 
 class Command(BaseCommand):
     help = 'Start MQTT client to receive telemetry data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-port', type=int, help='Serve Prometheus /metrics for this process on this port')
+        parser.add_argument('--no-presence-transitions', action='store_true',
+                            help='Do not record presence transitions here (another process sets PRESENCE_RECORD_TRANSITIONS=1)')
+
     def handle(self, *args, **options):
         self.stdout.write(
             self.style.SUCCESS('Starting MQTT client...')
         )
+        if options['metrics_port']:
+            metrics.serve(options['metrics_port'])
+            self.stdout.write(f"Serving metrics on :{options['metrics_port']}/metrics")
+        # The consumer is the one process that records presence transitions
+        presence.record = not options['no_presence_transitions']
         
         try:
             # Set up signal handler for graceful shutdown
@@ -46,10 +58,19 @@ class Command(BaseCommand):
                 )
                 self.stdout.write('Press Ctrl+C to stop...')
                 
-                # Keep the process running
+                # Keep the process running, reporting worker queue depth periodically
                 try:
+                    ticks = 0
                     while True:
                         time.sleep(1)
+                        ticks += 1
+                        if ticks % 60 == 0:
+                            stats = mqtt_client.queue_stats()
+                            self.stdout.write(
+                                f"Queue depth: {stats['queue_depth']}/{stats['queue_capacity']} "
+                                f"(per worker {stats['queue_depths']}), "
+                                f"processed: {stats['processed']}, dropped: {stats['dropped']}"
+                            )
                 except KeyboardInterrupt:
                     signal_handler(None, None)
             else:
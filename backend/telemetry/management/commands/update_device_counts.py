@@ -1,30 +1,60 @@
 from django.core.management.base import BaseCommand
-from telemetry.models import DeviceStatus
+from django.db import connection, transaction
+from django.db.models import Count
+from telemetry.models import DeviceStatus, TelemetryEvent
+from telemetry.fleet_cache import fleet_status
+from telemetry.versioning import bump_version
 
 class Command(BaseCommand):
-    help = 'Update device counts with accumulated values from database events'
+    help = 'Reconcile accumulated device counters against TelemetryEvent and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
 
     def handle(self, *args, **options):
-        self.stdout.write('Updating device counts with accumulated values...')
-        
-        devices = DeviceStatus.objects.all()
-        
-        for device in devices:
-            self.stdout.write(f'Updating device: {device.device_id}')
-            
-            # Get old counts
-            old_basic = device.current_count_basic
-            old_standard = device.current_count_standard
-            old_premium = device.current_count_premium
-            
-            # Update with accumulated counts
-            device.update_accumulated_counts()
-            
-            # Show the change
-            self.stdout.write(f'  Basic: {old_basic} → {device.current_count_basic}')
-            self.stdout.write(f'  Standard: {old_standard} → {device.current_count_standard}')
-            self.stdout.write(f'  Premium: {old_premium} → {device.current_count_premium}')
-        
+        self.stdout.write('Reconciling accumulated device counts...')
+
+        with transaction.atomic():
+            devices = DeviceStatus.objects.only('id', 'device_id', *DeviceStatus.COUNTER_FIELDS.values())
+            if not options['dry_run']:
+                # Lock the counters before counting events, so increments
+                # committed meanwhile are not overwritten: row locks on
+                # PostgreSQL, the write lock (taken by a first write) on SQLite
+                devices = devices.select_for_update()
+                if connection.vendor == 'sqlite':
+                    bump_version()
+            devices = list(devices)
+
+            # One GROUP BY over all events instead of three COUNTs per device
+            counts = {}
+            rows = (
+                TelemetryEvent.objects.filter(event_type__in=DeviceStatus.COUNTER_FIELDS)
+                .values_list('device_id', 'event_type')
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            for device_id, event_type, n in rows:
+                counts.setdefault(device_id, {})[event_type] = n
+
+            drifted = []
+            for device in devices:
+                expected = counts.get(device.device_id, {})
+                changes = []
+                for event_type, field in DeviceStatus.COUNTER_FIELDS.items():
+                    old = getattr(device, field)
+                    new = expected.get(event_type, 0)
+                    if old != new:
+                        setattr(device, field, new)
+                        changes.append(f'{event_type.title()}: {old} → {new}')
+                if changes:
+                    drifted.append(device)
+                    self.stdout.write(f'  {device.device_id}: ' + ', '.join(changes))
+
+            if drifted and not options['dry_run']:
+                DeviceStatus.objects.bulk_update(drifted, list(DeviceStatus.COUNTER_FIELDS.values()), batch_size=500)
+                transaction.on_commit(fleet_status.clear)
+                bump_version()
+
         self.stdout.write(
-            self.style.SUCCESS('Device counts updated successfully!')
+            self.style.SUCCESS(f'{len(drifted)} device(s) with drifted counts' + (' (dry run)' if options['dry_run'] else ' fixed'))
         )
@@ -0,0 +1,270 @@
+"""In-process metrics, exposed in the Prometheus text format at ``/metrics``.
+
+Recording takes no lock: every thread updates its own shard of a metric and
+the shards are only summed when the endpoint is scraped. Shards of threads
+that have finished are folded into a retired total at scrape time, so
+servers that start a thread per request do not accumulate them. Component
+gauges (caches, MQTT worker queues, live subscribers) are read from their
+``stats()`` at scrape time.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) per recording thread
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def collect(self):
+        """``{label values: value}`` summed over all threads"""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in live:
+                # The owning thread may be adding keys; copying is atomic under the GIL
+                self._merge(total, shard.copy())
+        return total
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(total, shard):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{self._labels(labels)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        data = shard.get(labels)
+        if data is None:
+            # One slot per bucket, one for +Inf, then the sum
+            data = shard[labels] = [0] * (len(self.buckets) + 2)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a block; also usable as a decorator"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    @staticmethod
+    def _merge(total, shard):
+        for labels, data in shard.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(data)
+            else:
+                for i, value in enumerate(data):
+                    merged[i] += value
+
+    def samples(self):
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, data in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, data):
+                cumulative += count
+                yield f"{self.name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {_number(data[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """Register ``func() -> [(name, type, documentation, [(labels dict, value), ...]), ...]``"""
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for collector in collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = ",".join(f'{key}="{_escape(v)}"' for key, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {_number(value)}" if label_text else f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Global registry and the metrics recorded on the hot paths
+registry = Registry()
+
+http_requests = registry.counter(
+    "ozon_http_requests_total", "HTTP requests by view, method and status code", ("view", "method", "status")
+)
+http_request_seconds = registry.histogram(
+    "ozon_http_request_duration_seconds", "Time to produce the response, by view", ("view", "method")
+)
+http_db_queries = registry.histogram(
+    "ozon_http_request_db_queries", "Database queries per request, by view", ("view",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+http_db_seconds = registry.histogram(
+    "ozon_http_request_db_seconds", "Time spent in database queries per request, by view", ("view",)
+)
+mqtt_messages = registry.counter(
+    "ozon_mqtt_messages_total", "MQTT messages received, by topic type (status, event, unknown, invalid)", ("type",)
+)
+mqtt_handler_seconds = registry.histogram(
+    "ozon_mqtt_handler_duration_seconds", "Time to handle an MQTT message on a DB worker", ("handler",)
+)
+mqtt_handler_errors = registry.counter(
+    "ozon_mqtt_handler_errors_total", "MQTT messages whose handler failed", ("handler",)
+)
+mqtt_dropped = registry.counter(
+    "ozon_mqtt_dropped_total", "MQTT messages dropped because their worker queue stayed full"
+)
+mqtt_connections = registry.counter(
+    "ozon_mqtt_connections_total", "MQTT broker connection attempts, by result", ("result",)
+)
+mqtt_reconnects = registry.counter("ozon_mqtt_reconnects_total", "MQTT broker connections after the first")
+mqtt_disconnects = registry.counter("ozon_mqtt_disconnects_total", "MQTT broker disconnections")
+
+
+@registry.collector
+def _component_stats():
+    # Imported here: these modules record into the metrics above
+    from .analytics_cache import analytics_cache
+    from .fleet_cache import fleet_status
+    from .idempotency import recent_event_keys
+    from .ingest_buffer import ingest_buffer
+    from .live import live_hub
+    from .mqtt_client import mqtt_client
+    from .presence import presence
+    from .versioning import version_bumper
+
+    components = {
+        "analytics_cache": analytics_cache.stats(),
+        "fleet_cache": fleet_status.stats(),
+        "idempotency_keys": recent_event_keys.stats(),
+        "live": live_hub.stats(),
+        "presence": presence.stats(),
+        "fleet_version": version_bumper.stats(),
+        "mqtt_workers": mqtt_client.queue_stats(),
+        "mqtt_status_coalescer": mqtt_client.statuses.stats(),
+        "ingest_buffer": ingest_buffer.stats(),
+        "mqtt": {"connected": mqtt_client.connected},
+    }
+    for component, stats in components.items():
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                yield f"ozon_{component}_{key}", "gauge", f"{component} {key.replace('_', ' ')}", [({}, int(value) if isinstance(value, bool) else value)]
+
+
+def serve(port, host=""):
+    """Serve ``/metrics`` from a background thread, for processes without an HTTP server (``start_mqtt``)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
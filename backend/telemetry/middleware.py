@@ -0,0 +1,101 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from .metrics import http_requests, http_request_seconds, http_db_queries, http_db_seconds
+from .profiling import sample_request, capture
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` counting the queries of a request and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+def view_label(request):
+    """Low-cardinality name of the view that served ``request``"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route
+
+
+class MetricsMiddleware:
+    """Records latency, status and database queries per view (see ``telemetry.metrics``).
+
+    Put it first in MIDDLEWARE so the latency covers the whole stack. Async
+    views run their queries on other threads, so only their latency is
+    recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        queries = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def _acall(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _record(request, response, seconds, queries=None):
+        view = view_label(request)
+        http_requests.inc(view, request.method, str(response.status_code))
+        http_request_seconds.observe(seconds, view, request.method)
+        if queries is not None:
+            http_db_queries.observe(queries.count, view)
+            http_db_seconds.observe(queries.seconds, view)
+
+
+class ProfilingMiddleware:
+    """Captures SQL and a cProfile of sampled requests (see ``telemetry.profiling``).
+
+    The response of a captured request carries its ``X-Profile-Id``. Async
+    views are not profiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.get_response(request)
+        if not sample_request(request):
+            return self.get_response(request)
+        with capture("http", request.path, method=request.method, query=request.META.get("QUERY_STRING", "")) as record:
+            response = self.get_response(request)
+            record["view"] = view_label(request)
+            record["status"] = response.status_code
+        response["X-Profile-Id"] = record["id"]
+        return response
@@ -0,0 +1,71 @@
+"""Migration operations that build indexes on large tables without blocking writes.
+
+On PostgreSQL the index is built CONCURRENTLY, which cannot run inside a
+transaction, so migrations using these must set ``atomic = False``. Other
+backends get the plain operation. The backend is taken from the schema
+editor's connection when the operation runs, so ``migrate --database`` and
+``sqlmigrate`` against another backend get the right statements.
+"""
+from django.db import NotSupportedError, migrations
+
+
+def _concurrently(schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError("Building an index concurrently cannot run inside a transaction; set atomic = False")
+    return True
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """``django.contrib.postgres``'s AddIndexConcurrently on PostgreSQL, a plain AddIndex elsewhere"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if _concurrently(schema_editor):
+            self._postgres().database_forwards(app_label, schema_editor, from_state, to_state)
+        else:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if _concurrently(schema_editor):
+            self._postgres().database_backwards(app_label, schema_editor, from_state, to_state)
+        else:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def _postgres(self):
+        # Imported here: it needs psycopg, which SQLite-only installs lack
+        from django.contrib.postgres.operations import AddIndexConcurrently
+
+        return AddIndexConcurrently(self.model_name, self.index)
+
+
+class AlterFieldUniqueConcurrently(migrations.AlterField):
+    """AlterField making a field unique.
+
+    On PostgreSQL the unique index is built CONCURRENTLY and then attached as
+    the field's unique constraint; elsewhere this is a plain AlterField.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            table, column, name = self._names(schema_editor, model)
+            schema_editor.execute(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({column})")
+            schema_editor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _concurrently(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            table, _, name = self._names(schema_editor, model)
+            schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+
+    def _names(self, schema_editor, model):
+        # The constraint name Django itself would give the unique field
+        table = model._meta.db_table
+        column = model._meta.get_field(self.name).column
+        name = schema_editor._create_index_name(table, [column], suffix="_uniq")
+        return schema_editor.quote_name(table), schema_editor.quote_name(column), schema_editor.quote_name(name)
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+COUNTER_FIELDS = {
+    'BASIC': 'total_basic_count',
+    'STANDARD': 'total_standard_count',
+    'PREMIUM': 'total_premium_count',
+}
+
+
+def backfill_counters(apps, schema_editor):
+    """Seed the counters from existing events with a single GROUP BY"""
+    TelemetryEvent = apps.get_model('telemetry', 'TelemetryEvent')
+    DeviceStatus = apps.get_model('telemetry', 'DeviceStatus')
+
+    counts = {}
+    rows = (
+        TelemetryEvent.objects.filter(event_type__in=COUNTER_FIELDS)
+        .values_list('device_id', 'event_type')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for device_id, event_type, n in rows:
+        counts.setdefault(device_id, {})[event_type] = n
+
+    devices = list(DeviceStatus.objects.filter(device_id__in=counts))
+    for device in devices:
+        for event_type, field in COUNTER_FIELDS.items():
+            setattr(device, field, counts[device.device_id].get(event_type, 0))
+    DeviceStatus.objects.bulk_update(devices, list(COUNTER_FIELDS.values()), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0006_migrate_machine_devices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicestatus',
+            name='total_basic_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='devicestatus',
+            name='total_premium_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='devicestatus',
+            name='total_standard_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
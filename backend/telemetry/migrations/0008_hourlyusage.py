@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0007_devicestatus_event_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=128)),
+                ('hour', models.DateTimeField(help_text='Start of the hour (UTC)')),
+                ('event_type', models.CharField(choices=[('BASIC', 'BASIC'), ('STANDARD', 'STANDARD'), ('PREMIUM', 'PREMIUM'), ('status', 'Status Update')], max_length=16)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour', 'device_id'],
+                'indexes': [models.Index(fields=['hour'], name='hourly_usage_hour_idx')],
+                'unique_together': {('device_id', 'hour', 'event_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:39
+
+from django.db import migrations, models
+from telemetry.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('telemetry', '0009_changecounter'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='devicestatus',
+            index=models.Index(fields=['last_seen'], name='device_last_seen_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telemetryevent',
+            index=models.Index(fields=['device_id', 'occurred_at'], name='event_device_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telemetryevent',
+            index=models.Index(fields=['device_id', 'event_type'], name='event_device_type_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telemetryevent',
+            index=models.Index(condition=models.Q(('event_type', 'status'), _negated=True), fields=['device_id', 'occurred_at'], name='event_trigger_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telemetryrecord',
+            index=models.Index(fields=['device_id', 'created_at'], name='record_device_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='telemetryrecord',
+            index=models.Index(fields=['created_at'], name='record_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telemetryevent',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
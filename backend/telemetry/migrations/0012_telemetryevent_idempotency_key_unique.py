@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+from django.db import migrations, models
+from telemetry.migration_operations import AlterFieldUniqueConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('telemetry', '0011_telemetryevent_idempotency_key'),
+    ]
+
+    operations = [
+        AlterFieldUniqueConcurrently(
+            model_name='telemetryevent',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=32, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0012_telemetryevent_idempotency_key_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PresenceTransition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_id', models.CharField(max_length=128)),
+                ('online', models.BooleanField()),
+                ('occurred_at', models.DateTimeField()),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-occurred_at'],
+                'indexes': [models.Index(fields=['device_id', 'occurred_at'], name='presence_device_time_idx'), models.Index(fields=['occurred_at'], name='presence_time_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from django.db import models
 
 
@@ -13,6 +14,12 @@ class TelemetryRecord(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Latest record per device
+            models.Index(fields=['device_id', 'created_at'], name='record_device_created_idx'),
+            # Latest record overall and retention purges by age
+            models.Index(fields=['created_at'], name='record_created_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.device_id} @ {self.created_at.isoformat()}"
@@ -39,9 +46,24 @@ class TelemetryEvent(models.Model):
     device_timestamp = models.CharField(max_length=25, null=True, blank=True, help_text="Timestamp from ESP32 device")
     wifi_status = models.BooleanField(null=True, blank=True, help_text="WiFi connection status")
     payload = models.JSONField(null=True, blank=True)
+    # Hash of device, device timestamp, type and cumulative count; a resent
+    # trigger carries the same key and is rejected (see idempotency.event_key)
+    idempotency_key = models.CharField(max_length=32, null=True, blank=True, unique=True)
 
     class Meta:
         ordering = ["-occurred_at", "-id"]
+        indexes = [
+            # Device + time range: analytics, exports and event pages
+            models.Index(fields=['device_id', 'occurred_at'], name='event_device_time_idx'),
+            # Per-device counts by event type
+            models.Index(fields=['device_id', 'event_type'], name='event_device_type_idx'),
+            # Real triggers only, for the many queries that exclude heartbeats
+            models.Index(
+                fields=['device_id', 'occurred_at'],
+                name='event_trigger_time_idx',
+                condition=~models.Q(event_type='status'),
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"{self.device_id} {self.event_type} @ {self.occurred_at.isoformat()}"
@@ -59,43 +81,51 @@ class DeviceStatus(models.Model):
     current_count_premium = models.IntegerField(default=0)
     uptime_seconds = models.IntegerField(null=True, blank=True)
     device_timestamp = models.CharField(max_length=25, null=True, blank=True)
+    # Accumulated TelemetryEvent counts, incremented alongside each event insert
+    total_basic_count = models.IntegerField(default=0)
+    total_standard_count = models.IntegerField(default=0)
+    total_premium_count = models.IntegerField(default=0)
+
+    COUNTER_FIELDS = {
+        TelemetryEvent.EVENT_BASIC: 'total_basic_count',
+        TelemetryEvent.EVENT_STANDARD: 'total_standard_count',
+        TelemetryEvent.EVENT_PREMIUM: 'total_premium_count',
+    }
+    # Devices seen within this window count as online
+    ONLINE_WINDOW = timedelta(minutes=5)
     
     class Meta:
         ordering = ["-last_seen"]
+        # Online devices are a last_seen range
+        indexes = [models.Index(fields=['last_seen'], name='device_last_seen_idx')]
 
     def __str__(self) -> str:
         return f"{self.device_id} - Last seen: {self.last_seen}"
     
     def get_accumulated_basic_count(self):
-        """Get accumulated basic count from database events"""
-        from django.db.models import Count
-        return TelemetryEvent.objects.filter(
-            device_id=self.device_id,
-            event_type='BASIC'
-        ).count()
+        """Get accumulated basic count"""
+        return self.total_basic_count
     
     def get_accumulated_standard_count(self):
-        """Get accumulated standard count from database events"""
-        from django.db.models import Count
-        return TelemetryEvent.objects.filter(
-            device_id=self.device_id,
-            event_type='STANDARD'
-        ).count()
+        """Get accumulated standard count"""
+        return self.total_standard_count
     
     def get_accumulated_premium_count(self):
-        """Get accumulated premium count from database events"""
-        from django.db.models import Count
-        return TelemetryEvent.objects.filter(
-            device_id=self.device_id,
-            event_type='PREMIUM'
-        ).count()
+        """Get accumulated premium count"""
+        return self.total_premium_count
     
     def update_accumulated_counts(self):
-        """Update the current counts with accumulated values from database"""
-        self.current_count_basic = self.get_accumulated_basic_count()
-        self.current_count_standard = self.get_accumulated_standard_count()
-        self.current_count_premium = self.get_accumulated_premium_count()
-        self.save()
+        """Recount this device's accumulated counters from its events"""
+        from django.db.models import Count
+        counts = dict(
+            TelemetryEvent.objects.filter(device_id=self.device_id)
+            .values_list('event_type')
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        for event_type, field in self.COUNTER_FIELDS.items():
+            setattr(self, field, counts.get(event_type, 0))
+        self.save(update_fields=list(self.COUNTER_FIELDS.values()))
 
 
 class UsageStatistics(models.Model):
@@ -117,6 +147,53 @@ class UsageStatistics(models.Model):
         return f"{self.device_id} - {self.date}: {self.total_events} events"
 
 
+class HourlyUsage(models.Model):
+    """Hourly event counts per device and event type, maintained at ingest time"""
+    device_id = models.CharField(max_length=128)
+    hour = models.DateTimeField(help_text="Start of the hour (UTC)")
+    event_type = models.CharField(max_length=16, choices=TelemetryEvent.EVENT_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        # The unique index doubles as the (device_id, hour) range-scan index
+        unique_together = ['device_id', 'hour', 'event_type']
+        indexes = [models.Index(fields=['hour'], name='hourly_usage_hour_idx')]
+        ordering = ["-hour", "device_id"]
+
+    def __str__(self) -> str:
+        return f"{self.device_id} {self.event_type} @ {self.hour.isoformat()}: {self.count}"
+
+
+class ChangeCounter(models.Model):
+    """Named monotonic version number, bumped whenever the data it covers changes"""
+    name = models.CharField(max_length=64, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} v{self.version}"
+
+
+class PresenceTransition(models.Model):
+    """A device coming online or going offline, recorded by telemetry.presence"""
+    device_id = models.CharField(max_length=128)
+    online = models.BooleanField()
+    # When the device was first seen again, or when its timeout ran out
+    occurred_at = models.DateTimeField()
+    # Offline transitions only: when the device was last heard from
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['device_id', 'occurred_at'], name='presence_device_time_idx'),
+            models.Index(fields=['occurred_at'], name='presence_time_idx'),
+        ]
+        ordering = ["-occurred_at"]
+
+    def __str__(self) -> str:
+        return f"{self.device_id} {'online' if self.online else 'offline'} @ {self.occurred_at.isoformat()}"
+
+
 class Outlet(models.Model):
     """Outlet/Location where machines are installed"""
     name = models.CharField(max_length=200, unique=True)
@@ -156,6 +233,9 @@ class Machine(models.Model):
     @property
     def current_device(self):
         """Get the currently active device for this machine"""
+        if 'devices' in getattr(self, '_prefetched_objects_cache', {}):
+            # Prefetched devices follow MachineDevice ordering, active and newest first
+            return next((device for device in self.devices.all() if device.is_active), None)
         return self.devices.filter(is_active=True).first()
     
     @property
@@ -1,24 +1,54 @@
 import json
 import logging
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from paho.mqtt.client import Client
-from .models import TelemetryEvent, DeviceStatus
-from datetime import datetime
+from .mqtt_workers import ShardedWorkerPool
+from .status_coalescer import StatusCoalescer
+from .upserts import insert_event, upsert_device_status, upsert_daily_statistics, daily_totals, upsert_hourly_usage, hourly_totals
+from .versioning import bump_device_generations, fleet_changed
+from .live import publish_status, publish_event
+from .idempotency import event_key, recent_event_keys
+from .profiling import sample_mqtt, profiled
+from .metrics import (
+    mqtt_messages, mqtt_handler_seconds, mqtt_handler_errors, mqtt_connections, mqtt_reconnects, mqtt_disconnects,
+)
 
 logger = logging.getLogger(__name__)
 
 class MQTTClient:
+    # Status payload keys mapped to DeviceStatus fields
+    STATUS_FIELDS = {
+        'basic_count': 'current_count_basic',
+        'standard_count': 'current_count_standard',
+        'premium_count': 'current_count_premium',
+        'wifi_connected': 'wifi_connected',
+        'rtc_available': 'rtc_available',
+    }
+
     def __init__(self):
         self.client = Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
+        self.ever_connected = False
+        self.workers = ShardedWorkerPool(
+            workers=getattr(settings, 'MQTT_WORKER_COUNT', 4),
+            queue_size=getattr(settings, 'MQTT_WORKER_QUEUE_SIZE', 1000),
+            put_timeout=getattr(settings, 'MQTT_WORKER_PUT_TIMEOUT', 10.0),
+        )
+        # Heartbeats are written in batches; see telemetry.status_coalescer
+        self.statuses = StatusCoalescer()
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logger.info("Connected to MQTT broker")
-            self.connected = True
+            mqtt_connections.inc('success')
+            if self.ever_connected:
+                mqtt_reconnects.inc()
+            self.connected = self.ever_connected = True
             
             # Subscribe to all telemetry topics
             client.subscribe(f"{settings.MQTT_TOPIC_STATUS}+")  # telemetry/status/+
@@ -26,13 +56,16 @@ class MQTTClient:
             logger.info(f"Subscribed to {settings.MQTT_TOPIC_STATUS}+ and {settings.MQTT_TOPIC_EVENTS}+")
         else:
             logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
+            mqtt_connections.inc('failure')
             self.connected = False
     
     def on_disconnect(self, client, userdata, rc):
         logger.warning("Disconnected from MQTT broker")
+        mqtt_disconnects.inc()
         self.connected = False
     
     def on_message(self, client, userdata, msg):
+        """Decode on the network thread and hand DB work to the worker pool"""
         try:
             topic = msg.topic
             payload = json.loads(msg.payload.decode())
@@ -44,56 +77,59 @@ class MQTTClient:
             device_id = topic.split('/')[-1]
             
             if 'status' in topic:
-                self.handle_status_message(device_id, payload)
+                mqtt_messages.inc('status')
+                handler = self.handle_status_message
             elif 'events' in topic:
-                self.handle_event_message(device_id, payload)
+                mqtt_messages.inc('event')
+                handler = self.handle_event_message
             else:
+                mqtt_messages.inc('unknown')
                 logger.warning(f"Unknown topic: {topic}")
+                return
+            if sample_mqtt():
+                # Profile the DB work this message triggers, on its worker
+                handler = profiled(handler, 'mqtt', handler.__name__, topic=topic)
+            self.workers.submit(device_id, handler, device_id, payload)
                 
         except json.JSONDecodeError as e:
+            mqtt_messages.inc('invalid')
             logger.error(f"Failed to parse JSON message: {e}")
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
     
+    @mqtt_handler_seconds.time('handle_status_message')
     def handle_status_message(self, device_id, payload):
         """Handle status messages from ESP32 devices"""
         try:
             data = payload.get('data', {})
             
-            # Create or update device status
-            device_status, created = DeviceStatus.objects.get_or_create(
-                device_id=device_id,
-                defaults={
-                    'current_count_basic': data.get('basic_count', 0),
-                    'current_count_standard': data.get('standard_count', 0),
-                    'current_count_premium': data.get('premium_count', 0),
-                    'wifi_connected': data.get('wifi_connected', False),
-                    'rtc_available': data.get('rtc_available', False),
-                    'last_seen': datetime.now()
-                }
-            )
-            
-            if not created:
-                # Update existing status
-                device_status.current_count_basic = data.get('basic_count', device_status.current_count_basic)
-                device_status.current_count_standard = data.get('standard_count', device_status.current_count_standard)
-                device_status.current_count_premium = data.get('premium_count', device_status.current_count_premium)
-                device_status.wifi_connected = data.get('wifi_connected', device_status.wifi_connected)
-                device_status.rtc_available = data.get('rtc_available', device_status.rtc_available)
-                device_status.last_seen = datetime.now()
-                device_status.save()
-            
-            logger.info(f"Updated status for device {device_id}")
+            # Only the fields this message carries are overwritten; the
+            # write itself is coalesced with the device's other heartbeats
+            values = {
+                field: data[key]
+                for key, field in self.STATUS_FIELDS.items()
+                if key in data
+            }
+            self.statuses.add(device_id, values)
+            publish_status(device_id, values, timezone.now())
+            
+            logger.info(f"Queued status for device {device_id}")
             
         except Exception as e:
+            mqtt_handler_errors.inc('handle_status_message')
             logger.error(f"Error handling status message: {e}")
     
+    @mqtt_handler_seconds.time('handle_event_message')
     def handle_event_message(self, device_id, payload):
         """Handle event messages from ESP32 devices"""
         try:
             data = payload.get('data', {})
             event_type = data.get('event_type', 'UNKNOWN')
             count = data.get('count', 0)
+            # Cumulative counter of this event type after the press. Without it
+            # (older firmware) two presses in the same second look like a
+            # resend, so such events get no idempotency key and are all stored
+            total = data.get('total')
             
             # Create telemetry event
             # The count field represents the number of events (always 1 for each button press)
@@ -101,10 +137,15 @@ class MQTTClient:
             event_data = {
                 'device_id': device_id,
                 'event_type': event_type,
-                'occurred_at': datetime.now(),
+                'occurred_at': timezone.now(),
                 'device_timestamp': payload.get('timestamp', ''),
-                'payload': payload
+                'payload': payload,
+                'idempotency_key': event_key(device_id, payload.get('timestamp'), event_type, total) if total is not None else None,
             }
+            # A resent message is dropped without touching the database
+            if recent_event_keys.seen(event_data['idempotency_key']):
+                logger.info(f"Ignored resent event for device {device_id}: {event_type} count={count}")
+                return
             
             # Set the count field based on event type
             if event_type == 'BASIC':
@@ -114,19 +155,26 @@ class MQTTClient:
             elif event_type == 'PREMIUM':
                 event_data['count_premium'] = count
             
-            TelemetryEvent.objects.create(**event_data)
+            # Insert the event and bump the device's accumulated counter together
+            with transaction.atomic():
+                if insert_event(event_data) is None:
+                    recent_event_keys.add(event_data['idempotency_key'])
+                    logger.info(f"Ignored resent event for device {device_id}: {event_type} count={count}")
+                    return
+                upsert_device_status(device_id, counts={event_type: 1})
+                # The same daily and hourly rollups the HTTP ingest paths maintain
+                event = [(device_id, event_type, event_data['occurred_at'])]
+                upsert_daily_statistics(daily_totals(event))
+                upsert_hourly_usage(hourly_totals(event))
+                bump_device_generations([device_id])
+                fleet_changed()
+            recent_event_keys.add(event_data['idempotency_key'])
+            publish_event(event_data)
             
             logger.info(f"Created event for device {device_id}: {event_type} count={count}")
             
-            # Update accumulated counts for this device
-            try:
-                device_status = DeviceStatus.objects.get(device_id=device_id)
-                device_status.update_accumulated_counts()
-                logger.info(f"Updated accumulated counts for device {device_id}")
-            except DeviceStatus.DoesNotExist:
-                logger.warning(f"Device status not found for {device_id}")
-            
         except Exception as e:
+            mqtt_handler_errors.inc('handle_event_message')
             logger.error(f"Error handling event message: {e}")
     
     def connect(self):
@@ -139,16 +187,19 @@ class MQTTClient:
             result = self.client.connect(settings.MQTT_BROKER, settings.MQTT_PORT, 60)
             
             if result == 0:
+                self.start_workers()
                 self.client.loop_start()
                 # Wait for connection callback to set self.connected
                 import time
                 time.sleep(2)
             else:
                 logger.error(f"Failed to connect to MQTT broker. Result: {result}")
+                mqtt_connections.inc('failure')
                 self.connected = False
             
         except Exception as e:
             logger.error(f"Failed to connect to MQTT broker: {e}")
+            mqtt_connections.inc('failure')
             self.connected = False
     
     def disconnect(self):
@@ -156,8 +207,23 @@ class MQTTClient:
         self.client.loop_stop()
         self.client.disconnect()
         self.connected = False
+        self.stop_workers()
         logger.info("Disconnected from MQTT broker")
     
+    def start_workers(self):
+        """Start the DB worker pool and the status flush thread"""
+        self.workers.start()
+        self.statuses.start()
+    
+    def stop_workers(self):
+        """Finish queued messages, then write the pending statuses"""
+        self.workers.stop()
+        self.statuses.stop()
+    
+    def queue_stats(self):
+        """Queue depth and throughput of the DB worker pool"""
+        return self.workers.stats()
+    
     def publish_command(self, device_id, command):
         """Publish a command to a specific device"""
         try:
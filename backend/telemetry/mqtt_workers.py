@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import zlib
+from django.db import close_old_connections, connection
+from .metrics import mqtt_dropped
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedWorkerPool:
+    """Bounded pool of DB worker threads for the MQTT consumer.
+
+    Each worker owns one bounded queue and messages are sharded onto the
+    queues by a stable hash of ``device_id``, so messages from one device are
+    always handled by the same worker in arrival order. ``submit`` blocks when
+    the shard is full (backpressure onto the network thread) and drops the
+    message only after ``put_timeout`` seconds.
+
+    Dropping is a deliberate trade-off: paho acknowledges the message once
+    ``on_message`` returns, so a dropped message is lost (counted in
+    ``ozon_mqtt_dropped_total``), but a network thread blocked for longer
+    would miss keepalives and be disconnected by the broker. ``put_timeout=None`` never drops and blocks
+    for as long as the shard stays full.
+    """
+
+    def __init__(self, workers=4, queue_size=1000, put_timeout=10.0, name="mqtt-db"):
+        self.workers = max(1, int(workers))
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.name = name
+        self.dropped = 0
+        self.processed = 0
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            for index, shard in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._run, args=(shard,), name=f"{self.name}-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started {self.workers} MQTT DB workers (queue size {self.queue_size} each)")
+
+    def stop(self, timeout=30.0):
+        """Drain the queues and stop the workers"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for shard in self._queues:
+            shard.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+    def shard_for(self, device_id):
+        return zlib.crc32(str(device_id).encode()) % self.workers
+
+    def submit(self, device_id, func, *args):
+        """Queue ``func(*args)`` on the worker owning ``device_id``.
+
+        Returns False if the message was dropped because the shard stayed full.
+        """
+        shard = self._queues[self.shard_for(device_id)]
+        try:
+            shard.put((func, args), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            mqtt_dropped.inc()
+            logger.error(f"MQTT worker queue full, dropped message for device {device_id}")
+            return False
+        return True
+
+    def queue_depths(self):
+        """Current number of pending messages per shard"""
+        return [shard.qsize() for shard in self._queues]
+
+    def stats(self):
+        depths = self.queue_depths()
+        return {
+            "workers": self.workers,
+            "queue_depth": sum(depths),
+            "queue_depths": depths,
+            "queue_capacity": self.queue_size * self.workers,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+    def _run(self, shard):
+        try:
+            while True:
+                item = shard.get()
+                if item is None:
+                    break
+                func, args = item
+                # Drop connections that are broken or past CONN_MAX_AGE before touching the DB
+                close_old_connections()
+                try:
+                    func(*args)
+                except Exception as e:
+                    logger.error(f"Error in MQTT worker: {e}")
+                with self._lock:
+                    self.processed += 1
+        finally:
+            # Django connections are per thread; release this worker's connection
+            connection.close()
@@ -0,0 +1,98 @@
+"""Keyset (cursor) pagination for the append-only telemetry tables.
+
+Pages are ordered newest first on ``(<time field>, id)`` and the cursor
+holds the last row's pair, so every page is one index range scan of at most
+``limit`` rows no matter how deep it is. No COUNT(*) runs unless the client
+asks for ``count=true``, and even then it stops at ``MAX_COUNT``.
+"""
+import base64
+from collections import OrderedDict
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    time_field = None
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    page_size = 100
+    max_page_size = 1000
+    # count=true reports at most this many rows
+    MAX_COUNT = 10_000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get("count") == "true":
+            self.count = queryset.order_by()[:self.MAX_COUNT].count()
+
+        queryset = queryset.order_by(f"-{self.time_field}", "-id")
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            moment, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f"{self.time_field}__lt": moment}) | Q(**{self.time_field: moment, "id__lt": pk})
+            )
+        # One extra row tells whether another page exists
+        rows = list(queryset[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(getattr(self.last, self.time_field), self.last.pk)
+        return replace_query_param(remove_query_param(url, "count"), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        body = OrderedDict([("next", self.get_next_link()), ("results", data)])
+        if self.count is not None:
+            body["count"] = self.count
+            body["count_capped"] = self.count >= self.MAX_COUNT
+        return Response(body)
+
+    def encode_cursor(self, moment, pk):
+        return base64.urlsafe_b64encode(f"{moment.isoformat()}|{pk}".encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """``(moment, pk)`` of a cursor from ``encode_cursor``; anything else is a 400"""
+        try:
+            moment, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            moment, pk = parse_datetime(moment), int(pk)
+            # Cursors carry an aware time and a primary key the database can compare
+            if moment is None or timezone.is_naive(moment) or not 0 < pk < 2 ** 63:
+                raise ValueError(cursor)
+            return moment, pk
+        except (ValueError, UnicodeDecodeError):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor"})
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {"name": self.cursor_query_param, "required": False, "in": "query", "schema": {"type": "string"}},
+            {"name": self.page_size_query_param, "required": False, "in": "query", "schema": {"type": "integer"}},
+            {"name": "count", "required": False, "in": "query", "schema": {"type": "boolean"}},
+        ]
+
+
+class EventPagination(KeysetPagination):
+    time_field = "occurred_at"
+
+
+class RecordPagination(KeysetPagination):
+    time_field = "created_at"
@@ -0,0 +1,239 @@
+"""In-memory device presence with recorded online/offline transitions.
+
+Every live reading marks its device seen (``live.publish_status`` and
+``publish_event``, which all ingest paths call). A device goes offline once
+it has not been seen for its timeout: PRESENCE_TIMEOUT, or its entry in
+PRESENCE_DEVICE_TIMEOUTS. Deadlines sit on a hashed timing wheel of
+``tick``-second slots, so marking a device seen moves it between two slots
+and each tick visits only the devices due in that slot: detecting an
+offline device costs O(1) however large the fleet. Transitions are recorded
+as PresenceTransition rows, written in batches by the tick thread, and
+passed to the registered listeners (the live channel).
+
+The state is per process. At start and every ``sync_interval`` seconds the
+tracker also reads recently seen devices from DeviceStatus, so devices
+ingested by another process (``start_mqtt``) appear here after at most that
+delay. Every process detects transitions for its listeners, but only one
+records them: ``start_mqtt``, or the process with
+PRESENCE_RECORD_TRANSITIONS=1.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Max
+from .models import DeviceStatus, PresenceTransition
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    def __init__(self, tick=None, timeout=None, device_timeouts=None, sync_interval=None, record=None):
+        self.tick = tick or getattr(settings, "PRESENCE_TICK", 1.0)
+        self.timeout = timeout or getattr(settings, "PRESENCE_TIMEOUT", DeviceStatus.ONLINE_WINDOW.total_seconds())
+        if device_timeouts is None:
+            device_timeouts = getattr(settings, "PRESENCE_DEVICE_TIMEOUTS", {})
+        self.device_timeouts = dict(device_timeouts)
+        self.sync_interval = sync_interval or getattr(settings, "PRESENCE_SYNC_INTERVAL", 30.0)
+        self.record = getattr(settings, "PRESENCE_RECORD_TRANSITIONS", True) if record is None else record
+        # One revolution spans the default timeout; longer deadlines stay in
+        # their slot for later revolutions
+        self._slots = [set() for _ in range(int(self.timeout / self.tick) + 2)]
+        self._devices = {}  # online device_id -> [last seen (epoch seconds), deadline tick]
+        self._persisted_online = set()  # recorded as online before this process started
+        self._pending = []  # PresenceTransition rows to write
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_tick = None
+        self.counters = {"seen": 0, "online": 0, "offline": 0}
+
+    def add_listener(self, callback):
+        """Call ``callback(device_id, online)`` on every transition, from the thread that detected it"""
+        self._listeners.append(callback)
+        return callback
+
+    def set_timeout(self, device_id, seconds):
+        """Offline timeout of one device, applied from its next reading (None restores the default)"""
+        with self._lock:
+            if seconds is None:
+                self.device_timeouts.pop(device_id, None)
+            else:
+                self.device_timeouts[device_id] = seconds
+
+    def seen(self, device_id, at=None):
+        """Mark ``device_id`` seen at epoch second ``at`` (default now)"""
+        self.start()
+        self._seen(device_id, at)
+
+    def _seen(self, device_id, at=None):
+        now = time.time()
+        at = now if at is None else at
+        with self._lock:
+            self.counters["seen"] += 1
+            deadline = at + self.device_timeouts.get(device_id, self.timeout)
+            if deadline <= now:
+                return
+            deadline_tick = math.ceil(deadline / self.tick)
+            state = self._devices.get(device_id)
+            if state is not None:
+                if at <= state[0]:
+                    return
+                if state[1] % len(self._slots) != deadline_tick % len(self._slots):
+                    self._slots[state[1] % len(self._slots)].discard(device_id)
+                    self._slots[deadline_tick % len(self._slots)].add(device_id)
+                state[0], state[1] = at, deadline_tick
+                return
+            self._devices[device_id] = [at, deadline_tick]
+            self._slots[deadline_tick % len(self._slots)].add(device_id)
+            if device_id in self._persisted_online:
+                # Still online from before this process started
+                self._persisted_online.discard(device_id)
+                return
+        self._transition(device_id, True, at)
+
+    def online(self):
+        """``{device_id: epoch second it goes offline unless seen again}`` of the online devices"""
+        self.start()
+        with self._lock:
+            return {device_id: deadline * self.tick for device_id, (_, deadline) in self._devices.items()}
+
+    def is_online(self, device_id):
+        self.start()
+        return device_id in self._devices
+
+    def start(self):
+        """Load the current state and start the tick thread (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._last_tick = math.floor(time.time() / self.tick)
+            self._bootstrap()
+            self._stopping.clear()
+            thread = threading.Thread(target=self._run, name="presence", daemon=True)
+            thread.start()
+            self._thread = thread
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the tick thread and write the pending transitions"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.tick + 30)
+        self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Write the pending transitions; returns the number written"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            PresenceTransition.objects.bulk_create(batch)
+        except Exception as e:
+            logger.error(f"Failed to record {len(batch)} presence transitions: {e}")
+            with self._lock:
+                self._pending = batch + self._pending
+            return 0
+        return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "online_devices": len(self._devices), "pending_transitions": len(self._pending)}
+
+    def expire(self, now=None):
+        """Take offline the devices whose deadline passed; called every tick"""
+        now = time.time() if now is None else now
+        current = math.floor(now / self.tick)
+        expired = []
+        with self._lock:
+            first = current if self._last_tick is None else self._last_tick + 1
+            # After a stall, one revolution visits every slot
+            for tick in range(max(first, current - len(self._slots) + 1), current + 1):
+                slot = self._slots[tick % len(self._slots)]
+                due = [device_id for device_id in slot if self._devices[device_id][1] <= current]
+                for device_id in due:
+                    slot.discard(device_id)
+                    last_seen, deadline = self._devices.pop(device_id)
+                    expired.append((device_id, last_seen, deadline * self.tick))
+            self._last_tick = current
+        for device_id, last_seen, offline_at in expired:
+            self._transition(device_id, False, offline_at, last_seen)
+        return len(expired)
+
+    def sync(self):
+        """Mark seen the devices whose DeviceStatus shows a recent reading"""
+        longest = max([self.timeout, *self.device_timeouts.values()])
+        cutoff = datetime.fromtimestamp(time.time() - longest, tz=dt_timezone.utc)
+        rows = DeviceStatus.objects.filter(last_seen__gte=cutoff).values_list("device_id", "last_seen")
+        for device_id, last_seen in rows:
+            self._seen(device_id, last_seen.timestamp())
+
+    def _bootstrap(self):
+        # Devices whose last recorded transition is "online" stay online
+        # without a new record; those that went quiet meanwhile are recorded
+        # offline at their deadline
+        latest = PresenceTransition.objects.values("device_id").annotate(last_id=Max("id")).values("last_id")
+        persisted = set(
+            PresenceTransition.objects.filter(id__in=latest, online=True).values_list("device_id", flat=True)
+        )
+        with self._lock:
+            self._persisted_online = persisted
+        self.sync()
+        with self._lock:
+            quiet, self._persisted_online = self._persisted_online, set()
+        if quiet:
+            last_seen = dict(DeviceStatus.objects.filter(device_id__in=quiet).values_list("device_id", "last_seen"))
+            for device_id in quiet:
+                seen = last_seen.get(device_id)
+                if seen is None:
+                    continue
+                timeout = self.device_timeouts.get(device_id, self.timeout)
+                self._transition(device_id, False, seen.timestamp() + timeout, seen.timestamp())
+
+    def _transition(self, device_id, online, at, last_seen=None):
+        with self._lock:
+            self.counters["online" if online else "offline"] += 1
+            if self.record:
+                self._pending.append(PresenceTransition(
+                    device_id=device_id,
+                    online=online,
+                    occurred_at=datetime.fromtimestamp(at, tz=dt_timezone.utc),
+                    last_seen=datetime.fromtimestamp(last_seen, tz=dt_timezone.utc) if last_seen is not None else None,
+                ))
+        for listener in self._listeners:
+            try:
+                listener(device_id, online)
+            except Exception as e:
+                logger.error(f"Presence listener failed for {device_id}: {e}")
+
+    def _run(self):
+        next_sync = time.monotonic() + self.sync_interval
+        try:
+            while not self._stopping.wait(self.tick):
+                # Drop connections that are broken or past CONN_MAX_AGE before touching the DB
+                close_old_connections()
+                try:
+                    self.expire()
+                    if time.monotonic() >= next_sync:
+                        next_sync = time.monotonic() + self.sync_interval
+                        self.sync()
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"Presence tick failed: {e}")
+        finally:
+            connection.close()
+
+
+# Global tracker instance
+presence = PresenceTracker()
@@ -0,0 +1,227 @@
+"""Opt-in profiling of HTTP requests and MQTT messages.
+
+With PROFILING_ENABLED, a request is captured when it carries an
+``X-Profile: 1`` header or is picked at PROFILING_SAMPLE_RATE, and an MQTT
+message when it is picked at PROFILING_MQTT_SAMPLE_RATE. A capture records
+the wall time, every SQL statement with its time (flagging statements run
+repeatedly and exact duplicates) and a cProfile of the thread. Captures are
+written to PROFILING_DIR as JSON plus a ``.prof`` file for pstats/snakeviz,
+keeping the newest PROFILING_MAX_FILES. SQL is stored without parameters.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+
+# Entries kept per list (statements, functions) in a capture
+SUMMARY_LIMIT = 25
+
+
+def enabled():
+    return getattr(settings, "PROFILING_ENABLED", False)
+
+
+def sample_request(request):
+    """Whether to capture ``request``"""
+    if not enabled():
+        return False
+    if request.META.get("HTTP_X_PROFILE") == "1":
+        return True
+    return random.random() < getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+
+
+def sample_mqtt():
+    """Whether to capture the next MQTT message"""
+    return enabled() and random.random() < getattr(settings, "PROFILING_MQTT_SAMPLE_RATE", 0.0)
+
+
+class SqlCapture:
+    """``connection.execute_wrapper`` recording every statement and its time"""
+
+    def __init__(self):
+        self.queries = []  # (sql, parameters fingerprint, seconds)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # executemany batches never count as duplicates
+            fingerprint = None if many else hash(repr(params))
+            self.queries.append((sql, fingerprint, time.perf_counter() - start))
+
+    def summary(self, limit=SUMMARY_LIMIT):
+        statements, exact, seconds = Counter(), Counter(), {}
+        for sql, fingerprint, duration in self.queries:
+            statements[sql] += 1
+            seconds[sql] = seconds.get(sql, 0) + duration
+            if fingerprint is not None:
+                exact[(sql, fingerprint)] += 1
+        slowest = sorted(self.queries, key=lambda query: query[2], reverse=True)[:limit]
+        return {
+            "count": len(self.queries),
+            "ms": _ms(sum(duration for _, _, duration in self.queries)),
+            "slowest": [{"sql": sql, "ms": _ms(duration)} for sql, _, duration in slowest],
+            # Same statement with different parameters, e.g. a query per row (N+1)
+            "repeated": [
+                {"sql": sql, "count": n, "ms": _ms(seconds[sql])} for sql, n in statements.most_common(limit) if n > 1
+            ],
+            # Same statement with the same parameters
+            "duplicates": [{"sql": sql, "count": n} for (sql, _), n in exact.most_common(limit) if n > 1],
+        }
+
+
+def top_functions(profiler, limit=SUMMARY_LIMIT):
+    """Functions with the highest cumulative time in a cProfile"""
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_ms": _ms(own),
+            "cumulative_ms": _ms(cumulative),
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in ranked
+    ]
+
+
+class ProfileStore:
+    """Directory of captures, rotated to the newest ``max_files``"""
+
+    def __init__(self, directory=None, max_files=None):
+        self.directory = Path(directory or getattr(settings, "PROFILING_DIR", settings.BASE_DIR / "profiles"))
+        self.max_files = max_files or getattr(settings, "PROFILING_MAX_FILES", 200)
+        self._lock = threading.Lock()
+
+    def save(self, record, profiler=None):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{record['id']}.json"
+        if profiler is not None:
+            profiler.dump_stats(path.with_suffix(".prof"))
+        # Write then rename, so readers never see a partial file
+        partial = path.with_suffix(".tmp")
+        partial.write_text(json.dumps(record))
+        os.replace(partial, path)
+        self._rotate()
+
+    def _rotate(self):
+        with self._lock:
+            # IDs start with the capture time, so names sort oldest first
+            captures = sorted(self.directory.glob("*.json"))
+            for path in captures[:max(0, len(captures) - self.max_files)]:
+                path.unlink(missing_ok=True)
+                path.with_suffix(".prof").unlink(missing_ok=True)
+
+    def slowest(self, kind=None, limit=20):
+        """Summaries of the slowest captures, optionally of one kind (http, mqtt)"""
+        summaries = []
+        for path in self.directory.glob("*.json"):
+            record = self._read(path)
+            if record is None or (kind and record["kind"] != kind):
+                continue
+            sql = record["sql"]
+            summaries.append({
+                **{key: value for key, value in record.items() if key not in ("sql", "functions")},
+                "sql_count": sql["count"],
+                "sql_ms": sql["ms"],
+                "sql_repeated": len(sql["repeated"]),
+                "sql_duplicates": len(sql["duplicates"]),
+            })
+        summaries.sort(key=lambda summary: summary["duration_ms"], reverse=True)
+        return summaries[:limit]
+
+    def get(self, profile_id):
+        """The full capture, or None"""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        return self._read(self.directory / f"{profile_id}.json")
+
+    def cprofile_path(self, profile_id):
+        """Path of the capture's ``.prof`` file, or None"""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.exists() else None
+
+    @staticmethod
+    def _read(path):
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Rotated away meanwhile
+            return None
+
+
+@contextmanager
+def capture(kind, name, **details):
+    """Profile the enclosed block on this thread and store it.
+
+    Yields the capture record, so the caller can add details (e.g. the
+    response status) before it is written.
+    """
+    record = {
+        "id": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}",
+        "kind": kind,
+        "name": name,
+        "started": timezone.now().isoformat(),
+        **details,
+    }
+    sql = SqlCapture()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active (Python 3.12+ allows one per process)
+        profiler = None
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(sql):
+            yield record
+    finally:
+        duration = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+        record["duration_ms"] = _ms(duration)
+        record["sql"] = sql.summary()
+        record["functions"] = top_functions(profiler) if profiler is not None else []
+        try:
+            profile_store.save(record, profiler)
+        except OSError as e:
+            logger.error(f"Failed to store profile {record['id']}: {e}")
+
+
+def profiled(func, kind, name, **details):
+    """``func`` wrapped to run under ``capture``, noting how long it waited to be called"""
+    queued_at = time.perf_counter()
+
+    def run(*args, **kwargs):
+        wait = _ms(time.perf_counter() - queued_at)
+        with capture(kind, name, queue_wait_ms=wait, **details):
+            return func(*args, **kwargs)
+
+    return run
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+# Global profile store instance
+profile_store = ProfileStore()
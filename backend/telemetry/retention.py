@@ -0,0 +1,178 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import TelemetryRecord, TelemetryEvent, UsageStatistics, HourlyUsage, PresenceTransition
+from .upserts import truncate_hour
+from .versioning import bump_device_generations, fleet_changed
+
+logger = logging.getLogger(__name__)
+
+# Purgeable tables by policy name: (model, time field)
+PURGE_TABLES = {
+    'records': (TelemetryRecord, 'created_at'),
+    'events': (TelemetryEvent, 'occurred_at'),
+    'hourly': (HourlyUsage, 'hour'),
+    'daily': (UsageStatistics, 'date'),
+    'presence': (PresenceTransition, 'occurred_at'),
+}
+
+
+def _batch_settings(batch_size, pause):
+    if batch_size is None:
+        batch_size = getattr(settings, 'TELEMETRY_PURGE_BATCH_SIZE', 1000)
+    if pause is None:
+        pause = getattr(settings, 'TELEMETRY_PURGE_PAUSE', 0.05)
+    return batch_size, pause
+
+
+def _time_bound(model, field, value):
+    # DateField columns compare against dates
+    if value is not None and model._meta.get_field(field).get_internal_type() == 'DateField':
+        return value.date()
+    return value
+
+
+def purge(table, before=None, after=None, device_ids=None, batch_size=None, pause=None, progress=None):
+    """Delete rows of ``table`` in small primary-key ordered batches.
+
+    Optional filters: rows older than ``before``, at or newer than ``after``
+    and belonging to ``device_ids``. Each batch is its own short transaction
+    followed by ``pause`` seconds, so writers are never locked out for long.
+    The batch bumps the event generation of the devices it touched, so no
+    process keeps serving their pre-purge analytics, and the fleet version.
+    ``progress(table, deleted)`` is called after every batch. Returns the
+    number of rows deleted.
+    """
+    model, field = PURGE_TABLES[table]
+    batch_size, pause = _batch_settings(batch_size, pause)
+    rows = model.objects.all()
+    if before is not None:
+        rows = rows.filter(**{f'{field}__lt': _time_bound(model, field, before)})
+    if after is not None:
+        rows = rows.filter(**{f'{field}__gte': _time_bound(model, field, after)})
+    if device_ids is not None:
+        rows = rows.filter(device_id__in=device_ids)
+    return _delete_in_batches(table, model, rows, batch_size, pause, progress)
+
+
+def downsample_heartbeats(before, device_ids=None, batch_size=None, pause=None, progress=None):
+    """Thin out heartbeat TelemetryRecords older than ``before``.
+
+    Keeps the newest heartbeat per device per hour and deletes the rest.
+    Returns the number of rows deleted.
+    """
+    batch_size, pause = _batch_settings(batch_size, pause)
+    rows = TelemetryRecord.objects.filter(created_at__lt=before, payload__mode='status')
+    if device_ids is not None:
+        rows = rows.filter(device_id__in=device_ids)
+
+    deleted = 0
+    last_pk = 0
+    kept = {}  # (device_id, hour) -> pk of the newest heartbeat seen so far
+    while True:
+        chunk = list(
+            rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'device_id', 'created_at')[:batch_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        doomed = []
+        seen = {}
+        for pk, device_id, created_at in chunk:
+            bucket = (device_id, truncate_hour(created_at))
+            previous = seen.get(bucket, kept.get(bucket))
+            if previous is not None:
+                doomed.append(previous)
+            seen[bucket] = pk
+        # Buckets that did not appear in this chunk are finished
+        kept = seen
+        if doomed:
+            with transaction.atomic():
+                deleted += TelemetryRecord.objects.filter(pk__in=doomed).delete()[0]
+            _reclaim_space()
+        if progress:
+            progress('heartbeats', deleted)
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def apply_retention(now=None, batch_size=None, pause=None, progress=None):
+    """Apply ``TELEMETRY_RETENTION_DAYS`` and heartbeat downsampling.
+
+    Returns ``{table: rows_deleted}``.
+    """
+    now = now or timezone.now()
+    results = {}
+    downsample_days = getattr(settings, 'TELEMETRY_HEARTBEAT_DOWNSAMPLE_DAYS', None)
+    if downsample_days is not None:
+        results['heartbeats'] = downsample_heartbeats(
+            now - timedelta(days=downsample_days), batch_size=batch_size, pause=pause, progress=progress
+        )
+    for table, days in getattr(settings, 'TELEMETRY_RETENTION_DAYS', {}).items():
+        if days is None:
+            continue
+        results[table] = purge(
+            table, before=now - timedelta(days=days), batch_size=batch_size, pause=pause, progress=progress
+        )
+    return results
+
+
+def expired_counts(now=None):
+    """Rows each retention policy would delete, without deleting anything"""
+    now = now or timezone.now()
+    counts = {}
+    for table, days in getattr(settings, 'TELEMETRY_RETENTION_DAYS', {}).items():
+        if days is None:
+            continue
+        model, field = PURGE_TABLES[table]
+        before = _time_bound(model, field, now - timedelta(days=days))
+        counts[table] = model.objects.filter(**{f'{field}__lt': before}).count()
+    return counts
+
+
+def vacuum():
+    """Return freed pages to the filesystem after a large purge.
+
+    On SQLite this also switches the file to ``auto_vacuum=INCREMENTAL``
+    (only a VACUUM can change it), so later purges reclaim space as they go.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            cursor.execute('VACUUM')
+        elif connection.vendor == 'postgresql':
+            for model, _ in PURGE_TABLES.values():
+                cursor.execute(f'VACUUM ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def _delete_in_batches(table, model, rows, batch_size, pause, progress):
+    deleted = 0
+    last_pk = 0
+    while True:
+        chunk = list(rows.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'device_id')[:batch_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        # These tables have no relations or signals, so this is a single DELETE
+        with transaction.atomic():
+            deleted += model.objects.filter(pk__in=[pk for pk, _ in chunk]).delete()[0]
+            bump_device_generations({device_id for _, device_id in chunk})
+            fleet_changed()
+        _reclaim_space()
+        if progress:
+            progress(table, deleted)
+        if pause:
+            time.sleep(pause)
+    logger.info(f"Purged {deleted} rows from {model._meta.db_table}")
+    return deleted
+
+
+def _reclaim_space(pages=500):
+    # A no-op until the SQLite file uses auto_vacuum=INCREMENTAL (see vacuum())
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA incremental_vacuum({pages})')
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, Outlet, Machine, MachineDevice
+from .fleet_cache import fleet_status
 
 
 class TelemetryRecordSerializer(serializers.ModelSerializer):
@@ -37,9 +38,9 @@ class TelemetryEventSerializer(serializers.ModelSerializer):
 
 class DeviceStatusSerializer(serializers.ModelSerializer):
     # Override the count fields to return accumulated values
-    current_count_basic = serializers.SerializerMethodField()
-    current_count_standard = serializers.SerializerMethodField()
-    current_count_premium = serializers.SerializerMethodField()
+    current_count_basic = serializers.IntegerField(source='total_basic_count', read_only=True)
+    current_count_standard = serializers.IntegerField(source='total_standard_count', read_only=True)
+    current_count_premium = serializers.IntegerField(source='total_premium_count', read_only=True)
     
     class Meta:
         model = DeviceStatus
@@ -55,15 +56,6 @@ class DeviceStatusSerializer(serializers.ModelSerializer):
             "uptime_seconds",
             "device_timestamp",
         ]
-    
-    def get_current_count_basic(self, obj):
-        return obj.get_accumulated_basic_count()
-    
-    def get_current_count_standard(self, obj):
-        return obj.get_accumulated_standard_count()
-    
-    def get_current_count_premium(self, obj):
-        return obj.get_accumulated_premium_count()
 
 
 class UsageStatisticsSerializer(serializers.ModelSerializer):
@@ -100,9 +92,21 @@ class OutletSerializer(serializers.ModelSerializer):
         ]
     
     def get_machine_count(self, obj):
+        # Annotated by OutletViewSet; fall back to a query for single instances
+        if hasattr(obj, 'active_machine_count'):
+            return obj.active_machine_count
         return obj.machines.filter(is_active=True).count()
 
 
+def _device_status_data(serializer, device_id):
+    """Serialized DeviceStatus for ``device_id``, from the statuses preloaded
+    into the serializer context when available"""
+    statuses = serializer.context.get('device_statuses')
+    if statuses is None:
+        statuses = fleet_status.get_many([device_id])
+    return statuses.get(device_id)
+
+
 class MachineDeviceSerializer(serializers.ModelSerializer):
     device_status = serializers.SerializerMethodField()
     
@@ -120,11 +124,20 @@ class MachineDeviceSerializer(serializers.ModelSerializer):
     
     def get_device_status(self, obj):
         """Get device status for this device"""
-        try:
-            device_status = DeviceStatus.objects.get(device_id=obj.device_id)
-            return DeviceStatusSerializer(device_status).data
-        except DeviceStatus.DoesNotExist:
-            return None
+        return _device_status_data(self, obj.device_id)
+
+
+def _load_device_statuses(serializer, machines):
+    """Look up the status of every device of ``machines`` in the fleet snapshot at once"""
+    device_ids = {device.device_id for machine in machines for device in machine.devices.all()}
+    serializer.context['device_statuses'] = fleet_status.get_many(device_ids)
+
+
+class MachineListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        machines = list(data.all() if hasattr(data, 'all') else data)
+        _load_device_statuses(self, machines)
+        return super().to_representation(machines)
 
 
 class MachineSerializer(serializers.ModelSerializer):
@@ -137,6 +150,7 @@ class MachineSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Machine
+        list_serializer_class = MachineListSerializer
         fields = [
             "id",
             "outlet",
@@ -156,21 +170,22 @@ class MachineSerializer(serializers.ModelSerializer):
             "device_status"
         ]
     
+    def to_representation(self, instance):
+        if 'device_statuses' not in self.context:
+            _load_device_statuses(self, [instance])
+        return super().to_representation(instance)
+
     def get_current_device(self, obj):
         """Get the currently active device"""
         current = obj.current_device
         if current:
-            return MachineDeviceSerializer(current).data
+            return MachineDeviceSerializer(current, context=self.context).data
         return None
     
     def get_device_status(self, obj):
         """Get device status for the currently active device"""
         current = obj.current_device
         if current:
-            try:
-                device_status = DeviceStatus.objects.get(device_id=current.device_id)
-                return DeviceStatusSerializer(device_status).data
-            except DeviceStatus.DoesNotExist:
-                return None
+            return _device_status_data(self, current.device_id)
         return None
 
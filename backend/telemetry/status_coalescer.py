@@ -0,0 +1,124 @@
+"""Coalesced DeviceStatus writes for MQTT status heartbeats.
+
+Only a device's latest state matters, so heartbeats are folded into a
+per-device map (later values win, field by field) and a background thread
+writes the map every ``flush_interval`` seconds in one transaction: one
+upsert per set of carried fields, touching only those columns and
+``last_seen``. Writes drop from one per message to one row per device per
+interval. A heartbeat reaches the database at most ``flush_interval``
+seconds (plus the flush itself) after it arrived; a failed flush keeps its
+values, under any newer ones, for the next attempt.
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from .models import DeviceStatus
+from .upserts import upsert_device_statuses
+from .versioning import fleet_changed, status_changes_listing
+
+logger = logging.getLogger(__name__)
+
+
+class StatusCoalescer:
+    def __init__(self, flush_interval=None, max_pending=None):
+        self.flush_interval = flush_interval or getattr(settings, "MQTT_STATUS_FLUSH_INTERVAL", 2.0)
+        self.max_pending = max_pending or getattr(settings, "MQTT_STATUS_MAX_PENDING", 10_000)
+        self._pending = {}  # device_id -> (values, monotonic time of its oldest unwritten heartbeat)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self.counters = {"received": 0, "flushes": 0, "rows_written": 0, "failed_flushes": 0}
+        self.last_staleness = 0.0  # seconds the oldest heartbeat of the last flush waited
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Start the background flush thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="mqtt-status-flush", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def add(self, device_id, values):
+        """Merge a heartbeat's DeviceStatus field values into the device's pending state"""
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if pending is None:
+                self._pending[device_id] = (dict(values), time.monotonic())
+            else:
+                pending[0].update(values)
+            self.counters["received"] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all pending device states; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            groups = {}
+            for device_id, (values, _) in batch.items():
+                groups.setdefault(frozenset(values), []).append(DeviceStatus(device_id=device_id, **values))
+            try:
+                with transaction.atomic():
+                    # Compared before the upserts write the rows through to the snapshot
+                    changed = status_changes_listing({device_id: values for device_id, (values, _) in batch.items()})
+                    for fields, objs in groups.items():
+                        upsert_device_statuses(objs, update_fields=sorted(fields))
+                    if changed:
+                        fleet_changed()
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} device statuses: {e}")
+                with self._lock:
+                    for device_id, (values, since) in batch.items():
+                        newer = self._pending.get(device_id)
+                        self._pending[device_id] = ({**values, **newer[0]} if newer else values, since)
+                    self.counters["failed_flushes"] += 1
+                return 0
+            oldest = min(since for _, since in batch.values())
+            with self._lock:
+                self.counters["flushes"] += 1
+                self.counters["rows_written"] += len(batch)
+                self.last_staleness = time.monotonic() - oldest
+            return len(batch)
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still pending"""
+        self._stopping = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 30)
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "pending": len(self._pending),
+                "last_staleness_ms": round(self.last_staleness * 1000, 1),
+            }
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                # Drop connections that are broken or past CONN_MAX_AGE before touching the DB
+                close_old_connections()
+                self.flush()
+        finally:
+            connection.close()
@@ -1,3 +1,506 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import re
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase
+from django.utils import timezone
+from .bulk_ingest import import_payloads, sd_log_payloads
+from .exports import export_events, pyarrow_available
+from .fleet_cache import fleet_status
+from .idempotency import recent_event_keys
+from .ingest_buffer import IngestBuffer, parse_device_timestamp
+from .models import (
+    TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, HourlyUsage, Outlet, Machine, MachineDevice,
+    PresenceTransition,
+)
+from .metrics import mqtt_dropped
+from .mqtt_client import MQTTClient
+from .mqtt_workers import ShardedWorkerPool
+from .presence import PresenceTracker
+from .retention import purge
+from .status_coalescer import StatusCoalescer
+from .upserts import truncate_hour, upsert_device_statuses
+from .versioning import current_version, device_counter, fleet_changed, status_changes_listing, version_bumper
 
-# Create your tests here.
+EVENT_TYPES = ("BASIC", "STANDARD", "PREMIUM")
+
+
+@unittest.skipUnless(pyarrow_available(), "pyarrow is not installed")
+class ColumnarExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        TelemetryEvent.objects.bulk_create([
+            TelemetryEvent(device_id="export-1", event_type=TelemetryEvent.EVENT_BASIC, occurred_at=now),
+            TelemetryEvent(device_id="export-1", event_type=TelemetryEvent.EVENT_PREMIUM, occurred_at=now),
+        ])
+
+    def export(self, **params):
+        response = self.client.get("/api/export/columnar/", {"table": "events", "days": 1, **params})
+        self.assertEqual(response.status_code, 200, getattr(response, "content", b""))
+        return b"".join(response.streaming_content)
+
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        table = pq.read_table(io.BytesIO(self.export(output="parquet")))
+        self.assertEqual(table.num_rows, 2)
+
+    def test_arrow(self):
+        import pyarrow as pa
+        table = pa.ipc.open_stream(self.export(output="arrow")).read_all()
+        self.assertEqual(table.num_rows, 2)
+
+    def test_default_is_parquet(self):
+        self.assertEqual(self.export()[:4], b"PAR1")
+
+    def test_unknown_output(self):
+        response = self.client.get("/api/export/columnar/", {"output": "csv"})
+        self.assertEqual(response.status_code, 400)
+
+
+@mock.patch("telemetry.live.presence")
+class EventIdempotencyTests(TestCase):
+    DEVICE = "idem-1"
+    TIMESTAMP = "2026-01-15 14:30:25"
+
+    def setUp(self):
+        recent_event_keys.clear()
+        self.consumer = MQTTClient()
+
+    def press(self, **data):
+        payload = {"device_id": self.DEVICE, "timestamp": self.TIMESTAMP, "type": "event",
+                   "data": {"event_type": "BASIC", "count": 1, **data}}
+        self.consumer.handle_event_message(self.DEVICE, payload)
+
+    def test_presses_in_the_same_second_are_kept(self, presence):
+        self.press(total=41)
+        self.press(total=42)
+        self.assertEqual(TelemetryEvent.objects.filter(device_id=self.DEVICE).count(), 2)
+
+    def test_resent_press_is_dropped(self, presence):
+        self.press(total=41)
+        self.press(total=41)
+        recent_event_keys.clear()
+        self.press(total=41)
+        self.assertEqual(TelemetryEvent.objects.filter(device_id=self.DEVICE).count(), 1)
+
+    def test_database_rejects_a_duplicate_key(self, presence):
+        fields = {"device_id": self.DEVICE, "event_type": "BASIC", "occurred_at": timezone.now(), "idempotency_key": "k" * 32}
+        TelemetryEvent.objects.create(**fields)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TelemetryEvent.objects.create(**fields)
+
+    def test_presses_without_total_are_all_stored(self, presence):
+        self.press()
+        self.press()
+        self.assertEqual(TelemetryEvent.objects.filter(device_id=self.DEVICE).count(), 2)
+
+    def test_mqtt_presses_count_in_fleet_analytics(self, presence):
+        self.press(total=41)
+        self.press(event_type="PREMIUM", total=7)
+        response = self.client.get("/api/events/fleet-analytics/", {"device_ids": self.DEVICE, "days": 1})
+        self.assertEqual(response.data["totals"], {"total": 2, "basic": 1, "standard": 0, "premium": 1})
+
+    def test_sd_log_skips_presses_already_received(self, presence):
+        self.press(total=41)
+        log = ["Timestamp,Machine_Type,Count,Device_MAC", f"{self.TIMESTAMP},BASIC,41,{self.DEVICE}",
+               f"{self.TIMESTAMP},BASIC,42,{self.DEVICE}"]
+        totals = import_payloads(sd_log_payloads(log))
+        self.assertEqual((totals["created"], totals["duplicates"]), (1, 1))
+        self.assertEqual(TelemetryEvent.objects.filter(device_id=self.DEVICE).count(), 2)
+
+    def test_bulk_presses_in_the_same_second_are_kept(self, presence):
+        lines = [
+            json.dumps({"macaddr": self.DEVICE, "mode": "BASIC", "timestamp": timestamp, "count1": count})
+            for timestamp, count in ((self.TIMESTAMP, 42), (self.TIMESTAMP, 43), ("2026-01-15 14:30:26", 44))
+        ]
+        response = self.client.post("/api/iot/bulk/", "\n".join(lines), content_type="application/x-ndjson")
+        self.assertEqual((response.data["created"], response.data["duplicates"]), (3, 0))
+        response = self.client.post("/api/iot/bulk/", "\n".join(lines), content_type="application/x-ndjson")
+        self.assertEqual((response.data["created"], response.data["duplicates"]), (0, 3))
+        self.assertEqual(TelemetryEvent.objects.filter(device_id=self.DEVICE).count(), 3)
+
+
+class BulkIngestTests(TestCase):
+    LOG_HEADER = "Timestamp,Machine_Type,Count,Device_MAC"
+
+    def test_backfill_does_not_refresh_last_seen(self):
+        long_ago = timezone.now() - timedelta(days=30)
+        DeviceStatus.objects.create(device_id="backfill-known")
+        DeviceStatus.objects.filter(device_id="backfill-known").update(last_seen=long_ago)
+        log = [self.LOG_HEADER, "2026-01-15 14:30:25,BASIC,1,backfill-known", "2026-01-15 14:30:25,BASIC,1,backfill-new"]
+        import_payloads(sd_log_payloads(log))
+
+        known = DeviceStatus.objects.get(device_id="backfill-known")
+        self.assertEqual((known.last_seen, known.total_basic_count), (long_ago, 1))
+        new = DeviceStatus.objects.get(device_id="backfill-new")
+        self.assertEqual(new.last_seen, parse_device_timestamp("2026-01-15 14:30:25"))
+
+
+class IngestBufferTests(TestCase):
+    def test_failed_flush_keeps_every_reading(self):
+        buffer = IngestBuffer(flush_size=100, max_size=3)
+        buffer._thread = mock.Mock()  # no background flushes
+        for n in range(3):
+            buffer.add({"n": n})
+
+        def fail(batch):
+            buffer._pending.append({"n": 3})  # arrives while the flush is failing
+            raise RuntimeError("database is down")
+
+        with mock.patch("telemetry.ingest_buffer.write_readings", side_effect=fail):
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(buffer._pending, [{"n": 0}, {"n": 1}, {"n": 2}, {"n": 3}])
+            # Over its bound with the database down, the buffer refuses new readings
+            self.assertFalse(buffer.add({"n": 4}))
+
+    def test_unwritable_reading_is_dropped_after_retries(self):
+        buffer = IngestBuffer(flush_size=100, max_retries=2)
+        buffer._thread = mock.Mock()
+        for n in range(4):
+            buffer.add({"n": n, "poison": n == 2})
+        written = []
+
+        def write(batch):
+            if any(r["poison"] for r in batch):
+                raise RuntimeError("value too long for type character varying(128)")
+            written.extend(r["n"] for r in batch)
+
+        with mock.patch("telemetry.ingest_buffer.write_readings", side_effect=write):
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(len(buffer), 4)
+            # The second failure in a row splits the batch around the bad reading
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(sorted(written), [0, 1, 3])
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.stats()["dead_lettered"], 1)
+
+    def test_oversized_fields_are_refused(self):
+        response = self.client.post("/api/iot/", {"macaddr": "x" * 129, "mode": "status"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/api/iot/", {"macaddr": "buffer-1", "mode": "BASIC", "timestamp": "2026-01-15 14:30:25" * 2})
+        self.assertEqual(response.status_code, 400)
+
+
+class StatusCoalescerTests(TestCase):
+    def test_burst_is_one_write_per_device_with_the_latest_values(self):
+        statuses = StatusCoalescer()
+        for n in range(10):
+            statuses.add("coalesce-1", {"current_count_basic": n, "wifi_connected": True})
+            statuses.add("coalesce-2", {"current_count_premium": n})
+        statuses.add("coalesce-1", {"rtc_available": True})
+
+        with mock.patch("telemetry.status_coalescer.upsert_device_statuses", wraps=upsert_device_statuses) as write:
+            self.assertEqual(statuses.flush(), 2)
+        written = [obj.device_id for call in write.call_args_list for obj in call.args[0]]
+        self.assertEqual(sorted(written), ["coalesce-1", "coalesce-2"])
+        first = DeviceStatus.objects.get(device_id="coalesce-1")
+        self.assertEqual((first.current_count_basic, first.wifi_connected, first.rtc_available), (9, True, True))
+        self.assertEqual(DeviceStatus.objects.get(device_id="coalesce-2").current_count_premium, 9)
+        self.assertEqual(statuses.stats()["received"], 21)
+
+
+class MqttWorkerPoolTests(TestCase):
+    def test_full_queue_drop_is_counted(self):
+        pool = ShardedWorkerPool(workers=1, queue_size=1, put_timeout=0.01)  # not started: nothing drains
+        before = mqtt_dropped.collect().get((), 0)
+        self.assertTrue(pool.submit("drop-1", print))
+        self.assertFalse(pool.submit("drop-1", print))
+        self.assertEqual((pool.stats()["dropped"], mqtt_dropped.collect().get((), 0) - before), (1, 1))
+
+
+@mock.patch("telemetry.live.presence")
+@mock.patch.object(version_bumper, "request")
+class ConcurrentIngestTests(TransactionTestCase):
+    """Parallel first inserts for the same devices keep daily totals and counters exact"""
+
+    THREADS = 8
+    REQUESTS = 25
+    DEVICES = 2
+
+    def test_parallel_triggers(self, request, presence):
+        accepted = [{} for _ in range(self.THREADS)]
+
+        def worker(index):
+            client = Client(raise_request_exception=False)
+            try:
+                for i in range(self.REQUESTS):
+                    key = (f"stress-{i % self.DEVICES}", EVENT_TYPES[(index + i) % 3])
+                    response = client.post("/api/iot/", {"macaddr": key[0], "mode": key[1]})
+                    if response.status_code == 200:
+                        accepted[index][key] = accepted[index].get(key, 0) + 1
+            finally:
+                connection.close()
+
+        # Every device starts without a status row, so the first packets race on the insert
+        pool = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+        expected = {}
+        for sent in accepted:
+            for key, n in sent.items():
+                expected[key] = expected.get(key, 0) + n
+        self.assertEqual(sum(expected.values()), self.THREADS * self.REQUESTS)
+        self.assertEqual(DeviceStatus.objects.filter(device_id__startswith="stress-").count(), self.DEVICES)
+        for d in range(self.DEVICES):
+            device_id = f"stress-{d}"
+            want = {event_type: expected.get((device_id, event_type), 0) for event_type in EVENT_TYPES}
+            with self.subTest(device_id=device_id):
+                daily = UsageStatistics.objects.filter(device_id=device_id).aggregate(
+                    BASIC=Sum("basic_count"), STANDARD=Sum("standard_count"), PREMIUM=Sum("premium_count"),
+                    total=Sum("total_events"),
+                )
+                self.assertEqual({event_type: daily[event_type] or 0 for event_type in EVENT_TYPES}, want)
+                self.assertEqual(daily["total"], sum(want.values()))
+                status = DeviceStatus.objects.get(device_id=device_id)
+                counters = {event_type: getattr(status, field) for event_type, field in DeviceStatus.COUNTER_FIELDS.items()}
+                self.assertEqual(counters, want)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        # Ties on occurred_at straddle the page boundaries
+        moments = [now] * 7 + [now - timedelta(seconds=s) for s in (1, 1, 2, 3, 3)]
+        TelemetryEvent.objects.bulk_create([
+            TelemetryEvent(device_id="page-1", event_type="BASIC", occurred_at=moment) for moment in moments
+        ])
+
+    def test_pages_cover_every_row_once(self):
+        ids = []
+        url = "/api/events/?device_id=page-1&limit=3"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(event["id"] for event in response.data["results"])
+            url = response.data["next"]
+        expected = list(
+            TelemetryEvent.objects.filter(device_id="page-1").order_by("-occurred_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        def encode(raw):
+            return base64.urlsafe_b64encode(raw).decode()
+
+        cursors = [
+            "not a cursor",
+            encode(b"garbage"),
+            encode(b"\xff\xfe"),
+            encode(b"2026-01-15T14:30:25|1"),  # naive time
+            encode(b"2026-13-45T14:30:25+00:00|1"),
+            encode(b"2026-01-15T14:30:25+00:00|99999999999999999999999"),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/events/", {"cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+class FleetVersionTests(TestCase):
+    def test_liveness_only_heartbeat_does_not_change_listing(self):
+        fleet_status.store([DeviceStatus(device_id="version-1", wifi_connected=True, rtc_available=True)])
+        self.assertFalse(status_changes_listing({"version-1": {"wifi_connected": True, "uptime_seconds": 60}}))
+        self.assertTrue(status_changes_listing({"version-1": {"rtc_available": False}}))
+        self.assertTrue(status_changes_listing({"version-unknown": {"wifi_connected": True}}))
+
+    def test_bump_is_requested_after_commit(self):
+        with mock.patch.object(version_bumper, "request") as request:
+            with self.captureOnCommitCallbacks(execute=True):
+                fleet_changed()
+                request.assert_not_called()
+            request.assert_called_once()
+
+
+class RetentionTests(TestCase):
+    def test_purge_invalidates_analytics_of_its_devices(self):
+        now = timezone.now()
+        TelemetryEvent.objects.create(device_id="purge-1", event_type="BASIC", occurred_at=now - timedelta(days=90))
+        TelemetryEvent.objects.create(device_id="purge-2", event_type="BASIC", occurred_at=now)
+        generations = {d: current_version(device_counter(d))[0] for d in ("purge-1", "purge-2")}
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(version_bumper, "request") as request:
+            self.assertEqual(purge("events", before=now - timedelta(days=30), pause=0), 1)
+        request.assert_called()
+        self.assertEqual(current_version(device_counter("purge-1"))[0], generations["purge-1"] + 1)
+        self.assertEqual(current_version(device_counter("purge-2"))[0], generations["purge-2"])
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.tracker = PresenceTracker(tick=1, timeout=10, record=True)
+        self.tracker._thread = mock.Mock()  # ticks are driven by the test
+        self.now = time.time()
+
+    def transitions(self):
+        self.tracker.flush()
+        return list(PresenceTransition.objects.filter(device_id="presence-1").order_by("id").values_list("online", flat=True))
+
+    def test_goes_offline_after_the_timeout(self):
+        self.tracker.seen("presence-1", self.now)
+        self.assertEqual(self.tracker.expire(self.now + 5), 0)
+        self.assertTrue(self.tracker.is_online("presence-1"))
+        self.assertEqual(self.tracker.expire(self.now + 11), 1)
+        self.assertFalse(self.tracker.is_online("presence-1"))
+        self.assertEqual(self.transitions(), [True, False])
+
+    def test_heartbeat_rearms_the_deadline(self):
+        self.tracker.seen("presence-1", self.now)
+        self.tracker.seen("presence-1", self.now + 8)
+        self.assertEqual(self.tracker.expire(self.now + 11), 0)
+        self.assertEqual(self.tracker.expire(self.now + 19), 1)
+        self.assertEqual(self.transitions(), [True, False])
+        offline = PresenceTransition.objects.get(device_id="presence-1", online=False)
+        self.assertAlmostEqual(offline.occurred_at.timestamp(), self.now + 18, delta=1)
+
+    def test_no_duplicate_transitions(self):
+        for offset in range(5):
+            self.tracker.seen("presence-1", self.now + offset)
+        self.tracker.expire(self.now + 20)
+        self.tracker.expire(self.now + 30)
+        self.assertEqual(self.transitions(), [True, False])
+
+
+class QueryBudgetTests(TestCase):
+    """Listing endpoints run a fixed number of queries regardless of fleet size"""
+
+    # With a warm fleet status snapshot. Version-stamped listings spend one
+    # extra query reading the fleet version, and the snapshot another to check
+    # it is current (plus one load per fleet version when cold)
+    QUERY_BUDGETS = {
+        "/api/machines/": 4,
+        "/api/machines/unregistered/": 1,
+        "/api/outlets/": 1,
+        "/api/devices/all/": 2,
+        "/api/devices/online/": 2,
+    }
+
+    def setUp(self):
+        fleet_status.cache.clear()
+        # A tracker of its own, without the tick thread, fed from the seeded rows
+        self.presence = PresenceTracker(record=False)
+        self.presence._thread = mock.Mock()
+        patcher = mock.patch("telemetry.views.presence", self.presence)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def seed(self, size):
+        now = timezone.now()
+        for o in range(2):
+            outlet = Outlet.objects.create(name=f"budget-outlet-{o}")
+            for m in range(size):
+                machine = Machine.objects.create(outlet=outlet, name=f"budget-{o}-{m}")
+                # One retired device and one current device per machine
+                for d, active in ((0, False), (1, True)):
+                    device_id = f"budget-{o}-{m}-{d}"
+                    MachineDevice.objects.create(machine=machine, device_id=device_id, is_active=active)
+                    DeviceStatus.objects.create(device_id=device_id, last_seen=now)
+        for u in range(size):
+            DeviceStatus.objects.create(device_id=f"budget-unregistered-{u}", last_seen=now)
+        self.presence.sync()
+
+    def assert_budgets(self, size):
+        self.seed(size)
+        # Warm the fleet snapshot, a one-off load per fleet version
+        self.client.get("/api/devices/all/")
+        for path, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(path=path), self.assertNumQueries(budget):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+
+    def test_small_fleet(self):
+        self.assert_budgets(5)
+
+    def test_large_fleet(self):
+        self.assert_budgets(50)
+
+
+class QueryPlanTests(TestCase):
+    """The hot telemetry queries are served by an index, never a table scan"""
+
+    DEVICES = 50
+    PER_DEVICE = 200
+    # Plan lines that mean a full table scan
+    FULL_SCAN_PATTERNS = {
+        "sqlite": re.compile(r"\bSCAN (\w+)\s*$"),
+        "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        step = timedelta(days=30) / cls.PER_DEVICE
+        for d in range(cls.DEVICES):
+            device_id = f"plan-{d}"
+            DeviceStatus.objects.create(device_id=device_id)
+            TelemetryEvent.objects.bulk_create([
+                TelemetryEvent(
+                    device_id=device_id,
+                    event_type="status" if i % 10 == 0 else EVENT_TYPES[i % 3],
+                    occurred_at=cls.now - step * i,
+                )
+                for i in range(cls.PER_DEVICE)
+            ])
+            TelemetryRecord.objects.bulk_create([
+                TelemetryRecord(device_id=device_id, payload={"mode": "status"}) for _ in range(cls.PER_DEVICE)
+            ])
+            UsageStatistics.objects.bulk_create([
+                UsageStatistics(device_id=device_id, date=(cls.now - timedelta(days=day)).date(), total_events=1)
+                for day in range(30)
+            ])
+            HourlyUsage.objects.bulk_create([
+                HourlyUsage(device_id=device_id, hour=truncate_hour(cls.now - timedelta(hours=h)), event_type="BASIC", count=1)
+                for h in range(0, 24 * 30, 6)
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        if connection.vendor not in self.FULL_SCAN_PATTERNS:
+            self.skipTest(f"Plan checks are not supported on {connection.vendor}")
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                # Small tables make sequential scans look cheap; only fall back if no index applies
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def hot_queries(self, device_id):
+        """The ORM queries behind the hot endpoints, by name"""
+        now = self.now
+        week_ago = now - timedelta(days=7)
+        return {
+            "analytics recent events": TelemetryEvent.objects.filter(
+                device_id=device_id, occurred_at__gte=week_ago, occurred_at__lte=now
+            ).exclude(event_type="status").order_by("-occurred_at")[:50],
+            "analytics daily stats": UsageStatistics.objects.filter(
+                device_id=device_id, date__gte=week_ago.date(), date__lte=now.date()
+            ).order_by("date"),
+            "export events": export_events([device_id], 30)[0],
+            "event page": TelemetryEvent.objects.filter(
+                device_id=device_id, occurred_at__gte=week_ago
+            ).exclude(event_type="status").order_by("-occurred_at", "-id")[:101],
+            "device event type count": TelemetryEvent.objects.filter(device_id=device_id, event_type="BASIC").order_by(),
+            "latest record by device": TelemetryRecord.objects.filter(device_id=device_id).order_by("-created_at")[:1],
+            "latest record": TelemetryRecord.objects.order_by("-created_at")[:1],
+            "online devices": DeviceStatus.objects.filter(last_seen__gte=now - timedelta(minutes=5)),
+            "hourly series": HourlyUsage.objects.filter(
+                device_id__in=[device_id], hour__gte=truncate_hour(week_ago), hour__lte=now
+            ),
+        }
+
+    def test_hot_queries_use_an_index(self):
+        pattern = self.FULL_SCAN_PATTERNS[connection.vendor]
+        for name, queryset in self.hot_queries("plan-0").items():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                scans = [m.group(1) for line in plan.splitlines() if (m := pattern.search(line))]
+                self.assertEqual(scans, [], f"Table scan in {name}:\n{plan}")
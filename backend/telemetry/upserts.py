@@ -0,0 +1,231 @@
+"""Single-statement upserts (INSERT ... ON CONFLICT DO UPDATE).
+
+Supported on SQLite (3.24+; 3.35+ for ``returning``) and PostgreSQL. Every
+update is one statement, so concurrent writers never lose increments and
+racing first inserts never raise IntegrityError.
+"""
+from datetime import timezone as dt_timezone
+from django.db import NotSupportedError, connection, transaction
+from .fleet_cache import fleet_status
+from .models import TelemetryEvent, DeviceStatus, UsageStatistics, HourlyUsage
+
+# Two-argument MIN/MAX scalar functions per vendor
+_MIN_MAX_FUNCTIONS = {
+    "sqlite": ("MIN", "MAX"),
+    "postgresql": ("LEAST", "GREATEST"),
+}
+
+
+def upsert(model, objs, conflict_fields, update_fields=(), increment_fields=(), min_fields=(), max_fields=(),
+           explicit_fields=(), returning=False):
+    """Insert ``objs`` or merge them into the rows matching ``conflict_fields``.
+
+    On conflict, ``update_fields`` take the new value, ``increment_fields``
+    are added to the stored value and ``min_fields``/``max_fields`` keep the
+    smaller/larger of the two (ignoring NULLs). Other columns keep their
+    stored value. ``explicit_fields`` are written as set on the objects,
+    bypassing ``auto_now``. Returns the number of rows written, or with
+    ``returning`` the written rows as model instances (SQLite
+    3.35+/PostgreSQL RETURNING).
+    """
+    if not objs:
+        return [] if returning else 0
+    if connection.vendor not in _MIN_MAX_FUNCTIONS:
+        raise NotSupportedError(f"upsert is not supported on {connection.vendor}")
+    min_fn, max_fn = _MIN_MAX_FUNCTIONS[connection.vendor]
+    qn = connection.ops.quote_name
+    meta = model._meta
+    table = qn(meta.db_table)
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+
+    def column(name):
+        return qn(meta.get_field(name).column)
+
+    assignments = []
+    for name in update_fields:
+        assignments.append(f"{column(name)} = excluded.{column(name)}")
+    for name in increment_fields:
+        assignments.append(f"{column(name)} = {table}.{column(name)} + excluded.{column(name)}")
+    for fn, names in ((min_fn, min_fields), (max_fn, max_fields)):
+        for name in names:
+            col = column(name)
+            assignments.append(
+                f"{col} = COALESCE({fn}({table}.{col}, excluded.{col}), {table}.{col}, excluded.{col})"
+            )
+    conflict = ", ".join(column(name) for name in conflict_fields)
+    if assignments:
+        on_conflict = f"ON CONFLICT ({conflict}) DO UPDATE SET {', '.join(assignments)}"
+    else:
+        on_conflict = f"ON CONFLICT ({conflict}) DO NOTHING"
+
+    if returning:
+        on_conflict += " RETURNING " + ", ".join(qn(f.column) for f in meta.concrete_fields)
+
+    row_sql = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    batch_size = max(1, (connection.features.max_query_params or 999) // len(fields))
+    written = 0
+    rows = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+            for obj in batch:
+                for field in fields:
+                    value = getattr(obj, field.attname) if field.name in explicit_fields else field.pre_save(obj, True)
+                    params.append(field.get_db_prep_save(value, connection))
+            sql = (
+                f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) "
+                f"VALUES {', '.join([row_sql] * len(batch))} {on_conflict}"
+            )
+            cursor.execute(sql, params)
+            if returning:
+                rows.extend(_from_db_row(model, row) for row in cursor.fetchall())
+            else:
+                written += cursor.rowcount
+    return rows if returning else written
+
+
+def _from_db_row(model, row):
+    # Apply the same backend and field converters the ORM uses when loading rows
+    fields = model._meta.concrete_fields
+    values = []
+    for field, value in zip(fields, row):
+        column = field.get_col(model._meta.db_table)
+        for converter in connection.ops.get_db_converters(column) + field.get_db_converters(connection):
+            value = converter(value, column, connection)
+        values.append(value)
+    return model.from_db(connection.alias, [f.attname for f in fields], values)
+
+
+def insert_event(fields):
+    """Insert a TelemetryEvent unless its idempotency key is already stored.
+
+    Returns the new event, or None for a duplicate.
+    """
+    events = upsert(TelemetryEvent, [TelemetryEvent(**fields)], conflict_fields=["idempotency_key"], returning=True)
+    return events[0] if events else None
+
+
+def upsert_device_statuses(objs, update_fields=(), counts=None, seen_at=None):
+    """Upsert DeviceStatus rows keyed on device_id.
+
+    ``last_seen`` is refreshed to now, unless ``seen_at`` maps device_id to
+    when a backfilled reading was taken: a new row then takes that time and
+    an existing row keeps the later of the two. ``counts`` maps device_id to
+    ``{event_type: n}`` and is added to the accumulated counters. The
+    resulting rows are written through to the fleet status cache once the
+    transaction commits. Returns the number of rows written.
+    """
+    counts = counts or {}
+    for obj in objs:
+        for event_type, n in counts.get(obj.device_id, {}).items():
+            if event_type in DeviceStatus.COUNTER_FIELDS:
+                setattr(obj, DeviceStatus.COUNTER_FIELDS[event_type], n)
+    increment_fields = list(DeviceStatus.COUNTER_FIELDS.values()) if counts else []
+    if seen_at is None:
+        update_fields, max_fields = [*update_fields, "last_seen"], []
+    else:
+        for obj in objs:
+            obj.last_seen = seen_at[obj.device_id]
+        max_fields = ["last_seen"]
+    devices = upsert(
+        DeviceStatus,
+        objs,
+        conflict_fields=["device_id"],
+        update_fields=update_fields,
+        increment_fields=increment_fields,
+        max_fields=max_fields,
+        explicit_fields=max_fields,  # backfilled times, not auto_now
+        returning=True,
+    )
+    transaction.on_commit(lambda: fleet_status.store(devices))
+    return len(devices)
+
+
+def upsert_device_status(device_id, values=None, counts=None):
+    """Create or update one device's status row in a single statement.
+
+    Only the fields in ``values`` are overwritten on an existing row; a new
+    row takes the model defaults for anything not given.
+    """
+    values = values or {}
+    obj = DeviceStatus(device_id=device_id, **values)
+    return upsert_device_statuses([obj], update_fields=list(values), counts={device_id: counts} if counts else None)
+
+
+def upsert_daily_statistics(totals):
+    """Add per-day totals into UsageStatistics.
+
+    ``totals`` maps ``(device_id, date)`` to a dict with basic_count,
+    standard_count, premium_count, total_events, first_event and last_event.
+    """
+    objs = [
+        UsageStatistics(device_id=device_id, date=date, **day)
+        for (device_id, date), day in totals.items()
+    ]
+    return upsert(
+        UsageStatistics,
+        objs,
+        conflict_fields=["device_id", "date"],
+        increment_fields=["basic_count", "standard_count", "premium_count", "total_events"],
+        min_fields=["first_event"],
+        max_fields=["last_event"],
+    )
+
+
+def daily_totals(events):
+    """Fold ``(device_id, event_type, occurred_at)`` tuples into per-day totals"""
+    totals = {}
+    for device_id, event_type, occurred_at in events:
+        day = totals.setdefault((device_id, occurred_at.date()), {
+            "basic_count": 0,
+            "standard_count": 0,
+            "premium_count": 0,
+            "total_events": 0,
+            "first_event": occurred_at,
+            "last_event": occurred_at,
+        })
+        if event_type == "BASIC":
+            day["basic_count"] += 1
+        elif event_type == "STANDARD":
+            day["standard_count"] += 1
+        elif event_type == "PREMIUM":
+            day["premium_count"] += 1
+        day["total_events"] += 1
+        day["first_event"] = min(day["first_event"], occurred_at)
+        day["last_event"] = max(day["last_event"], occurred_at)
+    return totals
+
+
+def upsert_hourly_usage(counts):
+    """Add ``{(device_id, hour, event_type): n}`` into HourlyUsage"""
+    objs = [
+        HourlyUsage(device_id=device_id, hour=hour, event_type=event_type, count=n)
+        for (device_id, hour, event_type), n in counts.items()
+    ]
+    return upsert(
+        HourlyUsage,
+        objs,
+        conflict_fields=["device_id", "hour", "event_type"],
+        increment_fields=["count"],
+    )
+
+
+def hourly_totals(events):
+    """Fold ``(device_id, event_type, occurred_at)`` tuples into per-hour counts.
+
+    Heartbeat ("status") events are skipped.
+    """
+    counts = {}
+    for device_id, event_type, occurred_at in events:
+        if event_type == "status":
+            continue
+        hour = truncate_hour(occurred_at)
+        key = (device_id, hour, event_type)
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def truncate_hour(value):
+    """Start of the UTC hour containing ``value``"""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
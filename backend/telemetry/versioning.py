@@ -0,0 +1,220 @@
+"""Version stamps for conditional GETs on the polled fleet listings.
+
+Every write that can change a fleet listing bumps the shared ``fleet``
+counter. The listings derive their ETag from it, so polling an unchanged
+fleet costs one lookup of a one-row table and returns 304 Not Modified.
+
+Registration changes bump the counter in their own transaction. Ingest
+calls ``fleet_changed()`` instead: after commit it asks ``version_bumper``
+for a bump, and the bumper writes at most one every
+FLEET_VERSION_BUMP_INTERVAL seconds, so concurrent ingest transactions do
+not queue on the counter row. Heartbeats that only refresh a device's
+liveness fields (``last_seen``, uptime, device timestamp) do not count as a
+change; listing ETags expire after FLEET_LIVENESS_REFRESH seconds instead.
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, quote_etag
+from .models import ChangeCounter, Outlet, Machine, MachineDevice
+from .fleet_cache import fleet_status
+from .presence import presence
+from .upserts import upsert
+
+logger = logging.getLogger(__name__)
+
+FLEET = "fleet"
+
+# Listed DeviceStatus fields a heartbeat can change (besides liveness)
+LISTED_STATUS_FIELDS = ("wifi_connected", "rtc_available", "sd_card_available")
+
+
+def bump_version(name=FLEET):
+    """Increment counter ``name`` in a single statement and return the new version"""
+    counter, = upsert(
+        ChangeCounter,
+        [ChangeCounter(name=name, version=1)],
+        conflict_fields=["name"],
+        update_fields=["updated_at"],
+        increment_fields=["version"],
+        returning=True,
+    )
+    if name == FLEET:
+        # Status rows written in this transaction are already queued for the snapshot
+        transaction.on_commit(lambda: fleet_status.advance(counter.version))
+    return counter.version
+
+
+class VersionBumper:
+    """Coalesces requested fleet version bumps into one write per interval"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or getattr(settings, "FLEET_VERSION_BUMP_INTERVAL", 0.5)
+        self._requested = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.counters = {"requested": 0, "bumps": 0, "failed_bumps": 0}
+
+    def request(self):
+        """Bump the fleet version within ``interval`` seconds"""
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            self.counters["requested"] += 1
+        self._requested.set()
+
+    def start(self):
+        """Start the background bump thread (idempotent)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="fleet-version", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def flush(self):
+        """Write a requested bump now; returns whether there was one"""
+        if not self._requested.is_set():
+            return False
+        self._requested.clear()
+        try:
+            bump_version()
+        except Exception as e:
+            logger.error(f"Failed to bump the fleet version: {e}")
+            self._requested.set()
+            with self._lock:
+                self.counters["failed_bumps"] += 1
+            return False
+        with self._lock:
+            self.counters["bumps"] += 1
+        return True
+
+    def stop(self):
+        """Stop the bump thread and write a pending bump"""
+        self._stopping = True
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.interval + 30)
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "pending": int(self._requested.is_set())}
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                if not self._requested.wait(self.interval):
+                    continue
+                # Drop connections that are broken or past CONN_MAX_AGE before touching the DB
+                close_old_connections()
+                self.flush()
+                # Requests arriving meanwhile share the next bump
+                time.sleep(self.interval)
+        finally:
+            connection.close()
+
+
+# Global bumper instance
+version_bumper = VersionBumper()
+
+
+def fleet_changed():
+    """Bump the fleet version once the current transaction commits (coalesced)"""
+    transaction.on_commit(version_bumper.request)
+
+
+def status_changes_listing(updates):
+    """Whether writing ``{device_id: DeviceStatus values}`` changes a fleet listing
+    beyond the liveness fields, judged against the snapshot (unknown devices do)"""
+    cached = fleet_status.peek(list(updates))
+    for device_id, values in updates.items():
+        entry = cached.get(device_id)
+        if entry is None:
+            return True
+        if any(field in values and values[field] != entry.get(field) for field in LISTED_STATUS_FIELDS):
+            return True
+    return False
+
+
+@presence.add_listener
+def _presence_changed(device_id, online):
+    # The online listing changes without any status write
+    version_bumper.request()
+
+
+def device_counter(device_id):
+    """Name of the counter bumped whenever a new event for ``device_id`` lands"""
+    return f"device:{device_id}"
+
+
+def bump_device_generations(device_ids):
+    """Bump the event generation of every device in ``device_ids`` in one statement"""
+    upsert(
+        ChangeCounter,
+        [ChangeCounter(name=device_counter(device_id), version=1) for device_id in set(device_ids)],
+        conflict_fields=["name"],
+        update_fields=["updated_at"],
+        increment_fields=["version"],
+    )
+
+
+def current_version(name=FLEET):
+    """``(version, updated_at)`` of counter ``name``; ``(0, None)`` before its first bump"""
+    return ChangeCounter.objects.filter(name=name).values_list("version", "updated_at").first() or (0, None)
+
+
+def conditional_response(request, build, name=FLEET):
+    """Answer a polled GET with 304 while counter ``name`` is unchanged.
+
+    ``build()`` returns ``(response, expires)``. ``expires`` is the epoch
+    second at which the listing goes stale on its own (e.g. a device dropping
+    offline), or None; it is carried in the ETag so later requests can be
+    validated without rebuilding the listing.
+    """
+    version, updated_at = current_version(name)
+    etag = _valid_tag(request, version)
+    if etag is not None:
+        response = HttpResponseNotModified()
+    else:
+        response, expires = build()
+        if name == FLEET:
+            # Heartbeats refresh last_seen without a version bump
+            refresh = time.time() + getattr(settings, "FLEET_LIVENESS_REFRESH", 60)
+            expires = min(expires, refresh) if expires else refresh
+        etag = f"{version}-{int(expires)}" if expires else str(version)
+    response["ETag"] = quote_etag(etag)
+    if updated_at is not None:
+        response["Last-Modified"] = http_date(updated_at.timestamp())
+    # Browsers must revalidate each poll instead of reusing the body heuristically
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def _valid_tag(request, version):
+    # A tag is "<version>" or "<version>-<expires>"
+    for tag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+        tag_version, _, expires = tag.strip('"').partition("-")
+        if tag_version != str(version):
+            continue
+        if not expires or (expires.isdigit() and time.time() < int(expires)):
+            return tag.strip('"')
+    return None
+
+
+@receiver([post_save, post_delete], sender=Outlet)
+@receiver([post_save, post_delete], sender=Machine)
+@receiver([post_save, post_delete], sender=MachineDevice)
+def _registry_changed(sender, **kwargs):
+    bump_version()
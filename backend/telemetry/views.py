@@ -1,13 +1,37 @@
+import json
 from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from django.utils import timezone
-from django.db.models import Sum, Count, Q, Min, Max
+from django.db.models import Sum, Count, Q, Min, Max, Exists, OuterRef
 from django.db.models.functions import TruncDate
-from datetime import datetime, timedelta
-from .models import TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, Outlet, Machine, MachineDevice
+from datetime import timedelta
+from .models import TelemetryRecord, TelemetryEvent, DeviceStatus, UsageStatistics, HourlyUsage, Outlet, Machine, MachineDevice, PresenceTransition
 from .serializers import TelemetryRecordSerializer, TelemetryEventSerializer, DeviceStatusSerializer, UsageStatisticsSerializer, OutletSerializer, MachineSerializer
 from django.db import transaction
+from django.conf import settings
+from django.http import StreamingHttpResponse, JsonResponse, HttpResponse, FileResponse
+from django.views.decorators.http import require_GET
+from .exports import (
+    export_scope, export_events, stream_events_csv, gzip_stream,
+    COLUMNAR_TABLES, COLUMNAR_FORMATS, pyarrow_available, parse_export_range, columnar_rows, stream_columnar,
+)
+from .retention import PURGE_TABLES, purge
+from .ingest_buffer import ingest_buffer, parse_iot_reading, INVALID_READING, build_record_payload, build_event_fields, reading_event_key
+from .idempotency import recent_event_keys
+from .bulk_ingest import import_payloads, ndjson_payloads, csv_payloads
+from .upserts import insert_event, upsert_device_status, upsert_daily_statistics, daily_totals, upsert_hourly_usage, hourly_totals, truncate_hour
+from .versioning import bump_device_generations, conditional_response, current_version, device_counter, fleet_changed, status_changes_listing
+from .analytics_cache import analytics_cache
+from .db_executor import db_executor
+from .pagination import EventPagination, RecordPagination
+from .live import LIVE_KINDS, live_hub, publish_status, publish_event
+from .fleet_cache import fleet_status
+from .presence import presence
+from .metrics import registry as metrics_registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .profiling import profile_store, enabled as profiling_enabled
+from django.utils.dateparse import parse_datetime
+from asgiref.sync import sync_to_async
 
 
 class TelemetryViewSet(mixins.CreateModelMixin,
@@ -17,6 +41,7 @@ class TelemetryViewSet(mixins.CreateModelMixin,
     queryset = TelemetryRecord.objects.all()
     serializer_class = TelemetryRecordSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = RecordPagination
 
     @action(detail=False, methods=["get"], url_path="latest")
     def latest(self, request):
@@ -69,110 +94,151 @@ def iot_ingest(request):
       - type1, type2, type3
       - count1, count2, count3
       - timestamp: ESP32 device timestamp (optional)
+
+    When ``settings.IOT_INGEST_BUFFERED`` is enabled the validated reading is
+    queued on the write-behind buffer and persisted on the next flush.
     """
-    mode = request.data.get("mode")
-    macaddr = request.data.get("macaddr")
-    type1 = request.data.get("type1")
-    type2 = request.data.get("type2")
-    type3 = request.data.get("type3")
-    count1 = request.data.get("count1")
-    count2 = request.data.get("count2")
-    count3 = request.data.get("count3")
-    device_timestamp = request.data.get("timestamp")
-    rtc_available_raw = request.data.get("rtc_available", None)
-    sd_available_raw = request.data.get("sd_available", None)
-    rtc_available = None if rtc_available_raw is None else str(rtc_available_raw).lower() == "true"
-    sd_available = None if sd_available_raw is None else str(sd_available_raw).lower() == "true"
-
-    if not macaddr:
-        return Response({"detail": "macaddr required"}, status=status.HTTP_400_BAD_REQUEST)
-
-    # Parse device timestamp if provided
-    occurred_at = timezone.now()
-    if device_timestamp:
-        parsed = _parse_device_timestamp(device_timestamp)
-        if parsed:
-            occurred_at = parsed
-
-    # Create or update device status
-    device_status, created = DeviceStatus.objects.get_or_create(
-        device_id=str(macaddr),
-        defaults={
-            'wifi_connected': True,
-            'rtc_available': bool(rtc_available) if rtc_available is not None else False,
-            'sd_card_available': bool(sd_available) if sd_available is not None else False,
-            'current_count_basic': _safe_number(count1) or 0,
-            'current_count_standard': _safe_number(count2) or 0,
-            'current_count_premium': _safe_number(count3) or 0,
-            'device_timestamp': device_timestamp,
-        }
-    )
-    
-    if not created:
-        device_status.wifi_connected = True
-        # Only update flags if provided in this request. This avoids event posts clearing flags.
-        if rtc_available is not None:
-            device_status.rtc_available = rtc_available
-        if sd_available is not None:
-            device_status.sd_card_available = sd_available
-        device_status.current_count_basic = _safe_number(count1) or 0
-        device_status.current_count_standard = _safe_number(count2) or 0
-        device_status.current_count_premium = _safe_number(count3) or 0
-        device_status.device_timestamp = device_timestamp
-        device_status.save()
+    reading = parse_iot_reading(request.data)
+    if reading is None:
+        return Response({"detail": INVALID_READING}, status=status.HTTP_400_BAD_REQUEST)
+    # A resent trigger is acknowledged without storing it again
+    if recent_event_keys.seen(reading_event_key(reading)):
+        return Response({"status": "duplicate"})
+
+    if getattr(settings, "IOT_INGEST_BUFFERED", False):
+        if not ingest_buffer.add(reading):
+            return Response({"detail": "ingest buffer full"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"status": "queued"})
+
+    record = _store_iot_reading(reading)
+    if record is None:
+        return Response({"status": "duplicate"})
+    return Response({"status": "ok", "id": record.id})
 
-    # Create telemetry record
-    record = TelemetryRecord.objects.create(
-        device_id=str(macaddr),
-        payload={
-            "mode": mode,
-            "type1": _safe_number(type1),
-            "type2": _safe_number(type2),
-            "type3": _safe_number(type3),
-            "count1": _safe_number(count1),
-            "count2": _safe_number(count2),
-            "count3": _safe_number(count3),
-            "timestamp": device_timestamp,
-        },
-    )
 
-    # Determine event type (status = heartbeat)
-    event_type = mode if mode in {"BASIC", "STANDARD", "PREMIUM", "status"} else "status"
+async def iot_ingest_async(request):
+    """Async variant of ``iot_ingest`` for ASGI servers.
 
-    # Persist events only for real triggers (exclude heartbeat "status")
-    if event_type != "status":
-        TelemetryEvent.objects.create(
-            device_id=str(macaddr),
-            event_type=event_type,
-            count_basic=_safe_number(count1),
-            count_standard=_safe_number(count2),
-            count_premium=_safe_number(count3),
-            occurred_at=occurred_at,
-            device_timestamp=device_timestamp,
-            wifi_status=True,
-            payload={
-                "type1": _safe_number(type1),
-                "type2": _safe_number(type2),
-                "type3": _safe_number(type3),
-            },
+    The request body is received on the event loop, so slow device
+    connections hold no thread; only the database work runs on the bounded
+    ``db_executor`` pool. Accepts the same form-encoded or JSON payloads and
+    answers like ``iot_ingest``.
+    """
+    if request.method != "POST":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "JSON parse error"}, status=400)
+    else:
+        data = request.POST
+    reading = parse_iot_reading(data)
+    if reading is None:
+        return JsonResponse({"detail": INVALID_READING}, status=400)
+    if recent_event_keys.seen(reading_event_key(reading)):
+        return JsonResponse({"status": "duplicate"})
+
+    if getattr(settings, "IOT_INGEST_BUFFERED", False):
+        if not await db_executor.run(ingest_buffer.add, reading):
+            return JsonResponse({"detail": "ingest buffer full"}, status=503)
+        return JsonResponse({"status": "queued"})
+
+    record = await db_executor.run(_store_iot_reading, reading)
+    if record is None:
+        return JsonResponse({"status": "duplicate"})
+    return JsonResponse({"status": "ok", "id": record.id})
+
+
+# Devices do not send CSRF tokens (DRF's api_view does the same for iot_ingest)
+iot_ingest_async.csrf_exempt = True
+
+
+# Body formats accepted by iot_bulk_ingest, by content type
+BULK_INGEST_FORMATS = {
+    "application/x-ndjson": ndjson_payloads,
+    "application/jsonl": ndjson_payloads,
+    "text/csv": csv_payloads,
+}
+
+
+@api_view(["POST"])
+@permission_classes([permissions.AllowAny])
+def iot_bulk_ingest(request):
+    """Backfill many readings from an NDJSON or CSV body.
+
+    Each NDJSON line, or CSV row under a header of field names, carries the
+    ``iot_ingest`` fields and must have a device ``timestamp``. Readings
+    already stored are skipped, so a device can resend its whole log.
+    Returns the received/created/duplicates/invalid/ignored totals.
+    """
+    content_type = request.content_type.split(";")[0].strip()
+    parse = BULK_INGEST_FORMATS.get(content_type)
+    if parse is None:
+        return Response(
+            {"detail": f'Unsupported media type "{content_type}"; send application/x-ndjson or text/csv.'},
+            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         )
+    # Read the body line by line instead of through request.data
+    totals = import_payloads(parse(request.stream or ()))
+    return Response(totals)
 
-        # Update daily statistics only for real events
-        _update_daily_statistics(str(macaddr), event_type, occurred_at)
 
-    return Response({"status": "ok", "id": record.id})
+def _store_iot_reading(reading):
+    """Persist a single reading synchronously and return its TelemetryRecord.
 
+    Returns None when the reading is a resent trigger that is already stored.
+    """
+    device_id = reading["device_id"]
+    rtc_available = reading["rtc_available"]
+    sd_available = reading["sd_available"]
+
+    # Create or update device status in one statement.
+    # Only update flags if provided in this request. This avoids event posts clearing flags.
+    values = {
+        'wifi_connected': True,
+        'current_count_basic': reading["count1"] or 0,
+        'current_count_standard': reading["count2"] or 0,
+        'current_count_premium': reading["count3"] or 0,
+        'device_timestamp': reading["device_timestamp"],
+    }
+    if rtc_available is not None:
+        values['rtc_available'] = rtc_available
+    if sd_available is not None:
+        values['sd_card_available'] = sd_available
 
-def _parse_device_timestamp(value):
-    """Parse ESP32 device timestamp format: '2024-01-15 14:30:25'"""
-    try:
-        if not value:
+    # Persist events only for real triggers (exclude heartbeat "status")
+    event_fields = build_event_fields(reading) if reading["event_type"] != "status" else None
+    with transaction.atomic():
+        # A write comes first so the transaction takes the write lock up front.
+        # The insert is skipped when the idempotency key is already stored.
+        if event_fields and insert_event(event_fields) is None:
+            recent_event_keys.add(event_fields["idempotency_key"])
             return None
-        # ESP32 format: "2024-01-15 14:30:25" - Now synced with NTP (Kuala Lumpur time)
-        dt = datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
-        return timezone.make_aware(dt)
-    except Exception:
-        return None
+        # The status update also adds the event to the accumulated counters, so
+        # readers never see the one without the other
+        upsert_device_status(device_id, values, counts={reading["event_type"]: 1} if event_fields else None)
+        if event_fields:
+            # Update daily statistics only for real events
+            _update_daily_statistics(device_id, reading["event_type"], reading["occurred_at"])
+            bump_device_generations([device_id])
+        if event_fields or status_changes_listing({device_id: values}):
+            fleet_changed()
+    if event_fields:
+        recent_event_keys.add(event_fields["idempotency_key"])
+
+    # Create telemetry record
+    record = TelemetryRecord.objects.create(
+        device_id=device_id,
+        payload=build_record_payload(reading),
+    )
+
+    publish_status(device_id, values, timezone.now())
+    if event_fields:
+        publish_event(event_fields)
+
+    return record
+
 
 def _parse_timestamp(value):
     try:
@@ -189,36 +255,10 @@ def _parse_timestamp(value):
         return None
 
 def _update_daily_statistics(device_id, event_type, occurred_at):
-    """Update daily usage statistics"""
-    try:
-        date = occurred_at.date()
-        stats, created = UsageStatistics.objects.get_or_create(
-            device_id=device_id,
-            date=date,
-            defaults={
-                'first_event': occurred_at,
-                'last_event': occurred_at,
-            }
-        )
-        
-        if not created:
-            if not stats.first_event or occurred_at < stats.first_event:
-                stats.first_event = occurred_at
-            if not stats.last_event or occurred_at > stats.last_event:
-                stats.last_event = occurred_at
-        
-        # Update counts based on event type
-        if event_type == "BASIC":
-            stats.basic_count += 1
-        elif event_type == "STANDARD":
-            stats.standard_count += 1
-        elif event_type == "PREMIUM":
-            stats.premium_count += 1
-        
-        stats.total_events += 1
-        stats.save()
-    except Exception as e:
-        print(f"Error updating daily statistics: {e}")
+    """Update daily and hourly usage statistics"""
+    event = [(device_id, event_type, occurred_at)]
+    upsert_daily_statistics(daily_totals(event))
+    upsert_hourly_usage(hourly_totals(event))
 
 
 class TelemetryEventViewSet(mixins.ListModelMixin,
@@ -227,6 +267,7 @@ class TelemetryEventViewSet(mixins.ListModelMixin,
     queryset = TelemetryEvent.objects.all()
     serializer_class = TelemetryEventSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = EventPagination
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -246,7 +287,7 @@ class TelemetryEventViewSet(mixins.ListModelMixin,
         if exclude_status:
             qs = qs.exclude(event_type='status')
             
-        return qs.order_by('-occurred_at')
+        return qs.order_by('-occurred_at', '-id')
 
     @action(detail=False, methods=["get"], url_path="analytics")
     def analytics(self, request):
@@ -257,8 +298,24 @@ class TelemetryEventViewSet(mixins.ListModelMixin,
         if not device_id:
             return Response({"detail": "device_id required"}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Cached until a new event lands for the device, and at most until the
+        # hour turns so the window keeps sliding
+        generation, _ = current_version(device_counter(device_id))
+        now = timezone.now()
+        key = (device_id, days, generation, truncate_hour(now))
+        data = analytics_cache.get(key)
+        if data is None:
+            data = self._device_analytics(device_id, days, now)
+            analytics_cache.put(key, data)
+        return Response(data)
+
+    @action(detail=False, methods=["get"], url_path="analytics/cache-stats")
+    def analytics_cache_stats(self, request):
+        """Hit/miss/eviction counters of this process's analytics cache"""
+        return Response(analytics_cache.stats())
+
+    def _device_analytics(self, device_id, days, end_datetime):
         # Use consistent time range for both queries
-        end_datetime = timezone.now()
         start_datetime = end_datetime - timedelta(days=days)
         
         # Convert to dates for UsageStatistics (daily aggregated data)
@@ -311,9 +368,146 @@ class TelemetryEventViewSet(mixins.ListModelMixin,
             "daily_stats": UsageStatisticsSerializer(daily_stats, many=True).data,
             "recent_events": TelemetryEventSerializer(recent_events, many=True).data
         }
+        if days <= HOURLY_STATS_MAX_DAYS:
+            data["hourly_stats"] = _hourly_series([device_id], start_datetime, end_datetime)
         
+        return data
+
+
+    @action(detail=False, methods=["get"], url_path="fleet-analytics")
+    def fleet_analytics(self, request):
+        """Aggregated usage analytics for an outlet, a device list or the whole fleet.
+
+        Query params: ``outlet_id``, ``device_ids`` (comma separated) or neither
+        for all devices, plus ``days``. Runs a fixed number of grouped queries
+        regardless of how many devices are included.
+        """
+        days = int(request.query_params.get("days", 7))
+        scope, devices = _device_scope(request.query_params)
+
+        end_datetime = timezone.now()
+        start_datetime = end_datetime - timedelta(days=days)
+
+        daily_stats = UsageStatistics.objects.filter(
+            date__gte=start_datetime.date(),
+            date__lte=end_datetime.date()
+        )
+        recent_events = TelemetryEvent.objects.filter(
+            occurred_at__gte=start_datetime,
+            occurred_at__lte=end_datetime
+        ).exclude(event_type='status')
+
+        if devices is not None:
+            daily_stats = daily_stats.filter(device_id__in=devices)
+            recent_events = recent_events.filter(device_id__in=devices)
+
+        # One grouped query for the per-day series; totals are summed from it
+        daily = list(
+            daily_stats.values('date')
+            .annotate(
+                basic_count=Sum('basic_count'),
+                standard_count=Sum('standard_count'),
+                premium_count=Sum('premium_count'),
+                total_events=Sum('total_events'),
+                device_count=Count('device_id', distinct=True),
+                first_event=Min('first_event'),
+                last_event=Max('last_event')
+            )
+            .order_by('date')
+        )
+        totals = {"total": 0, "basic": 0, "standard": 0, "premium": 0}
+        for day in daily:
+            totals["total"] += day["total_events"] or 0
+            totals["basic"] += day["basic_count"] or 0
+            totals["standard"] += day["standard_count"] or 0
+            totals["premium"] += day["premium_count"] or 0
+
+        recent_events = recent_events.order_by('-occurred_at', '-id')[:50]
+
+        data = {
+            "device_id": scope,
+            "period": {
+                "start_date": start_datetime.isoformat(),
+                "end_date": end_datetime.isoformat(),
+                "days": days
+            },
+            "totals": totals,
+            "daily_stats": daily,
+            "recent_events": TelemetryEventSerializer(recent_events, many=True).data
+        }
+        if days <= HOURLY_STATS_MAX_DAYS:
+            data["hourly_stats"] = _hourly_series(devices, start_datetime, end_datetime)
+
         return Response(data)
 
+    @action(detail=False, methods=["get"], url_path="hourly")
+    def hourly(self, request):
+        """Hourly usage series from the HourlyUsage rollup.
+
+        Scope with ``device_id``, ``outlet_id`` or ``device_ids`` (all devices
+        if none is given) and a window of ``days`` (default 1). Never reads
+        raw events.
+        """
+        days = int(request.query_params.get("days", 1))
+        scope, devices = _device_scope(request.query_params)
+        end_datetime = timezone.now()
+        start_datetime = end_datetime - timedelta(days=days)
+        return Response({
+            "device_id": scope,
+            "period": {
+                "start_date": start_datetime.isoformat(),
+                "end_date": end_datetime.isoformat(),
+                "days": days
+            },
+            "series": _hourly_series(devices, start_datetime, end_datetime),
+        })
+
+
+# Analytics responses include an hourly series for windows up to this many days
+HOURLY_STATS_MAX_DAYS = 7
+
+
+def _device_scope(params):
+    """Resolve device_id / outlet_id / device_ids query params.
+
+    Returns ``(label, devices)`` where ``devices`` is a list or subquery of
+    device ids usable with ``device_id__in``, or None for all devices.
+    """
+    device_id = params.get("device_id")
+    outlet_id = params.get("outlet_id")
+    device_ids = params.get("device_ids")
+    if device_id:
+        return device_id, [device_id]
+    if outlet_id:
+        devices = MachineDevice.objects.filter(
+            machine__outlet_id=outlet_id,
+            is_active=True
+        ).values('device_id')
+        return f"outlet_{outlet_id}", devices
+    if device_ids:
+        return "devices", [d for d in device_ids.split(",") if d]
+    return "all_devices", None
+
+
+def _hourly_series(devices, start_datetime, end_datetime):
+    """Per-hour counts from HourlyUsage, summed over ``devices``"""
+    rows = HourlyUsage.objects.filter(
+        hour__gte=truncate_hour(start_datetime),
+        hour__lte=end_datetime
+    )
+    if devices is not None:
+        rows = rows.filter(device_id__in=devices)
+    return list(
+        rows.values('hour')
+        .annotate(
+            basic=Sum('count', filter=Q(event_type='BASIC')),
+            standard=Sum('count', filter=Q(event_type='STANDARD')),
+            premium=Sum('count', filter=Q(event_type='PREMIUM')),
+            total=Sum('count')
+        )
+        .order_by('hour')
+    )
+
 
 class DeviceStatusViewSet(mixins.ListModelMixin,
                          mixins.RetrieveModelMixin,
@@ -322,59 +516,198 @@ class DeviceStatusViewSet(mixins.ListModelMixin,
     serializer_class = DeviceStatusSerializer
     permission_classes = [permissions.AllowAny]
 
+    def list(self, request, *args, **kwargs):
+        return Response(_devices_by_last_seen(fleet_status.devices()))
+
     @action(detail=False, methods=["get"], url_path="online")
     def online_devices(self, request):
-        """Get list of online devices"""
-        recent_threshold = timezone.now() - timedelta(minutes=5)
-        online_devices = self.get_queryset().filter(last_seen__gte=recent_threshold)
-        return Response(DeviceStatusSerializer(online_devices, many=True).data)
+        """Get list of online devices (from the in-memory presence tracker)"""
+        def build():
+            online = presence.online()
+            online_devices = _devices_by_last_seen(fleet_status.get_many(list(online)).values())
+            # The list changes without any write once the first device drops offline
+            expires = min(online.values()) if online else None
+            return Response(online_devices), expires
+        return conditional_response(request, build)
+
+    @action(detail=False, methods=["get"], url_path="transitions")
+    def transitions(self, request):
+        """Recorded online/offline transitions, newest first.
+
+        Query params: ``device_id``, ``start``/``end`` (ISO datetimes) and
+        ``limit`` (default 100, max 1000).
+        """
+        rows = PresenceTransition.objects.all()
+        if request.GET.get("device_id"):
+            rows = rows.filter(device_id=request.GET["device_id"])
+        for param, lookup in (("start", "occurred_at__gte"), ("end", "occurred_at__lt")):
+            if request.GET.get(param):
+                value = parse_datetime(request.GET[param])
+                if value is None:
+                    return Response({"detail": f"{param} must be an ISO datetime"}, status=status.HTTP_400_BAD_REQUEST)
+                rows = rows.filter(**{lookup: value})
+        try:
+            limit = min(int(request.GET.get("limit", 100)), 1000)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(list(rows.values("device_id", "online", "occurred_at", "last_seen")[:limit]))
 
     @action(detail=False, methods=["get"], url_path="all")
     def all_devices(self, request):
         """Get list of all devices (online and offline)"""
-        all_devices = self.get_queryset().order_by('-last_seen')
-        return Response(DeviceStatusSerializer(all_devices, many=True).data)
+        def build():
+            return Response(_devices_by_last_seen(fleet_status.devices())), None
+        return conditional_response(request, build)
+
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        """Hit/miss counters of this process's fleet status snapshot"""
+        return Response(fleet_status.stats())
+
+
+def _devices_by_last_seen(devices):
+    # Snapshot entries are serialized DeviceStatus dicts
+    return sorted(devices, key=lambda d: parse_datetime(d["last_seen"]), reverse=True)
+
+
+async def live_stream(request):
+    """Server-sent events with status deltas, new events and presence changes.
+
+    Query params: ``device_id``, ``outlet_id`` or ``device_ids`` (default: all
+    devices) and ``types`` (comma separated subset of status, event,
+    presence). Only available when served over ASGI.
+    """
+    if not hasattr(request, "scope"):
+        return JsonResponse({"detail": "live updates require an ASGI server"}, status=501)
+    _, devices = _device_scope(request.GET)
+    if devices is not None and not isinstance(devices, list):
+        # An outlet resolves to its active devices when the stream opens
+        devices = await sync_to_async(list)(devices.values_list("device_id", flat=True))
+    kinds = [kind for kind in request.GET.get("types", "").split(",") if kind in LIVE_KINDS]
+
+    subscription = live_hub.subscribe(devices, kinds)
+    response = StreamingHttpResponse(_sse_messages(subscription), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+    return response
+
+
+async def _sse_messages(subscription):
+    keepalive = getattr(settings, "LIVE_KEEPALIVE_SECONDS", 15)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            message = await subscription.get(keepalive)
+            if subscription.lagged:
+                # Messages were dropped; the client should refetch its state
+                subscription.lagged = False
+                yield "event: resync\ndata: {}\n\n"
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            seq, kind, body = message
+            yield f"id: {seq}\nevent: {kind}\ndata: {body}\n\n"
+    finally:
+        live_hub.unsubscribe(subscription)
+
+
+@require_GET
+def metrics(request):
+    """Prometheus scrape endpoint (text exposition format)"""
+    return HttpResponse(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api_view(["GET"])
+@permission_classes([permissions.AllowAny])
+def profiles(request):
+    """Slowest captured profiles (``PROFILING_ENABLED``).
+
+    Query params: ``kind`` (http or mqtt) and ``limit`` (default 20, max 200).
+    """
+    if not profiling_enabled():
+        return Response({"detail": "profiling is disabled"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        limit = min(int(request.GET.get("limit", 20)), 200)
+    except ValueError:
+        return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(profile_store.slowest(request.GET.get("kind"), limit))
+
+
+@api_view(["GET"])
+@permission_classes([permissions.AllowAny])
+def profile_detail(request, profile_id):
+    """One capture with its SQL and function breakdown; ``download=1`` returns the cProfile file"""
+    if not profiling_enabled():
+        return Response({"detail": "profiling is disabled"}, status=status.HTTP_404_NOT_FOUND)
+    if request.GET.get("download") == "1":
+        path = profile_store.cprofile_path(profile_id)
+        if path is None:
+            return Response({"detail": "not found"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=path.name)
+    record = profile_store.get(profile_id)
+    if record is None:
+        return Response({"detail": "not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(record)
 
 
 @api_view(["GET"])
 @permission_classes([permissions.AllowAny])
 def export_data(request):
-    """Export telemetry data as CSV"""
-    device_id = request.query_params.get("device_id")
+    """Export telemetry data as CSV.
+
+    Scope with ``device_id``, ``outlet_id`` or ``device_ids`` (comma separated).
+    Rows are streamed in chunks so memory stays flat regardless of row count;
+    ``compress=gzip`` compresses the stream on the fly.
+    """
     days = int(request.query_params.get("days", 30))
+    compress = request.query_params.get("compress")
+    scope, devices = export_scope(request.query_params)
     
-    if not device_id:
-        return Response({"detail": "device_id required"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    end_date = timezone.now()
-    start_date = end_date - timedelta(days=days)
-    
-    events = TelemetryEvent.objects.filter(
-        device_id=device_id,
-        occurred_at__gte=start_date,
-        occurred_at__lte=end_date
-    ).order_by('occurred_at')
+    if devices is None:
+        return Response({"detail": "device_id, outlet_id or device_ids required"}, status=status.HTTP_400_BAD_REQUEST)
     
-    import csv
-    from django.http import HttpResponse
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="telemetry_{device_id}_{start_date.date()}_to_{end_date.date()}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Timestamp', 'Device Timestamp', 'Event Type', 'Basic Count', 'Standard Count', 'Premium Count', 'WiFi Status'])
-    
-    for event in events:
-        writer.writerow([
-            event.occurred_at.isoformat(),
-            event.device_timestamp or '',
-            event.event_type,
-            event.count_basic or 0,
-            event.count_standard or 0,
-            event.count_premium or 0,
-            'Connected' if event.wifi_status else 'Disconnected'
-        ])
+    events, start_date, end_date = export_events(devices, days)
+    chunks = stream_events_csv(events, include_device=not request.query_params.get("device_id"))
+    filename = f"telemetry_{scope}_{start_date.date()}_to_{end_date.date()}.csv"
     
+    if compress == "gzip":
+        response = StreamingHttpResponse(gzip_stream(chunks), content_type='application/gzip')
+        filename += ".gz"
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([permissions.AllowAny])
+def export_columnar(request):
+    """Export events or daily statistics as Parquet or an Arrow IPC stream.
+
+    Query params: ``table`` (events|daily), ``output`` (parquet|arrow; not
+    ``format``, which DRF reserves for renderer selection), optional ``device_id``/``outlet_id``/``device_ids`` and either
+    ``start``/``end`` (ISO dates) or ``days``. Requires pyarrow.
+    """
+    table = request.query_params.get("table", "events")
+    fmt = request.query_params.get("output", "parquet")
+    if table not in COLUMNAR_TABLES:
+        return Response({"detail": f"table must be one of {', '.join(COLUMNAR_TABLES)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if fmt not in COLUMNAR_FORMATS:
+        return Response({"detail": f"output must be one of {', '.join(COLUMNAR_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not pyarrow_available():
+        return Response({"detail": "pyarrow is not installed"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    try:
+        start_date, end_date = parse_export_range(request.query_params)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    scope, devices = export_scope(request.query_params)
+    rows = columnar_rows(table, devices, start_date, end_date)
+    content_type, extension = COLUMNAR_FORMATS[fmt]
+    response = StreamingHttpResponse(stream_columnar(rows, table, fmt), content_type=content_type)
+    response['Content-Disposition'] = (
+        f'attachment; filename="{table}_{scope or "all_devices"}_{start_date.date()}_to_{end_date.date()}.{extension}"'
+    )
     return response
 
 
@@ -383,37 +716,28 @@ def export_data(request):
 def flush_all_data(request):
     """Dangerous: wipe all telemetry tables. Intended for admin/testing via UI button.
 
-    Deletes TelemetryEvent, TelemetryRecord, UsageStatistics, and DeviceStatus.
+    Deletes TelemetryEvent, TelemetryRecord, UsageStatistics, HourlyUsage, and DeviceStatus.
+    Rows are deleted in short batches so ingest is not locked out for the whole wipe;
+    each batch bumps its devices' event generations, so other workers drop their
+    cached analytics too.
     """
     try:
-        with transaction.atomic():
-            TelemetryEvent.objects.all().delete()
-            TelemetryRecord.objects.all().delete()
-            UsageStatistics.objects.all().delete()
-            DeviceStatus.objects.all().delete()
-        return Response({"status": "flushed"})
+        deleted = {table: purge(table, pause=0) for table in PURGE_TABLES}
+        deleted["devices"] = DeviceStatus.objects.all().delete()[0]
+        fleet_status.clear()
+        analytics_cache.clear()
+        recent_event_keys.clear()
+        fleet_changed()
+        return Response({"status": "flushed", "deleted": deleted})
     except Exception as e:
         return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def _safe_number(value):
-    try:
-        if value is None:
-            return None
-        # try int first, then float
-        iv = int(str(value))
-        return iv
-    except Exception:
-        try:
-            fv = float(str(value))
-            return fv
-        except Exception:
-            return None
-
-
 class OutletViewSet(viewsets.ModelViewSet):
     """CRUD operations for Outlets"""
-    queryset = Outlet.objects.all()
+    queryset = Outlet.objects.annotate(
+        active_machine_count=Count('machines', filter=Q(machines__is_active=True))
+    )
     serializer_class = OutletSerializer
     permission_classes = [permissions.AllowAny]
     
@@ -427,7 +751,7 @@ class OutletViewSet(viewsets.ModelViewSet):
 
 class MachineViewSet(viewsets.ModelViewSet):
     """CRUD operations for Machines"""
-    queryset = Machine.objects.select_related('outlet').all()
+    queryset = Machine.objects.select_related('outlet').prefetch_related('devices')
     serializer_class = MachineSerializer
     permission_classes = [permissions.AllowAny]
     
@@ -445,12 +769,16 @@ class MachineViewSet(viewsets.ModelViewSet):
             # Filter by current device_id
             qs = qs.filter(devices__device_id=device_id, devices__is_active=True)
         return qs
+
+    def list(self, request, *args, **kwargs):
+        full_list = super().list
+        return conditional_response(request, lambda: (full_list(request, *args, **kwargs), None))
     
     @action(detail=False, methods=["get"], url_path="unregistered")
     def unregistered_devices(self, request):
         """Get devices that have telemetry data but are not registered as machines"""
-        registered_device_ids = set(MachineDevice.objects.values_list('device_id', flat=True))
-        unregistered_devices = DeviceStatus.objects.exclude(device_id__in=registered_device_ids)
+        registered = MachineDevice.objects.filter(device_id=OuterRef('device_id'))
+        unregistered_devices = DeviceStatus.objects.filter(~Exists(registered))
         return Response(DeviceStatusSerializer(unregistered_devices, many=True).data)
     
     @action(detail=False, methods=["post"], url_path="register")
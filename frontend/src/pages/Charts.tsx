@@ -87,6 +87,13 @@ interface Analytics {
     device_id?: string;
     device?: string;
   }>;
+  hourly_stats?: Array<{
+    hour: string;
+    basic: number | null;
+    standard: number | null;
+    premium: number | null;
+    total: number;
+  }>;
 }
 
 type Period = 'day' | 'week' | 'month' | 'year' | 'custom';
@@ -316,122 +323,20 @@ const Charts: React.FC = () => {
         return
       }
 
-      // Fetch analytics for all filtered devices and aggregate them
-      const analyticsPromises = filteredDevices.map(device => 
-        api.get('/events/analytics/', { params: { device_id: device.device_id, days } })
-      )
-      
-      const responses = await Promise.all(analyticsPromises)
-      
-      // Aggregate the data
+      // Aggregated server-side in a fixed number of queries
+      const scope = viewMode === 'outlet' && selectedOutlet ? { outlet_id: selectedOutlet } : {}
+      const res = await api.get('/events/fleet-analytics/', { params: { ...scope, days } })
       const aggregatedData = {
-        device_id: viewMode === 'outlet' && selectedOutlet 
-          ? `outlet_${selectedOutlet}` 
+        ...res.data,
+        device_id: viewMode === 'outlet' && selectedOutlet
+          ? `outlet_${selectedOutlet}`
           : 'all_devices',
-        period: {
-          start_date: responses[0]?.data?.period?.start_date || '',
-          end_date: responses[0]?.data?.period?.end_date || '',
-          days: days
-        },
-        totals: {
-          total: 0,
-          basic: 0,
-          standard: 0,
-          premium: 0
-        },
-        daily_stats: [] as Array<{
-          date: string;
-          basic_count: number;
-          standard_count: number;
-          premium_count: number;
-          total_events: number;
-        }>,
-        recent_events: [] as Array<{
-          event_type: string;
-          occurred_at: string;
-          device_timestamp: string;
-          count_basic: number;
-          count_standard: number;
-          count_premium: number;
-          device_id?: string;
-          device?: string;
-        }>
+        recent_events: res.data.recent_events.map((event: { device_id: string }) => ({
+          ...event,
+          device: event.device_id // Add both for compatibility
+        }))
       }
 
-      // Aggregate totals
-      responses.forEach(response => {
-        if (response.data?.totals) {
-          aggregatedData.totals.total += response.data.totals.total || 0
-          aggregatedData.totals.basic += response.data.totals.basic || 0
-          aggregatedData.totals.standard += response.data.totals.standard || 0
-          aggregatedData.totals.premium += response.data.totals.premium || 0
-        }
-      })
-
-      // Aggregate daily stats by date
-      const dailyStatsMap = new Map()
-      responses.forEach(response => {
-        if (response.data?.daily_stats) {
-          response.data.daily_stats.forEach((stat: {
-            date: string;
-            basic_count: number;
-            standard_count: number;
-            premium_count: number;
-            total_events: number;
-          }) => {
-            const existing = dailyStatsMap.get(stat.date) || {
-              date: stat.date,
-              basic_count: 0,
-              standard_count: 0,
-              premium_count: 0,
-              total_events: 0
-            }
-            existing.basic_count += stat.basic_count || 0
-            existing.standard_count += stat.standard_count || 0
-            existing.premium_count += stat.premium_count || 0
-            existing.total_events += stat.total_events || 0
-            dailyStatsMap.set(stat.date, existing)
-          })
-        }
-      })
-      aggregatedData.daily_stats = Array.from(dailyStatsMap.values()).sort((a, b) => 
-        new Date(a.date).getTime() - new Date(b.date).getTime()
-      )
-
-      // Aggregate recent events (limit to 50 most recent)
-      const allRecentEvents: Array<{
-        event_type: string;
-        occurred_at: string;
-        device_timestamp: string;
-        count_basic: number;
-        count_standard: number;
-        count_premium: number;
-        device_id?: string;
-        device?: string;
-      }> = []
-      responses.forEach((response, index) => {
-        if (response.data?.recent_events) {
-          // Preserve device_id information from the original device
-          const deviceId = filteredDevices[index]?.device_id
-          const eventsWithDeviceId = response.data.recent_events.map((event: {
-            event_type: string;
-            occurred_at: string;
-            device_timestamp: string;
-            count_basic: number;
-            count_standard: number;
-            count_premium: number;
-          }) => ({
-            ...event,
-            device_id: deviceId,
-            device: deviceId // Add both for compatibility
-          }))
-          allRecentEvents.push(...eventsWithDeviceId)
-        }
-      })
-      aggregatedData.recent_events = allRecentEvents
-        .sort((a, b) => new Date(b.occurred_at).getTime() - new Date(a.occurred_at).getTime())
-        .slice(0, 50)
-
       setAnalytics(aggregatedData)
     } catch {
       console.error('Failed to fetch aggregated analytics')
@@ -508,6 +413,17 @@ const Charts: React.FC = () => {
     if (period === 'day') {
       // 24 hourly buckets 00:00..23:00
       const buckets = Array.from({ length: 24 }, (_, h) => ({ label: `${String(h).padStart(2, '0')}:00`, Total: 0, Basic: 0, Standard: 0, Premium: 0 }))
+      if (analytics.hourly_stats) {
+        // Server-side hourly rollup covers every event, not just the recent ones
+        analytics.hourly_stats.forEach(h => {
+          const hour = parseISO(h.hour).getHours()
+          buckets[hour].Total += h.total || 0
+          buckets[hour].Basic += h.basic || 0
+          buckets[hour].Standard += h.standard || 0
+          buckets[hour].Premium += h.premium || 0
+        })
+        return buckets
+      }
       const events = analytics.recent_events || []
       events.forEach(e => {
         const dt = parseISO(e.occurred_at)
@@ -1,4 +1,4 @@
-import { useEffect, useState, useCallback, Fragment } from 'react'
+import { useEffect, useState, useCallback, useRef, Fragment } from 'react'
 import axios from 'axios'
 import { format, parseISO, startOfWeek, addDays, isSameDay, startOfMonth, endOfMonth, differenceInCalendarDays, startOfYear, addMonths } from 'date-fns'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, PieChart, Pie, Cell } from 'recharts'
@@ -26,6 +26,7 @@ interface AnalyticsData {
   totals: { total: number; basic: number; standard: number; premium: number }
   daily_stats: Array<{ date: string; basic_count: number; standard_count: number; premium_count: number; total_events: number }>
   recent_events: Array<{ event_type: string; occurred_at: string; device_timestamp: string; count_basic: number; count_standard: number; count_premium: number }>
+  hourly_stats?: Array<{ hour: string; basic: number | null; standard: number | null; premium: number | null; total: number }>
 }
 
 interface RecentEvent {
@@ -38,14 +39,6 @@ interface RecentEvent {
   count_premium: number
 }
 
-interface DailyStat {
-  date: string
-  basic_count: number
-  standard_count: number
-  premium_count: number
-  total_events: number
-}
-
 interface Outlet {
   id: number
   name: string
@@ -198,78 +191,16 @@ export default function Dashboard() {
         return
       }
 
-      // Fetch analytics for all filtered devices and aggregate them
-      const analyticsPromises = filteredDevices.map(device => 
-        api.get('/events/analytics/', { params: { device_id: device.device_id, days } })
-      )
-      
-      const responses = await Promise.all(analyticsPromises)
-      
-      // Aggregate the data
+      // Aggregated server-side in a fixed number of queries
+      const scope = viewMode === 'outlet' && selectedOutlet ? { outlet_id: selectedOutlet } : {}
+      const res = await api.get('/events/fleet-analytics/', { params: { ...scope, days } })
       const aggregatedData = {
-        device_id: viewMode === 'outlet' && selectedOutlet 
-          ? `outlet_${selectedOutlet}` 
-          : 'all_devices',
-        period: {
-          start_date: responses[0]?.data?.period?.start_date || '',
-          end_date: responses[0]?.data?.period?.end_date || '',
-          days: days
-        },
-        totals: {
-          total: 0,
-          basic: 0,
-          standard: 0,
-          premium: 0
-        },
-        daily_stats: [] as DailyStat[],
-        recent_events: [] as RecentEvent[]
+        ...res.data,
+        device_id: viewMode === 'outlet' && selectedOutlet
+          ? `outlet_${selectedOutlet}`
+          : 'all_devices'
       }
 
-      // Aggregate totals
-      responses.forEach(response => {
-        if (response.data?.totals) {
-          aggregatedData.totals.total += response.data.totals.total || 0
-          aggregatedData.totals.basic += response.data.totals.basic || 0
-          aggregatedData.totals.standard += response.data.totals.standard || 0
-          aggregatedData.totals.premium += response.data.totals.premium || 0
-        }
-      })
-
-      // Aggregate daily stats by date
-      const dailyStatsMap = new Map()
-      responses.forEach(response => {
-        if (response.data?.daily_stats) {
-          response.data.daily_stats.forEach((stat: DailyStat) => {
-            const existing = dailyStatsMap.get(stat.date) || {
-              date: stat.date,
-              basic_count: 0,
-              standard_count: 0,
-              premium_count: 0,
-              total_events: 0
-            }
-            existing.basic_count += stat.basic_count || 0
-            existing.standard_count += stat.standard_count || 0
-            existing.premium_count += stat.premium_count || 0
-            existing.total_events += stat.total_events || 0
-            dailyStatsMap.set(stat.date, existing)
-          })
-        }
-      })
-      aggregatedData.daily_stats = Array.from(dailyStatsMap.values()).sort((a, b) => 
-        new Date(a.date).getTime() - new Date(b.date).getTime()
-      )
-
-      // Aggregate recent events (limit to 50 most recent)
-      const allRecentEvents: RecentEvent[] = []
-      responses.forEach(response => {
-        if (response.data?.recent_events) {
-          allRecentEvents.push(...response.data.recent_events)
-        }
-      })
-      aggregatedData.recent_events = allRecentEvents
-        .sort((a, b) => new Date(b.occurred_at).getTime() - new Date(a.occurred_at).getTime())
-        .slice(0, 50)
-
       setAnalytics(aggregatedData)
     } catch {
       setError('Failed to fetch aggregated analytics')
@@ -299,17 +230,52 @@ export default function Dashboard() {
     } catch { setError('Failed to flush database') }
   }
 
+  // Polling is only a fallback for when the live stream is down
+  const liveConnected = useRef(false)
+  // Latest fetchers, so the live stream is not reopened when they change
+  const refetch = useRef({ fetchDevices, fetchMachines })
+  refetch.current = { fetchDevices, fetchMachines }
+
   useEffect(() => {
     fetchDevices()
     fetchOutlets()
     fetchMachines()
     const interval = setInterval(() => {
+      if (liveConnected.current) return
       fetchDevices()
       fetchMachines()
     }, 30000)
     return () => clearInterval(interval)
   }, [fetchDevices, fetchOutlets, fetchMachines])
 
+  useEffect(() => {
+    const source = new EventSource(`${api.defaults.baseURL}/live/`)
+    source.onopen = () => { liveConnected.current = true }
+    source.onerror = () => { liveConnected.current = false }
+    source.addEventListener('status', (e) => {
+      const delta = JSON.parse((e as MessageEvent).data) as Partial<DeviceStatus> & { device_id: string }
+      setDevices(prev => {
+        if (!prev.some(d => d.device_id === delta.device_id)) {
+          refetch.current.fetchDevices()
+          return prev
+        }
+        return prev.map(d => d.device_id === delta.device_id ? { ...d, ...delta } : d)
+      })
+    })
+    source.addEventListener('event', (e) => {
+      const event = JSON.parse((e as MessageEvent).data) as RecentEvent
+      const field = `current_count_${event.event_type.toLowerCase()}` as 'current_count_basic' | 'current_count_standard' | 'current_count_premium'
+      setDevices(prev => prev.map(d => d.device_id === event.device_id ? { ...d, [field]: (d[field] || 0) + 1 } : d))
+      setAllRecentEvents(prev => [event, ...prev].slice(0, 50))
+    })
+    // The server dropped messages for this stream; reload the full state
+    source.addEventListener('resync', () => {
+      refetch.current.fetchDevices()
+      refetch.current.fetchMachines()
+    })
+    return () => source.close()
+  }, [])
+
   useEffect(() => { 
     fetchAggregatedAnalytics() 
   }, [fetchAggregatedAnalytics])
@@ -326,6 +292,17 @@ export default function Dashboard() {
     if (period === 'day') {
       // 24 hourly buckets 00:00..23:00
       const buckets = Array.from({ length: 24 }, (_, h) => ({ label: `${String(h).padStart(2, '0')}:00`, Total: 0, Basic: 0, Standard: 0, Premium: 0 }))
+      if (analytics.hourly_stats) {
+        // Server-side hourly rollup covers every event, not just the recent ones
+        analytics.hourly_stats.forEach(h => {
+          const hour = parseISO(h.hour).getHours()
+          buckets[hour].Total += h.total || 0
+          buckets[hour].Basic += h.basic || 0
+          buckets[hour].Standard += h.standard || 0
+          buckets[hour].Premium += h.premium || 0
+        })
+        return buckets
+      }
       const events = analytics.recent_events || []
       events.forEach(e => {
         const dt = parseISO(e.occurred_at)